@@ -10,13 +10,16 @@ import random
 import numpy as np
 import datetime
 import shutil
-import string
 
 from typing import List
 from pathlib import Path
 from urllib.parse import urlparse
 from glob import glob
 
+# The JSON-SEQ reader is shared with the analysis scripts
+sys.path.append(str(Path.joinpath(Path(__file__).parent.parent.absolute(), 'analysis')))
+from qlog import iter_json_seq
+
 DOCKER_CONFIG = {}
 with open(Path.joinpath(Path(__file__).parent.absolute(), 'docker.json'), mode='r') as f:
     DOCKER_CONFIG = json.load(f)
@@ -217,22 +220,10 @@ def run_subprocess(client: str, url: str, dirpath: str, i: int, log: bool) -> di
             time.sleep(1)
             process.kill()
             time.sleep(1)
-            tshark_output = subprocess.run([
-                'tshark',
-                '-r',
-                Path.joinpath(TMP_PCAP, 'out.pcapng'),
-                '-T',
-                'json',
-                '-o',
-                f'tls.keylog_file: {Path.joinpath(TMP_DIR, "sslkeylog")}',
-                '-j',
-                "Timestamps tcp tcp.flags http2 http2.stream"
-            ], capture_output=True)
-
-            with open(Path.joinpath(dirpath, f'{client}_{i}.json'), mode='w') as f:
-                json.dump(json.loads(tshark_output.stdout.decode()), f)
-
-            result = process_pcap(Path.joinpath(dirpath, f'{client}_{i}.json'))
+            decode_pcap(Path.joinpath(TMP_PCAP, 'out.pcapng'),
+                        Path.joinpath(dirpath, f'{client}_{i}.npz'))
+
+            result = process_pcap(Path.joinpath(dirpath, f'{client}_{i}.npz'))
 
         out_arr = output.stdout.decode().split('\n')[:-1]
         dns_time = float(out_arr[0].split(':')[1])
@@ -353,23 +344,10 @@ def run_docker(client: str, url: str, dirpath: str, i: int) -> float:
         # process = record_pcap(url_host)
         process.kill()
         time.sleep(1)
-        tshark_output = subprocess.run([
-            'tshark',
-            '-r',
-            Path.joinpath(TMP_PCAP, 'out.pcapng'),
-            '-T',
-            'json',
-            '-o',
-            f'tls.keylog_file: {Path.joinpath(TMP_DIR, "sslkeylog")}',
-            '-j',
-            "Timestamps tcp tcp.flags http2 http2.stream"
-        ], capture_output=True)
-        
-        print("r->",tshark_output.stderr)
-        with open(Path.joinpath(dirpath, f'{client}_{i}.json'), mode='w') as f:
-            json.dump(json.loads(tshark_output.stdout.decode()), f)
-
-        result = process_pcap(Path.joinpath(dirpath, f'{client}_{i}.json'))
+        decode_pcap(Path.joinpath(TMP_PCAP, 'out.pcapng'),
+                    Path.joinpath(dirpath, f'{client}_{i}.npz'))
+
+        result = process_pcap(Path.joinpath(dirpath, f'{client}_{i}.npz'))
         os.remove(Path.joinpath(TMP_PCAP, 'out.pcapng'))
         # out_arr = output.stdout.decode().split('\n')[:-1]
         # dns_time = float(out_arr[0].split(':')[1])
@@ -486,10 +464,10 @@ def process_qlog(qlog: str) -> dict:
         }
 
 def process_sqlog(qlog: str) -> dict:
-    with open(qlog, mode='r') as f:
-        data = f.read().split("\n")
-        data = list(map(lambda x: json.loads("".join(filter(lambda x: x in string.printable, x))) if len(x) > 0 and "{" in x else {}, data))
-        events = data[1:]
+    with open(qlog, mode='rb') as f:
+        # The first record is the trace header
+        events = iter_json_seq(f)
+        next(events, None)
         time_units = 'ms'
 
         fin = False
@@ -545,11 +523,60 @@ def process_sqlog(qlog: str) -> dict:
                             init_cwnd_mss += 1
                             init_cwnd_bytes += length
 
-        return {
-            'time': (end - start) / 1000,
-            'init_cwnd_mss': init_cwnd_mss,
-            'init_cwnd_bytes': init_cwnd_bytes
-        }
+    return {
+        'time': (end - start) / 1000,
+        'init_cwnd_mss': init_cwnd_mss,
+        'init_cwnd_bytes': init_cwnd_bytes
+    }
+
+
+# tshark fields process_pcap reads, streamed instead of a full JSON export
+PCAP_FIELDS = [
+    ('tcp.time_relative', 'time', np.float64),
+    ('tcp.srcport', 'srcport', np.int32),
+    ('tcp.len', 'len', np.int64),
+]
+
+
+def decode_pcap(pcap: str, output: str):
+    command = ['tshark', '-r', str(pcap), '-n', '-Y', 'tcp',
+               '-o', 'tcp.calculate_timestamps:TRUE',
+               '-o', f'tls.keylog_file:{Path.joinpath(TMP_DIR, "sslkeylog")}',
+               '-T', 'fields', '-E', 'separator=/t', '-E', 'occurrence=a', '-E', 'aggregator=,']
+    for field, _, _ in PCAP_FIELDS:
+        command += ['-e', field]
+    command += ['-e', 'http2.streamid']
+
+    columns = {column: [] for _, column, _ in PCAP_FIELDS}
+    streams = []
+    index = [0]
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        values = line.rstrip('\r\n').split('\t')
+        if len(values) < len(PCAP_FIELDS) + 1:
+            continue
+
+        values = [x.split(',')[0] for x in values[:len(PCAP_FIELDS)]] + values[len(PCAP_FIELDS):]
+        # A packet without a time cannot be placed, e.g. the last one of a truncated capture
+        if any([value == '' for (_, _, dtype), value in zip(PCAP_FIELDS, values) if dtype is np.float64]):
+            continue
+
+        for (_, column, dtype), value in zip(PCAP_FIELDS, values):
+            columns[column].append(float(value) if dtype is np.float64 else int(value or -1))
+
+        # Stream ids of every HTTP/2 frame in the packet
+        streams += [int(x) for x in values[-1].split(',') if x]
+        index.append(len(streams))
+    _, stderr = process.communicate()
+
+    if process.returncode != 0:
+        raise Exception('tshark failed on {}: {}'.format(pcap, stderr.strip()))
+
+    np.savez_compressed(output,
+                        http2_stream=np.array(streams, dtype=np.int64),
+                        http2_stream_index=np.array(index, dtype=np.int64),
+                        **{column: np.array(columns[column], dtype=dtype) for _, column, dtype in PCAP_FIELDS})
 
 
 def process_pcap(pcap: str) -> float:
@@ -560,55 +587,47 @@ def process_pcap(pcap: str) -> float:
     elif str(pcap).count('delay-100ms') > 0:
         delay = 100
 
-    with open(pcap, mode='r') as f:
-        data = json.load(f)
-
-        start = None
-        init_rtt = None
-
-        h2_headers_received = False
-        first_data_pkt_time = None
-        init_cwnd_mss = 0
-        init_cwnd_bytes = 0
+    with np.load(pcap) as data:
+        packets = {key: data[key] for key in data.files}
 
-        # Associate each ACK offset with a timestamp
-        for packet in data:
-            tcp = packet['_source']['layers']['tcp']
-            h2 = packet['_source']['layers'].get('http2', {})
-            srcport = tcp['tcp.srcport']
-            time = float(tcp['Timestamps']['tcp.time_relative']) * 1000
+    start = None
+    init_rtt = None
 
-            if srcport != '443' and start is None:
-                start = time
+    h2_headers_received = False
+    first_data_pkt_time = None
+    init_cwnd_mss = 0
+    init_cwnd_bytes = 0
 
-            if start is None:
-                continue
+    # Associate each ACK offset with a timestamp
+    for i, (srcport, time, bytes_len) in enumerate(zip(
+            *[packets[x].tolist() for x in ['srcport', 'time', 'len']])):
+        time = time * 1000
 
-            # receive packet
-            if srcport == '443':
-                if init_rtt is None:
-                    init_rtt = time - start + delay
+        if srcport != 443 and start is None:
+            start = time
 
-                if not isinstance(h2, dict):
-                    continue
+        if start is None:
+            continue
 
-                stream_id = h2.get('http2.stream', {}).get(
-                    'http2.streamid', None)
+        # receive packet
+        if srcport == 443:
+            if init_rtt is None:
+                init_rtt = time - start + delay
 
-                # Find packet received with h2 headers. All packets received after that are data packets
-                if not h2_headers_received:
-                    if stream_id == '1':
-                        h2_headers_received = True
-                    continue
+            streams = packets['http2_stream'][packets['http2_stream_index'][i]:packets['http2_stream_index'][i + 1]]
 
-                if first_data_pkt_time is None:
-                    first_data_pkt_time = time
+            # Find packet received with h2 headers. All packets received after that are data packets
+            if not h2_headers_received:
+                if 1 in streams:
+                    h2_headers_received = True
+                continue
 
-                bytes_len = int(tcp['tcp.len'])
+            if first_data_pkt_time is None:
+                first_data_pkt_time = time
 
-                if time <= first_data_pkt_time + init_rtt:
-                    init_cwnd_mss += 1
-                    init_cwnd_bytes += bytes_len
+            if time <= first_data_pkt_time + init_rtt:
+                init_cwnd_mss += 1
+                init_cwnd_bytes += bytes_len
 
     return {
         'init_cwnd_mss': init_cwnd_mss,
@@ -1,6 +1,5 @@
 import argparse
 import sys
-import json
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
@@ -8,9 +7,12 @@ import os
 import math
 
 from matplotlib.ticker import StrMethodFormatter
-from collections import deque, OrderedDict
+from collections import deque
 from pathlib import Path
-from glob import glob
+from netlog import NetlogReader, netlog_files
+from artifact import open_artifact, artifact_files
+from pcap import load_packets, packet_values, pcap_files
+from qlog import parse_qlog, since_start, started, stream_acks, max_acked, to_ms, SENT, RECEIVED, MISSING
 
 BLUE = deque(['#0000FF', '#0000B3', '#0081B3',
               '#14293D', '#A7DFE2', '#8ED9CD'])
@@ -26,26 +28,6 @@ YELLOW = deque(['#FFFF00', '#DCFF20', '#DCC05A'])
 PURPLE = deque(['#6A00CD', '#A100CD', '#7653DE'])
 
 
-def make_unique(key, dct):
-    counter = 0
-    unique_key = key
-
-    while unique_key in dct:
-        counter += 1
-        unique_key = '{}_{}'.format(key, counter)
-    return unique_key
-
-
-def parse_object_pairs(pairs):
-    dct = OrderedDict()
-    for key, value in pairs:
-        if key in dct:
-            key = make_unique(key, dct)
-        dct[key] = value
-
-    return dct
-
-
 def merge(intervals):
     intervals.sort()
 
@@ -59,6 +41,11 @@ def merge(intervals):
     return result
 
 
+# Columns analyze_pcap walks, in the order they are unpacked
+PACKET_COLUMNS = ['srcport', 'time', 'fin', 'syn', 'initial_rtt', 'acks_frame', 'ack_rtt',
+                  'seq', 'len', 'ack', 'window_size']
+
+
 def analyze_pcap(filename: str) -> (dict, str):
     ack_ts = {}
     rx_ts = {}
@@ -80,132 +67,114 @@ def analyze_pcap(filename: str) -> (dict, str):
     else:
         delay = 0
 
-    with open(filename) as f:
-        decoder = json.JSONDecoder(object_pairs_hook=parse_object_pairs)
+    packets = load_packets(filename)
 
-        data = decoder.decode(f.read())
+    prev_ack = (0, None)
+    lost_packet = None
+    lost_time = None
+    num_lost = 0
+    start_data_time = None
+    sack_segs = []
 
-        prev_ack = (0, None)
-        lost_packet = None
-        lost_time = None
-        num_lost = 0
-        start_data_time = None
-        sack_segs = []
+    fin = False
+    prev_seq = 0
 
-        fin = False
-        prev_seq = 0
+    # Associate each ACK offset with a timestamp
+    for i, (srcport, time, fin_flag, syn_flag, init_rtt, acks_frame, ack_rtt, seq, length, ack, window_size) in enumerate(zip(
+            *[packets[x].tolist() for x in PACKET_COLUMNS])):
+        time = time * 1000
 
-        # Associate each ACK offset with a timestamp
-        for packet in data:
-            tcp = packet['_source']['layers']['tcp']
-            srcport = tcp['tcp.srcport']
-            time = float(tcp['Timestamps']['tcp.time_relative']) * 1000
+        if fin_flag == 1:
+            fin = True
 
-            if tcp['tcp.flags_tree']['tcp.flags.fin'] == '1':
-                fin = True
+        if not math.isnan(init_rtt):
+            initial_rtt = init_rtt
+
+        if acks_frame == 4:
+            second_rtt = ack_rtt
+
+        # receive packet
+        if srcport == 443:
+            if length == 1376 and seq >= 3000:
+                if start_data_time is None:
+                    start_data_time = time
 
-            init_rtt = tcp.get('tcp.analysis', {}).get(
-                'tcp.analysis.initial_rtt')
-            if init_rtt is not None:
-                initial_rtt = float(init_rtt)
+                min_rtt = min(initial_rtt, second_rtt) * 1000
 
-            if tcp.get("tcp.analysis", {}).get("tcp.analysis.acks_frame") == "4":
-                second_rtt = float(tcp.get("tcp.analysis").get(
-                    "tcp.analysis.ack_rtt"))
+                if time - start_data_time < min_rtt:
+                    init_cwnd += 1
 
-            # receive packet
-            if srcport == '443':
-                if tcp['tcp.len'] == '1376' and int(tcp['tcp.seq']) >= 3000:
-                    if start_data_time is None:
-                        start_data_time = time
+            bytes_seq = seq
+            bytes_len = length
 
-                    min_rtt = min(initial_rtt, second_rtt) * 1000
+            if bytes_seq in time_to_detection \
+                    and bytes_seq > 1 \
+                    and prev_seq != bytes_seq:
+                lost_packets.append(
+                    (time_to_detection[bytes_seq], bytes_seq))
+                num_lost += 1
+                detections.append(
+                    time - time_to_detection[bytes_seq])
 
-                    if time - start_data_time < min_rtt:
-                        init_cwnd += 1
+            time_to_detection[bytes_seq] = time
+            prev_seq = bytes_seq
 
-                bytes_seq = int(tcp['tcp.seq'])
-                bytes_len = int(tcp['tcp.len'])
-                next_seq = int(tcp['tcp.nxtseq'])
+            if length == 0 or seq < 3000:
+                continue
+
+            if fin:
+                continue
 
-                if bytes_seq in time_to_detection \
-                        and bytes_seq > 1 \
-                        and prev_seq != bytes_seq:
-                    lost_packets.append(
-                        (time_to_detection[bytes_seq], bytes_seq))
-                    num_lost += 1
-                    detections.append(
-                        time - time_to_detection[bytes_seq])
+            bytes_seq = seq / 1024
+            bytes_len = length / 1024
 
-                time_to_detection[bytes_seq] = time
+            rx_ts[time + delay] = bytes_seq
+            rx_packets_ts.append((time + delay, {'length': bytes_len}))
+
+            if bytes_seq > prev_seq:
                 prev_seq = bytes_seq
+            else:
+                num_lost += 1
+                # lost_packets[time] = bytes_seq
 
-                if tcp['tcp.len'] == '0' or int(tcp['tcp.seq']) < 3000:
-                    continue
+        # send packet
+        else:
+            if fin:
+                continue
 
-                if fin:
-                    continue
+            if syn_flag == 1 and time > 500:
+                fin = True
+                continue
 
-                bytes_seq = int(tcp['tcp.seq']) / 1024
-                bytes_len = int(tcp['tcp.len']) / 1024
+            bytes_ack = ack / 1024
 
-                rx_ts[time + delay] = bytes_seq
-                rx_packets_ts.append((time + delay, {'length': bytes_len}))
+            sack_le = packet_values(packets, 'sack_le', i).tolist()
+            sack_re = packet_values(packets, 'sack_re', i).tolist()
 
-                if bytes_seq > prev_seq:
-                    prev_seq = bytes_seq
-                else:
-                    num_lost += 1
-                    # lost_packets[time] = bytes_seq
+            if len(sack_le) > 0 and len(sack_re) > 0:
+                sack_segs += [[le, re] for le, re in zip(sack_le, sack_re)]
 
-            # send packet
-            else:
-                if fin:
-                    continue
+                sack_segs = merge(sack_segs)
 
-                if tcp['tcp.flags_tree']['tcp.flags.syn'] == '1' and time > 500:
-                    fin = True
-                    continue
+                added_segs = []
+                bytes_ack_prev = bytes_ack * 1024
+                for left, right in sack_segs:
+                    if right <= bytes_ack_prev:
+                        continue
+                    if bytes_ack_prev < left:
+                        added_segs.append([left / 1024, right / 1024])
+                        bytes_ack += (right - left) / 1024
+                    elif bytes_ack_prev < right:
+                        added_segs.append([bytes_ack / 1024, right / 1024])
+                        bytes_ack += (right - bytes_ack) / 1024
+
+            ack_ts[time] = bytes_ack
 
-                bytes_ack = int(tcp['tcp.ack']) / 1024
-
-                sack = tcp.get('tcp.options_tree', {}).get(
-                    'tcp.options.sack_tree', {})
-
-                if 'tcp.options.sack_le' in sack and 'tcp.options.sack_re' in sack:
-                    le = 0
-                    re = 0
-                    for k, v in sack.items():
-                        if k in {'tcp.option_kind', 'tcp.option_len', 'tcp.options.sack.count'}:
-                            continue
-
-                        if k.count('tcp.options.sack_le') > 0:
-                            le = int(v)
-                        elif k.count('tcp.options.sack_re') > 0:
-                            re = int(v)
-                            sack_segs.append([le, re])
-
-                    sack_segs = merge(sack_segs)
-
-                    added_segs = []
-                    bytes_ack_prev = bytes_ack * 1024
-                    for left, right in sack_segs:
-                        if right <= bytes_ack_prev:
-                            continue
-                        if bytes_ack_prev < left:
-                            added_segs.append([left / 1024, right / 1024])
-                            bytes_ack += (right - left) / 1024
-                        elif bytes_ack_prev < right:
-                            added_segs.append([bytes_ack / 1024, right / 1024])
-                            bytes_ack += (right - bytes_ack) / 1024
-
-                ack_ts[time] = bytes_ack
-
-                ack_packets_ts.append((time, bytes_ack))
-                window = int(tcp['tcp.window_size']) / 1024
-                window_updates[time] = window
-                max_stream_data[time] = bytes_ack + window
-                prev_ack = (bytes_ack, sack, time)
+            ack_packets_ts.append((time, bytes_ack))
+            window = window_size / 1024
+            window_updates[time] = window
+            max_stream_data[time] = bytes_ack + window
+            prev_ack = (bytes_ack, time)
 
     return {
         'ack_ts': ack_ts,
@@ -218,7 +187,6 @@ def analyze_pcap(filename: str) -> (dict, str):
 
 def analyze_qlog(filename: str) -> (dict, str):
     ack_ts = {}
-    pkts_received = {}
     rx_ts = {}
     max_stream_data = {}
     lost_packets = []
@@ -227,115 +195,63 @@ def analyze_qlog(filename: str) -> (dict, str):
     time_to_detection = {}
     detections = []
 
-    with open(filename) as f:
-        data = json.load(f)
-        traces = data['traces'][0]
-        events = traces['events']
-        if 'configuration' in traces:
-            time_units = traces['configuration']['time_units']
-        else:
-            time_units = 'ms'
-
-        first_time = None
-
-        prev_pkt = {'pn': 0, 'dl': 0}
-        loss_count = 0
-
-        # Store all stream packets received by client
-        for event in events:
-            if not event:
-                continue
-
-            if time_units == 'ms':
-                ts = int(event[0])
-            else:
-                ts = int(event[0]) / 1000
-
-            event_type = event[2]
-            event_data = event[3]
+    tables = parse_qlog(filename)
+    first_time = tables['meta']['start']
+    packets = tables['packets']
+    frames = since_start(tables, 'frames')
 
-            if event_type.lower() == 'packet_sent' and first_time is None:
-                first_time = ts
+    prev_pkt = {'pn': 0, 'dl': 0}
+    loss_count = 0
 
-            if first_time is None:
-                continue
+    # Store all stream packets received by client
+    stream = (frames['direction'] == RECEIVED) & (
+        frames['frame_type'] == 'stream') & (frames['stream_id'] == 0)
 
-            ts -= first_time
+    for ts, pkt_num, offset, length in zip(
+            to_ms(frames['time'][stream] - first_time).tolist(),
+            packets['packet_number'][frames['packet'][stream]].tolist(),
+            frames['offset'][stream].tolist(),
+            frames['length'][stream].tolist()):
 
-            if event_type.lower() == 'packet_received':
+        if offset in time_to_detection:
+            detections.append(ts - time_to_detection[offset])
 
-                # Associate packet num with data offset
-                if 'frames' not in event_data:
-                    continue
+        data_length = (offset + length) / 1024
 
-                frames = event_data['frames']
+        rx_ts[ts] = data_length
+        rx_packets_ts.append((ts, {'length': length / 1024}))
 
-                for frame in frames:
-                    if frame['frame_type'].lower() == 'stream':
-                        if frame['stream_id'] != '0':
-                            continue
+        if prev_pkt['pn'] + 1 != pkt_num:
+            lost_packets.append((ts, data_length))
+            loss_count += 1
+            time_to_detection[int(
+                prev_pkt['dl'] * 1024)] = ts
 
-                        pkt_num = int(event_data['header']['packet_number'])
-                        offset = int(frame['offset'])
-                        length = int(frame['length'])
+        prev_pkt['pn'] = pkt_num
+        prev_pkt['dl'] = data_length
 
-                        if offset in time_to_detection:
-                            detections.append(ts - time_to_detection[offset])
+    sent = frames['direction'] == SENT
+    window = sent & (frames['frame_type'] == 'max_stream_data') & (
+        frames['maximum'] != MISSING)
+    for ts, maximum in zip(to_ms(frames['time'][window] - first_time).tolist(),
+                           frames['maximum'][window].tolist()):
+        max_stream_data[ts] = maximum / 1024
 
-                        data_length = (offset + length) / 1024
+    # Get max ack sent
+    acks = stream_acks(tables, started(tables, 'acks') & (tables['acks']['direction'] == SENT))
+    max_acks = max_acked(acks, packets['packet_number'][frames['packet'][stream]],
+                         (frames['offset'][stream] + frames['length'][stream]) / 1024, frames['time'][stream])
 
-                        pkts_received[pkt_num] = data_length
-                        rx_ts[ts] = data_length
-                        rx_packets_ts.append((ts, {'length': length / 1024}))
+    sent_packets = np.nonzero(started(tables, 'packets') & (
+        packets['direction'] == SENT) & (packets['frame_count'] > 0))[0]
+    for packet in sent_packets.tolist():
+        ts = float(to_ms(packets['time'][packet] - first_time))
 
-                        if prev_pkt['pn'] + 1 != pkt_num:
-                            lost_packets.append((ts, data_length))
-                            loss_count += 1
-                            time_to_detection[int(
-                                prev_pkt['dl'] * 1024)] = ts
-
-                        prev_pkt['pn'] = pkt_num
-                        prev_pkt['dl'] = data_length
-
-            if event_type.lower() == 'packet_sent':
-                # Get max ack sent
-                if 'frames' not in event_data:
-                    continue
-
-                local_max_ack = None
-                packet_type = event_data['packet_type']
-                frames = event_data['frames']
-
-                for frame in frames:
-                    if frame['frame_type'] == 'max_stream_data':
-                        if 'maximum' in frame:
-                            max_stream_data[ts] = int(frame['maximum']) / 1024
-
-                    if 'acked_ranges' not in frame:
-                        continue
-
-                    for ack in frame['acked_ranges']:
-                        if len(ack) != 2:
-                            continue
-
-                        ack_begin = int(ack[0])
-                        ack_end = int(ack[1])
-
-                        for i in range(ack_begin, ack_end + 1):
-                            if i not in pkts_received:
-                                continue
-
-                            if local_max_ack is None:
-                                local_max_ack = pkts_received[i]
-
-                            local_max_ack = max(
-                                local_max_ack, pkts_received[i])
-
-                if packet_type != '1RTT':
-                    ack_packets_ts.append((ts, 0))
-                if local_max_ack is not None:
-                    ack_ts[ts] = local_max_ack
-                    ack_packets_ts.append((ts, local_max_ack))
+        if packets['packet_type'][packet] != '1RTT':
+            ack_packets_ts.append((ts, 0))
+        if packet in max_acks:
+            ack_ts[ts] = max_acks[packet]
+            ack_packets_ts.append((ts, max_acks[packet]))
 
     return {
         'ack_ts': ack_ts,
@@ -347,6 +263,16 @@ def analyze_qlog(filename: str) -> (dict, str):
     }, filename
 
 
+# Netlog events analyze_netlog reads, everything else is skipped unparsed
+NETLOG_EVENTS = [
+    'TCP_CONNECT',
+    'QUIC_SESSION',
+    'HTTP2_SESSION_RECV_DATA',
+    'QUIC_SESSION_UNAUTHENTICATED_PACKET_HEADER_RECEIVED',
+    'QUIC_SESSION_STREAM_FRAME_RECEIVED',
+]
+
+
 def analyze_netlog(filename: str) -> (dict, str):
     ack_ts = {}
     rx_ts = {}
@@ -357,32 +283,20 @@ def analyze_netlog(filename: str) -> (dict, str):
     detections = []
     packets = {}
 
-    with open(filename) as f:
-        data = json.load(f)
-
-        constants = data['constants']
-        events = data['events']
-        event_types = {v: k for k,
-                       v in constants['logEventTypes'].items()}
-        source_types = {v: k for k,
-                        v in constants['logSourceType'].items()}
-        phases = {v: k for k,
-                  v in constants['logEventPhase'].items()}
+    with open_artifact(filename, 'rt') as f:
+        netlog = NetlogReader(f, NETLOG_EVENTS)
 
         start_time = None
         total_size = 0
         prev_pn = 0
         prev_pkt = {'pn': 0, 'dl': 0}
 
-        for event in events:
-            # source_type in string
-            source_type = source_types[event['source']['type']]
+        for event in netlog:
             # source id
             source_id = event['source']['id']
-            # event_type in string
-            event_type = event_types[event['type']]
-            # phase in string
-            phase = phases[event['phase']]
+            # event_type in string, only for the wanted events
+            event_type = netlog.name(event['type'])
+            phase = event['phase']
 
             if 'params' not in event:
                 continue
@@ -395,7 +309,7 @@ def analyze_netlog(filename: str) -> (dict, str):
             if start_time is not None:
                 ts = event_time - start_time
 
-            if (event_type == 'TCP_CONNECT' or event_type == 'QUIC_SESSION') and phase == 'PHASE_BEGIN':
+            if (event_type == 'TCP_CONNECT' or event_type == 'QUIC_SESSION') and phase == netlog.phases['PHASE_BEGIN']:
                 if start_time is None:
                     start_time = event_time
 
@@ -441,7 +355,6 @@ def analyze_netlog(filename: str) -> (dict, str):
                 ack_ts[ts] = (offset + length) / 1024
                 rx_packets_ts.append((ts, {'length': params['length'] / 1024}))
 
-            print(event_type)
             # if event_type == 'QUIC_SESSION':
 
     print(np.median(detections), filename)
@@ -566,7 +479,7 @@ def main():
 
     if args.qlogdir is not None:
         qlogdir = Path.joinpath(Path.cwd(), args.qlogdir)
-        files = glob('{}/**/*.qlog'.format(qlogdir), recursive=True)
+        files = artifact_files(qlogdir, '.qlog')
         files.sort()
         for qlog in files:
             # if qlog.split('.')[0][-1] != '3':
@@ -575,7 +488,7 @@ def main():
 
     if args.pcapdir is not None:
         pcapdir = Path.joinpath(Path.cwd(), args.pcapdir)
-        files = glob('{}/**/*.json'.format(pcapdir), recursive=True)
+        files = pcap_files(pcapdir)
         for pcap in files:
             # if pcap.split('.')[0][-1] != '3':
             #     continue
@@ -584,7 +497,7 @@ def main():
 
     if args.netlogdir is not None:
         netlogdir = Path.joinpath(Path.cwd(), args.netlogdir)
-        files = glob('{}/**/*.json'.format(netlogdir), recursive=True)
+        files = netlog_files(netlogdir)
         for netlog in files:
             if netlog.count('h3') == 0:
                 continue
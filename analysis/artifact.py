@@ -0,0 +1,105 @@
+import gzip
+import io
+import lzma
+import os
+import shutil
+
+from glob import glob
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Suffix and magic number of every codec artifacts can be compressed with
+CODECS = {
+    'gzip': ('.gz', b'\x1f\x8b'),
+    'xz': ('.xz', b'\xfd7zXZ\x00'),
+    'zstd': ('.zst', b'\x28\xb5\x2f\xfd'),
+}
+SUFFIXES = [suffix for suffix, _ in CODECS.values()]
+
+COPY_CHUNK = 1024 * 1024
+
+
+def codec_open(codec: str, filename: str, mode: str, **kwargs):
+    if codec == 'gzip':
+        return gzip.open(filename, mode, **kwargs)
+    if codec == 'xz':
+        # Named like gzip files, readers find what is stored above them by it
+        f = lzma.LZMAFile(filename, mode.replace('t', ''))
+        f.name = str(filename)
+        return io.TextIOWrapper(f, **kwargs) if 't' in mode else f
+    if codec == 'zstd':
+        if zstandard is None:
+            raise Exception('zstd artifacts need the zstandard package')
+        f = zstandard.open(filename, mode, **kwargs)
+        # Readers peek at the first bytes, which only a buffered reader can
+        return io.BufferedReader(f) if mode == 'rb' else f
+    raise Exception('unknown codec {}, use one of {}'.format(codec, list(CODECS)))
+
+
+def detect(filename: str) -> str:
+    """The codec `filename` is compressed with, None for a plain file"""
+    with open(filename, mode='rb') as f:
+        head = f.read(8)
+
+    for codec, (_, magic) in CODECS.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def open_artifact(filename: str, mode: str = 'rb', **kwargs):
+    """
+    Open an artifact for reading, decompressing it on the fly if it is
+    compressed, whatever its name
+    """
+    codec = detect(filename)
+    if codec is None:
+        return open(filename, mode, **kwargs)
+    return codec_open(codec, filename, mode, **kwargs)
+
+
+def mappable(f) -> bool:
+    """Whether the bytes read from `f` are the file on disk, so it can be mapped"""
+    return isinstance(f, io.BufferedReader) and isinstance(f.raw, io.FileIO)
+
+
+def strip_codec(filename: str) -> Path:
+    """`filename` without the suffix of its codec, x.qlog for x.qlog.gz"""
+    path = Path(filename)
+    return path.with_suffix('') if path.suffix in SUFFIXES else path
+
+
+def artifact_suffix(filename: str) -> str:
+    return strip_codec(filename).suffix
+
+
+def artifact_files(directory: str, suffix: str) -> list:
+    """Files with `suffix` under `directory`, compressed or not"""
+    files = []
+    for codec_suffix in [''] + SUFFIXES:
+        files += glob('{}/**/*{}{}'.format(directory, suffix, codec_suffix), recursive=True)
+    return sorted(files)
+
+
+def save_artifact(src: str, dst: str, codec: str = None) -> Path:
+    """
+    Move `src` to `dst`, compressing it with `codec` on the way unless it is
+    None. Returns where it was saved, `dst` plus the codec's suffix.
+    """
+    if codec is None:
+        shutil.move(src, dst)
+        return Path(dst)
+
+    path = Path('{}{}'.format(dst, CODECS[codec][0]))
+    tmp = path.with_name('{}.tmp'.format(path.name))
+
+    with open(src, mode='rb') as f, codec_open(codec, tmp, 'wb') as out:
+        shutil.copyfileobj(f, out, COPY_CHUNK)
+    os.replace(tmp, path)
+    os.remove(src)
+
+    return path
@@ -1,6 +1,5 @@
 import argparse
 import sys
-import json
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
@@ -9,7 +8,8 @@ import random
 
 from collections import deque
 from pathlib import Path
-from glob import glob
+from artifact import artifact_files
+from qlog import parse_qlog, stream_acks, max_acked, to_ms, SENT, RECEIVED
 
 LINE = 10
 
@@ -20,87 +20,41 @@ def analyze_qlog(filename):
     handshake_done = {}
     data_sent = []
     acks_received = {}
-    packets_sent = {}
     cwnd_updates = []
     bytes_in_flight = []
 
-    with open(filename) as f:
-        data = json.load(f)
-
-        traces = data['traces'][0]
-        events = traces['events']
-        if 'configuration' in traces:
-            time_units = traces['configuration']['time_units']
-        else:
-            time_units = 'ms'
-
-        start = None
-        curr_bw = 0
-        curr_ack = 0
-
-        # Store all stream packets received by client
-        for event in events:
-            if not event:
-                continue
-
-            if time_units == 'ms':
-                ts = int(event[0])
-            else:
-                ts = int(event[0]) / 1000
-
-            if start is None:
-                start = ts
-
-            ts -= start
-
-            event_type = event[2]
-            event_data = event[3]
-
-            if event_type.lower() == 'bandwidth_est_update':
-                bandwidth[ts] = int(event_data['bandwidth_bytes'])
-                curr_bw = bandwidth[ts]
-
-            if event_type.lower() == 'packet_sent':
-                if 'frames' in event_data:
-                    for frame in event_data['frames']:
-                        if frame['frame_type'] == 'stream' and frame['stream_id'] == '0':
-                            data_offset = frame['offset'] + frame['length']
-                            data_sent.append((ts, data_offset))
-                            packets_sent[event_data['header']
-                                         ['packet_number']] = data_offset
-
-            if event_type.lower() == 'packet_received':
-                if 'frames' in event_data:
-                    for frame in event_data['frames']:
-                        if frame['frame_type'] == 'ack':
-
-                            local_max_ack = None
-
-                            for ack in frame['acked_ranges']:
-                                if len(ack) != 2:
-                                    continue
-
-                                ack_begin = int(ack[0])
-                                ack_end = int(ack[1])
-
-                                for i in range(ack_begin, ack_end + 1):
-                                    if i not in packets_sent:
-                                        continue
-
-                                    if local_max_ack is None:
-                                        local_max_ack = packets_sent[i]
-
-                                    local_max_ack = max(
-                                        local_max_ack, packets_sent[i])
-
-                            curr_ack = local_max_ack
-                            acks_received[ts] = local_max_ack
-
-            if event_type.lower() == 'congestion_metric_update':
-                bif = int(event_data['bytes_in_flight'])
-                cwnd = int(event_data['current_cwnd'])
-                cwnd_updates.append((ts, cwnd))
-                bytes_in_flight.append((ts, bif))
+    tables = parse_qlog(filename)
+    start = tables['meta']['first']
+    packets = tables['packets']
+    frames = tables['frames']
+    metrics = tables['metrics']
+
+    estimates = ~np.isnan(metrics['bandwidth'])
+    for ts, bw in zip(to_ms(metrics['time'][estimates] - start).tolist(),
+                      metrics['bandwidth'][estimates].tolist()):
+        bandwidth[ts] = int(bw)
+
+    stream = (frames['direction'] == SENT) & (
+        frames['frame_type'] == 'stream') & (frames['stream_id'] == 0)
+    data_offsets = frames['offset'][stream] + frames['length'][stream]
+    data_sent = list(zip(to_ms(frames['time'][stream] - start).tolist(),
+                         data_offsets.tolist()))
+
+    acks = stream_acks(tables, tables['acks']['direction'] == RECEIVED)
+    max_acks = max_acked(
+        acks, packets['packet_number'][frames['packet'][stream]], data_offsets, frames['time'][stream])
+
+    received = (frames['direction'] == RECEIVED) & (frames['frame_type'] == 'ack')
+    for ts, packet in zip(to_ms(frames['time'][received] - start).tolist(),
+                          frames['packet'][received].tolist()):
+        acks_received[ts] = max_acks.get(packet)
+
+    congestion = ~np.isnan(metrics['congestion_window']) & ~np.isnan(metrics['bytes_in_flight'])
+    for ts, cwnd, bif in zip(to_ms(metrics['time'][congestion] - start).tolist(),
+                             metrics['congestion_window'][congestion].tolist(),
+                             metrics['bytes_in_flight'][congestion].tolist()):
+        cwnd_updates.append((ts, int(cwnd)))
+        bytes_in_flight.append((ts, int(bif)))
 
     return {
         'bw': bandwidth,
@@ -214,7 +168,7 @@ def main():
 
     data = []
 
-    files = glob('{}/**/*.qlog'.format(qlogdir), recursive=True)
+    files = artifact_files(qlogdir, '.qlog')
     files.sort()
 
     for qlog in files:
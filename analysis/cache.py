@@ -0,0 +1,218 @@
+import argparse
+import functools
+import hashlib
+import inspect
+import json
+import os
+import numpy as np
+
+from pathlib import Path
+
+# Decoded tables are kept here, one compressed .npz per parsed file
+CACHE_DIR = os.environ.get('ANALYSIS_CACHE_DIR', str(Path.joinpath(Path.home(), '.cache', 'quic-analysis')))
+
+# Size cap in MB, least recently used entries are evicted beyond it
+CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE', 4096))
+
+# ANALYSIS_CACHE=0 parses everything from scratch
+CACHE_ENABLED = os.environ.get('ANALYSIS_CACHE', '1') != '0'
+
+# Files are keyed by path, size and mtime, or by a hash of their content
+# with ANALYSIS_CACHE_KEY=content so copies and touched files still hit
+CACHE_KEY = os.environ.get('ANALYSIS_CACHE_KEY', 'stat')
+
+# Separates the levels of nested tables in .npz keys
+SEPARATOR = '.'
+# Key of the JSON encoded values that are not arrays
+SCALARS = '__scalars__'
+
+HASH_CHUNK = 1024 * 1024
+
+# Bytes in the cache as this process knows it, scanned once and then kept up
+# to date with the entries it stores
+_SIZE = None
+
+
+def file_key(filename: str) -> str:
+    path = Path(filename).resolve()
+
+    if CACHE_KEY == 'content':
+        digest = hashlib.sha256()
+        with open(path, mode='rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    stat = path.stat()
+    return '{}:{}:{}'.format(path, stat.st_size, stat.st_mtime_ns)
+
+
+def entry_path(parser: str, version: int, filename: str, args: tuple, kwargs: dict, inputs: list = ()) -> Path:
+    key = '{}:{}:{}:{}'.format(parser, version, ':'.join([file_key(filename)] + list(inputs)),
+                               json.dumps([args, sorted(kwargs.items())], default=str))
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return Path.joinpath(Path(CACHE_DIR), '{}-{}.npz'.format(parser, digest))
+
+
+def flatten(value: dict, arrays: dict, scalars: dict, prefix: str = ''):
+    for key, item in value.items():
+        name = prefix + key
+        if isinstance(item, dict):
+            flatten(item, arrays, scalars, name + SEPARATOR)
+        elif isinstance(item, np.ndarray):
+            arrays[name] = item
+        else:
+            scalars[name] = item
+
+
+def unflatten(arrays: dict, scalars: dict) -> dict:
+    res = {}
+    for name, value in list(arrays.items()) + list(scalars.items()):
+        *parents, key = name.split(SEPARATOR)
+        node = res
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    return res
+
+
+def save_entry(path: Path, value: dict):
+    arrays = {}
+    scalars = {}
+    flatten(value, arrays, scalars)
+    arrays[SCALARS] = np.array(json.dumps(scalars))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and renamed, so parallel analyses never read half an entry
+    tmp = path.with_name('{}.{}.tmp'.format(path.stem, os.getpid()))
+    with open(tmp, mode='wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+
+
+def load_entry(path: Path) -> dict:
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files if key != SCALARS}
+        scalars = json.loads(str(data[SCALARS]))
+
+    # The mtime of an entry is its last use
+    os.utime(path)
+
+    return unflatten(arrays, scalars)
+
+
+def entries() -> list:
+    """Cache entries with their stat, least recently used first"""
+    res = []
+    for path in Path(CACHE_DIR).glob('*.npz'):
+        try:
+            res.append((path, path.stat()))
+        except OSError:
+            continue
+    return sorted(res, key=lambda x: x[1].st_mtime)
+
+
+def evict(limit: int = None) -> int:
+    """Delete the least recently used entries down to `limit` MB, returns the bytes left"""
+    limit = (CACHE_SIZE if limit is None else limit) * 1024 * 1024
+    paths = entries()
+    total = sum([stat.st_size for _, stat in paths])
+
+    for path, stat in paths:
+        if total <= limit:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= stat.st_size
+
+    return total
+
+
+def record(path: Path):
+    """Count a stored entry toward the cache size and evict once it is over the cap"""
+    global _SIZE
+
+    if _SIZE is None:
+        _SIZE = sum([stat.st_size for _, stat in entries()])
+    else:
+        _SIZE += path.stat().st_size
+
+    if _SIZE > CACHE_SIZE * 1024 * 1024:
+        _SIZE = evict()
+
+
+def cached(parser: str, version: int, files: list = ()):
+    """
+    Caches what the decorated parser returns for a file: a dict of numpy
+    arrays, nested dicts of them and JSON values. Bump `version` whenever
+    the parser's output changes. `files` names the other arguments that are
+    files read by the parser, keyed like the parsed file.
+    """
+
+    def decorator(parse):
+        signature = inspect.signature(parse)
+
+        @functools.wraps(parse)
+        def wrapper(filename, *args, **kwargs):
+            if not CACHE_ENABLED:
+                return parse(filename, *args, **kwargs)
+
+            arguments = signature.bind(filename, *args, **kwargs).arguments
+            inputs = [file_key(arguments[x]) if arguments.get(x) is not None else '' for x in files]
+            path = entry_path(parser, version, filename, args, kwargs, inputs)
+
+            try:
+                return load_entry(path)
+            except (OSError, KeyError, ValueError):
+                pass
+
+            value = parse(filename, *args, **kwargs)
+
+            try:
+                save_entry(path, value)
+                record(path)
+            except OSError as e:
+                print('Could not cache', filename, e)
+
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('info', help='Show the cache size per parser')
+    purge = subparsers.add_parser('purge', help='Delete cache entries')
+    purge.add_argument('--parser', help='Only delete the entries of this parser')
+    purge.add_argument('--size', type=int, help='Evict down to this many MB instead of deleting everything')
+
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        paths = entries()
+        parsers = {}
+        for path, stat in paths:
+            name = path.stem.rpartition('-')[0]
+            count, size = parsers.get(name, (0, 0))
+            parsers[name] = (count + 1, size + stat.st_size)
+
+        print(CACHE_DIR, 'enabled' if CACHE_ENABLED else 'disabled', 'key', CACHE_KEY)
+        for name, (count, size) in sorted(parsers.items()):
+            print('{:<16} {:>8} entries {:>10.1f} MB'.format(name, count, size / 1024 / 1024))
+        print('{:<16} {:>8} entries {:>10.1f} MB of {} MB'.format(
+            'total', len(paths), sum([stat.st_size for _, stat in paths]) / 1024 / 1024, CACHE_SIZE))
+    elif args.size is not None:
+        evict(args.size)
+    else:
+        for path, _ in entries():
+            if args.parser is None or path.stem.rpartition('-')[0] == args.parser:
+                path.unlink()
+
+
+if __name__ == "__main__":
+    main()
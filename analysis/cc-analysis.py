@@ -1,6 +1,5 @@
 import argparse
 import sys
-import json
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
@@ -8,7 +7,9 @@ from matplotlib.ticker import StrMethodFormatter
 
 from collections import deque
 from pathlib import Path
-from glob import glob
+from artifact import artifact_files
+from qlog import stream_acks, max_acked, to_ms, SENT, RECEIVED
+from store import TraceStore, load_tables
 
 BLUE = deque(['#0000FF', '#0000B3', '#0081B3',
               '#14293D', '#A7DFE2', '#8ED9CD'])
@@ -21,114 +22,35 @@ PURPLE = deque(['#6A00CD', '#A100CD', '#7653DE'])
 
 
 def analyze_cc(filename: str) -> (dict, str):
-    cc_ts = []
-
-    with open(filename) as f:
-        data = json.load(f)
-        traces = data['traces'][0]
-        events = traces['events']
-        if 'configuration' in traces:
-            time_units = traces['configuration']['time_units']
-        else:
-            time_units = 'ms'
-
-        # Store all stream packets received by client
-        for event in events:
-            if not event:
-                continue
-
-            if time_units == 'ms':
-                ts = int(event[0])
-            else:
-                ts = int(event[0]) / 1000
-
-            event_type = event[2]
-            event_data = event[3]
-
-            if event_type.lower() == 'metrics_updated':
-                cwnd = float(event_data['congestion_window']) / 1024
-                cc_ts.append((ts, cwnd))
+    tables = load_tables(filename)
+    metrics = tables['metrics']
+
+    updates = ~np.isnan(metrics['congestion_window'])
+    cc_ts = list(zip(to_ms(metrics['time'][updates]).tolist(),
+                     (metrics['congestion_window'][updates] / 1024).tolist()))
 
     return cc_ts, filename
 
 
 def analyze_ack(filename: str) -> (dict, str):
     print(filename)
-    with open(filename) as f:
-        data = json.load(f)
-        traces = data['traces'][0]
-        events = traces['events']
-        if 'configuration' in traces:
-            time_units = traces['configuration']['time_units']
-        else:
-            time_units = 'ms'
-
-        ack_ts = {}
-        pkts_received = {}
-        received_ts = {}
-
-        # Store all stream packets received by client
-        for event in events:
-            if not event:
-                continue
-
-            if time_units == 'ms':
-                ts = int(event[0])
-            else:
-                ts = int(event[0]) / 1000
-
-            event_type = event[2]
-            event_data = event[3]
-
-            if event_type.lower() == 'packet_received':
-
-                # Associate packet num with data offset
-                if 'frames' not in event_data:
-                    continue
-
-                frames = event_data['frames']
-
-                for frame in frames:
-                    if frame['frame_type'].lower() == 'stream':
-                        if frame['stream_id'] != '0':
-                            continue
-
-                        pkt_num = int(event_data['header']['packet_number'])
-                        offset = int(frame['offset'])
-                        length = int(frame['length'])
-                        pkts_received[pkt_num] = offset + length
-                        received_ts[ts] = (offset + length) / 1024
-
-            if event_type.lower() == 'packet_sent':
-                # Get max ack sent
-                if 'frames' not in event_data:
-                    continue
-
-                local_max_ack = None
-                frames = event_data['frames']
-                for frame in frames:
-                    if 'acked_ranges' not in frame:
-                        continue
-
-                    for ack in frame['acked_ranges']:
-                        if len(ack) != 2:
-                            continue
-
-                        ack_begin = int(ack[0])
-                        ack_end = int(ack[1])
-
-                        for i in range(ack_begin, ack_end + 1):
-                            if i not in pkts_received:
-                                continue
-
-                            if local_max_ack is None:
-                                local_max_ack = pkts_received[i]
-
-                            local_max_ack = max(
-                                local_max_ack, pkts_received[i])
-
-                if local_max_ack is not None:
-                    ack_ts[ts] = local_max_ack / 1024
+    tables = load_tables(filename)
+    packets = tables['packets']
+    frames = tables['frames']
+
+    ack_ts = {}
+
+    # Store all stream packets received by client
+    stream = (frames['direction'] == RECEIVED) & (
+        frames['frame_type'] == 'stream') & (frames['stream_id'] == 0)
+
+    # Get max ack sent
+    acks = stream_acks(tables, tables['acks']['direction'] == SENT)
+    max_acks = max_acked(acks, packets['packet_number'][frames['packet'][stream]],
+                         frames['offset'][stream] + frames['length'][stream], frames['time'][stream])
+
+    for packet, value in max_acks.items():
+        ack_ts[float(to_ms(packets['time'][packet]))] = value / 1024
 
     return ack_ts
 
@@ -199,6 +121,9 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("qlogdir")
     parser.add_argument("--title")
+    parser.add_argument("--store", action='store_true', help='qlogdir is a trace store, see store.py')
+    parser.add_argument("--scenario", nargs='+', help='Only the traces of these scenarios of the store')
+    parser.add_argument("--client", nargs='+', help='Only the traces of these clients of the store')
 
     args = parser.parse_args()
 
@@ -207,7 +132,11 @@ def main():
 
     data = []
 
-    files = glob('{}/**/*.qlog'.format(qlogdir), recursive=True)
+    if args.store:
+        store = TraceStore(qlogdir)
+        files = [str(store.path(x)) for x in store.select('qlog', args.scenario, client=args.client)]
+    else:
+        files = artifact_files(qlogdir, '.qlog')
     files.sort()
     for qlog in files:
         data.append(analyze_cc(qlog))
@@ -13,6 +13,10 @@ from matplotlib.ticker import StrMethodFormatter
 from collections import deque
 from pathlib import Path
 from glob import glob
+from netlog import NetlogReader
+from artifact import open_artifact
+from pcap import load_packets
+from qlog import parse_qlog, since_start, started, stream_acks, max_acked, to_ms, SENT, RECEIVED, MISSING
 
 BLUE = deque(['#0000FF', '#0000B3', '#0081B3',
               '#14293D', '#A7DFE2', '#8ED9CD'])
@@ -28,6 +32,11 @@ YELLOW = deque(['#FFFF00', '#DCFF20', '#DCC05A'])
 PURPLE = deque(['#6A00CD', '#A100CD', '#7653DE'])
 
 
+# Columns analyze_pcap walks, in the order they are unpacked
+PACKET_COLUMNS = ['srcport', 'time', 'fin', 'syn', 'initial_rtt', 'acks_frame', 'ack_rtt',
+                  'seq', 'len', 'ack', 'window_size']
+
+
 def analyze_pcap(filename: str) -> (dict, str):
     ack_ts = {}
     rx_ts = {}
@@ -39,93 +48,87 @@ def analyze_pcap(filename: str) -> (dict, str):
     second_rtt = None
     init_cwnd = 0
 
-    with open(filename) as f:
-        data = json.load(f)
-
-        prev_ack = 0
-        lost_packet = None
-        lost_time = None
-        num_lost = 0
-        tx_tls = None
-        rx_tls = None
-        start_data_time = None
+    packets = load_packets(filename)
 
-        fin = False
-        prev_seq = -1
+    prev_ack = 0
+    lost_packet = None
+    lost_time = None
+    num_lost = 0
+    tx_tls = None
+    rx_tls = None
+    start_data_time = None
 
-        # Associate each ACK offset with a timestamp
-        for packet in data:
-            tcp = packet['_source']['layers']['tcp']
-            srcport = tcp['tcp.srcport']
-            dstport = tcp['tcp.dstport']
-            time = float(tcp['Timestamps']['tcp.time_relative']) * 1000
+    fin = False
+    prev_seq = -1
 
-            if tcp['tcp.flags_tree']['tcp.flags.fin'] == '1':
-                fin = True
+    # Associate each ACK offset with a timestamp
+    for srcport, time, fin_flag, syn_flag, init_rtt, acks_frame, ack_rtt, seq, length, ack, window_size in zip(
+            *[packets[x].tolist() for x in PACKET_COLUMNS]):
+        time = time * 1000
 
-            init_rtt = tcp.get('tcp.analysis', {}).get(
-                'tcp.analysis.initial_rtt')
-            if init_rtt is not None:
-                initial_rtt = float(init_rtt)
+        if fin_flag == 1:
+            fin = True
 
-            if tcp.get("tcp.analysis", {}).get("tcp.analysis.acks_frame") == "4":
-                second_rtt = float(tcp.get("tcp.analysis").get(
-                    "tcp.analysis.ack_rtt"))
+        if not math.isnan(init_rtt):
+            initial_rtt = init_rtt
 
-            # receive packet
-            if srcport == '443':
-                if tcp['tcp.len'] == '1376' and int(tcp['tcp.seq']) >= 3000:
-                    if start_data_time is None:
-                        start_data_time = time
+        if acks_frame == 4:
+            second_rtt = ack_rtt
 
-                    min_rtt = min(initial_rtt, second_rtt) * 1000
+        # receive packet
+        if srcport == 443:
+            if length == 1376 and seq >= 3000:
+                if start_data_time is None:
+                    start_data_time = time
 
-                    if time - start_data_time < min_rtt:
-                        init_cwnd += 1
+                min_rtt = min(initial_rtt, second_rtt) * 1000
 
-                if tcp['tcp.len'] == '0' or int(tcp['tcp.seq']) < 3000:
-                    continue
+                if time - start_data_time < min_rtt:
+                    init_cwnd += 1
 
-                if fin:
-                    continue
+            if length == 0 or seq < 3000:
+                continue
 
-                bytes_seq = int(tcp['tcp.seq']) / 1024
-                bytes_len = int(tcp['tcp.len']) / 1024
+            if fin:
+                continue
 
-                rx_ts[time] = bytes_seq
-                rx_packets_ts.append((time, {'length': bytes_len}))
+            bytes_seq = seq / 1024
+            bytes_len = length / 1024
 
-                if bytes_seq > prev_seq:
-                    prev_seq = bytes_seq
-                else:
-                    num_lost += 1
-                    lost_packets[time] = bytes_seq
+            rx_ts[time] = bytes_seq
+            rx_packets_ts.append((time, {'length': bytes_len}))
 
-            # send packet
+            if bytes_seq > prev_seq:
+                prev_seq = bytes_seq
             else:
-                if fin:
-                    continue
-                if tcp['tcp.flags_tree']['tcp.flags.syn'] == '1' and time > 500:
-                    fin = True
-                    continue
+                num_lost += 1
+                lost_packets[time] = bytes_seq
 
-                bytes_ack = int(tcp['tcp.ack']) / 1024
-                ack_ts[time] = bytes_ack
-                window = int(tcp['tcp.window_size']) / 1024
-                window_updates[time] = window
-                max_stream_data[time] = bytes_ack + window
+        # send packet
+        else:
+            if fin:
+                continue
+            if syn_flag == 1 and time > 500:
+                fin = True
+                continue
 
-                if bytes_ack == prev_ack and bytes_ack > 1:
-                    if lost_packet is None:
-                        lost_packet = (bytes_ack, window)
-                        lost_time = time
-                else:
-                    if lost_time and time - lost_time > 5:
-                        pass
+            bytes_ack = ack / 1024
+            ack_ts[time] = bytes_ack
+            window = window_size / 1024
+            window_updates[time] = window
+            max_stream_data[time] = bytes_ack + window
+
+            if bytes_ack == prev_ack and bytes_ack > 1:
+                if lost_packet is None:
+                    lost_packet = (bytes_ack, window)
+                    lost_time = time
+            else:
+                if lost_time and time - lost_time > 5:
+                    pass
 
-                    lost_time = None
-                    lost_packet = None
-                    prev_ack = bytes_ack
+                lost_time = None
+                lost_packet = None
+                prev_ack = bytes_ack
 
     print(filename, initial_rtt, second_rtt, init_cwnd)
     return {
@@ -137,112 +140,56 @@ def analyze_pcap(filename: str) -> (dict, str):
 
 def analyze_qlog(filename: str) -> (dict, str):
     ack_ts = {}
-    pkts_received = {}
     rx_ts = {}
     max_stream_data = {}
     lost_packets = {}
     rx_packets_ts = []
 
-    with open(filename) as f:
-        data = json.load(f)
-        traces = data['traces'][0]
-        events = traces['events']
-        if 'configuration' in traces:
-            time_units = traces['configuration']['time_units']
-        else:
-            time_units = 'ms'
-
-        first_time = None
-
-        prev_pkt = {'pn': 0, 'dl': 0}
-        loss_count = 0
-
-        # Store all stream packets received by client
-        for event in events:
-            if not event:
-                continue
-
-            if time_units == 'ms':
-                ts = int(event[0])
-            else:
-                ts = int(event[0]) / 1000
-
-            event_type = event[2]
-            event_data = event[3]
-
-            if event_type.lower() == 'packet_sent' and first_time is None:
-                first_time = ts
-
-            if first_time is None:
-                continue
-
-            ts -= first_time
-
-            if event_type.lower() == 'packet_received':
-
-                # Associate packet num with data offset
-                if 'frames' not in event_data:
-                    continue
-
-                frames = event_data['frames']
+    tables = parse_qlog(filename)
+    first_time = tables['meta']['start']
+    packets = tables['packets']
+    frames = since_start(tables, 'frames')
 
-                for frame in frames:
-                    if frame['frame_type'].lower() == 'stream':
-                        if frame['stream_id'] != '0':
-                            continue
+    prev_pkt = {'pn': 0, 'dl': 0}
+    loss_count = 0
 
-                        pkt_num = int(event_data['header']['packet_number'])
-                        offset = int(frame['offset'])
-                        length = int(frame['length'])
+    # Store all stream packets received by client
+    stream = (frames['direction'] == RECEIVED) & (
+        frames['frame_type'] == 'stream') & (frames['stream_id'] == 0)
 
-                        data_length = (offset + length) / 1024
+    for ts, pkt_num, offset, length in zip(
+            to_ms(frames['time'][stream] - first_time).tolist(),
+            packets['packet_number'][frames['packet'][stream]].tolist(),
+            frames['offset'][stream].tolist(),
+            frames['length'][stream].tolist()):
 
-                        pkts_received[pkt_num] = data_length
-                        rx_ts[ts] = data_length
-                        rx_packets_ts.append((ts, {'length': length / 1024}))
+        data_length = (offset + length) / 1024
 
-                        if prev_pkt['dl'] < data_length:
-                            prev_pkt = {'pn': pkt_num, 'dl': data_length}
-                        elif prev_pkt['pn'] < pkt_num:
-                            lost_packets[ts] = data_length
-                            loss_count += 1
-                        else:
-                            print('out of order packet')
+        rx_ts[ts] = data_length
+        rx_packets_ts.append((ts, {'length': length / 1024}))
 
-            if event_type.lower() == 'packet_sent':
-                # Get max ack sent
-                if 'frames' not in event_data:
-                    continue
-
-                local_max_ack = None
-                frames = event_data['frames']
-                for frame in frames:
-                    if frame['frame_type'] == 'max_stream_data':
-                        if 'maximum' in frame:
-                            max_stream_data[ts] = int(frame['maximum']) / 1024
-
-                    if 'acked_ranges' not in frame:
-                        continue
-
-                    for ack in frame['acked_ranges']:
-                        if len(ack) != 2:
-                            continue
-
-                        ack_begin = int(ack[0])
-                        ack_end = int(ack[1])
-
-                        for i in range(ack_begin, ack_end + 1):
-                            if i not in pkts_received:
-                                continue
+        if prev_pkt['dl'] < data_length:
+            prev_pkt = {'pn': pkt_num, 'dl': data_length}
+        elif prev_pkt['pn'] < pkt_num:
+            lost_packets[ts] = data_length
+            loss_count += 1
+        else:
+            print('out of order packet')
 
-                            if local_max_ack is None:
-                                local_max_ack = pkts_received[i]
+    sent = frames['direction'] == SENT
+    window = sent & (frames['frame_type'] == 'max_stream_data') & (
+        frames['maximum'] != MISSING)
+    for ts, maximum in zip(to_ms(frames['time'][window] - first_time).tolist(),
+                           frames['maximum'][window].tolist()):
+        max_stream_data[ts] = maximum / 1024
 
-                            local_max_ack = max(
-                                local_max_ack, pkts_received[i])
+    # Get max ack sent
+    acks = stream_acks(tables, started(tables, 'acks') & (tables['acks']['direction'] == SENT))
+    max_acks = max_acked(acks, packets['packet_number'][frames['packet'][stream]],
+                         (frames['offset'][stream] + frames['length'][stream]) / 1024, frames['time'][stream])
 
-                if local_max_ack is not None:
-                    ack_ts[ts] = local_max_ack
+    for packet, value in max_acks.items():
+        ack_ts[float(to_ms(packets['time'][packet] - first_time))] = value
 
     return {
         'ack_ts': ack_ts,
@@ -253,35 +200,32 @@ def analyze_qlog(filename: str) -> (dict, str):
     }, filename
 
 
+# Netlog events analyze_netlog reads, everything else is skipped unparsed
+NETLOG_EVENTS = [
+    'TCP_CONNECT',
+    'QUIC_SESSION',
+    'HTTP2_SESSION_RECV_DATA',
+    'QUIC_SESSION_STREAM_FRAME_RECEIVED',
+]
+
+
 def analyze_netlog(filename: str) -> (dict, str):
     ack_ts = {}
     rx_ts = {}
     rx_packets_ts = []
 
-    with open(filename) as f:
-        data = json.load(f)
-
-        constants = data['constants']
-        events = data['events']
-        event_types = {v: k for k,
-                       v in constants['logEventTypes'].items()}
-        source_types = {v: k for k,
-                        v in constants['logSourceType'].items()}
-        phases = {v: k for k,
-                  v in constants['logEventPhase'].items()}
+    with open_artifact(filename, 'rt') as f:
+        netlog = NetlogReader(f, NETLOG_EVENTS)
 
         start_time = None
         total_size = 0
 
-        for event in events:
-            # source_type in string
-            source_type = source_types[event['source']['type']]
+        for event in netlog:
             # source id
             source_id = event['source']['id']
-            # event_type in string
-            event_type = event_types[event['type']]
-            # phase in string
-            phase = phases[event['phase']]
+            # event_type in string, only for the wanted events
+            event_type = netlog.name(event['type'])
+            phase = event['phase']
 
             if 'params' not in event:
                 continue
@@ -294,7 +238,7 @@ def analyze_netlog(filename: str) -> (dict, str):
             if start_time is not None:
                 ts = event_time - start_time
 
-            if (event_type == 'TCP_CONNECT' or event_type == 'QUIC_SESSION') and phase == 'PHASE_BEGIN':
+            if (event_type == 'TCP_CONNECT' or event_type == 'QUIC_SESSION') and phase == netlog.phases['PHASE_BEGIN']:
                 if start_time is None:
                     start_time = event_time
 
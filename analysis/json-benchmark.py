@@ -0,0 +1,99 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+from pathlib import Path
+from artifact import open_artifact, artifact_suffix
+
+# Decoding alone, and the repo's loader for the file's format
+MODES = ['decode', 'parse']
+
+
+def file_kind(filename: str) -> str:
+    suffix = artifact_suffix(filename)
+    if suffix in ['.sqlog', '.qlog']:
+        return suffix[1:]
+
+    with open_artifact(filename) as f:
+        head = f.read(4096)
+    if b'"constants"' in head:
+        return 'netlog'
+    if head.lstrip().startswith(b'['):
+        return 'tshark'
+    return 'qlog'
+
+
+def measure(filename: str, kind: str, mode: str) -> (float, float):
+    """Seconds to decode or parse a file and the peak RSS in MB of this process"""
+    import jsonlib
+    from netlog import NetlogReader
+    from pcap import read_json
+    from qlog import parse_qlog
+
+    start = time.perf_counter()
+
+    if mode == 'decode':
+        with open_artifact(filename) as f:
+            jsonlib.load(f)
+    elif kind in ['qlog', 'sqlog']:
+        parse_qlog(filename)
+    elif kind == 'netlog':
+        with open_artifact(filename, 'rt') as f:
+            for _ in NetlogReader(f):
+                pass
+    else:
+        read_json(filename)
+
+    elapsed = time.perf_counter() - start
+
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(backend: str, filename: str, kind: str, mode: str) -> (float, float):
+    # A fresh interpreter per run, so peak RSS is that run's alone and the
+    # backend is picked at import like in an analysis
+    os.environ['ANALYSIS_JSON'] = backend
+    os.environ['ANALYSIS_CACHE'] = '0'
+
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(measure, (filename, kind, mode))
+
+
+def main():
+    import jsonlib
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='Sample qlogs, sqlogs, netlogs and tshark JSON')
+    parser.add_argument('--backends', nargs='+', default=jsonlib.available())
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--repeat', type=int, default=3, help='Report the fastest of this many runs')
+
+    args = parser.parse_args()
+
+    print('{:<40} {:<7} {:>9} {:<9} {:<7} {:>8} {:>9} {:>9}'.format(
+        'file', 'kind', 'MB', 'backend', 'mode', 's', 'MB/s', 'peak MB'))
+
+    for filename in args.files:
+        kind = file_kind(filename)
+        size = os.path.getsize(filename) / 1024 / 1024
+
+        for mode in args.modes:
+            for backend in args.backends:
+                try:
+                    runs = [run(backend, filename, kind, mode) for _ in range(args.repeat)]
+                except Exception as e:
+                    print('{:<40} {:<7} {:>9.1f} {:<9} {:<7} error {}'.format(
+                        Path(filename).name[-40:], kind, size, backend, mode, e))
+                    continue
+
+                elapsed = min([x[0] for x in runs])
+                rss = max([x[1] for x in runs])
+
+                print('{:<40} {:<7} {:>9.1f} {:<9} {:<7} {:>8.3f} {:>9.1f} {:>9.1f}'.format(
+                    Path(filename).name[-40:], kind, size, backend, mode, elapsed, size / elapsed, rss))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import importlib
+import json
+import mmap
+import os
+
+from artifact import mappable
+
+# Decoders in order of preference. The first one installed is used, unless
+# ANALYSIS_JSON names one
+BACKENDS = ['orjson', 'simdjson', 'ujson', 'json']
+
+# Backends that decode a memoryview, so mapped files are never copied
+MEMORYVIEW = ['orjson']
+
+
+def import_backend(name: str):
+    if name not in BACKENDS:
+        raise Exception('unknown JSON backend {}, use one of {}'.format(name, BACKENDS))
+    return importlib.import_module(name).loads
+
+
+def available() -> list:
+    res = []
+    for name in BACKENDS:
+        try:
+            import_backend(name)
+        except ImportError:
+            continue
+        res.append(name)
+    return res
+
+
+def select_backend(name: str = None) -> (str, object):
+    if name:
+        return name, import_backend(name)
+
+    for name in BACKENDS:
+        try:
+            return name, import_backend(name)
+        except ImportError:
+            continue
+
+
+BACKEND, backend_loads = select_backend(os.environ.get('ANALYSIS_JSON'))
+
+
+def loads(data):
+    """
+    Decode str or bytes with the selected backend. What it rejects and the
+    standard library accepts (NaN, integers beyond 64 bit) is decoded by the
+    latter, so errors are always `json.JSONDecodeError`.
+    """
+    try:
+        return backend_loads(data)
+    except ValueError:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+if BACKEND == 'json':
+    loads = json.loads
+
+
+def load(f):
+    """
+    Decode a whole binary file, mapped rather than read into a buffer when
+    it is a plain file on disk
+    """
+    if not mappable(f):
+        return loads(f.read())
+    if os.fstat(f.fileno()).st_size == 0:
+        return loads(b'')
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if BACKEND in MEMORYVIEW:
+            with memoryview(data) as view:
+                return loads(view)
+        return loads(data[:])
@@ -13,6 +13,9 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable, axes_size
 from collections import deque
 from pathlib import Path
 from glob import glob
+from artifact import artifact_files, strip_codec
+from pcap import load_packets, pcap_files
+from qlog import parse_qlog, since_start, started, to_ms, RECEIVED
 
 
 def analyze_pcap(filename: str) -> (dict, str):
@@ -22,111 +25,130 @@ def analyze_pcap(filename: str) -> (dict, str):
     rx_packets = 0
     rx_seq = set()
 
-    with open(filename) as f:
-        data = json.load(f)
+    packets = load_packets(filename)
 
-        # Associate each ACK offset with a timestamp
-        for packet in data:
-            tcp = packet['_source']['layers']['tcp']
-            srcport = tcp['tcp.srcport']
-            time = float(tcp['Timestamps']['tcp.time_relative']) * 1000
+    # Associate each ACK offset with a timestamp
+    for srcport, time, bytes_seq, bytes_len in zip(
+            *[packets[x].tolist() for x in ['srcport', 'time', 'seq', 'len']]):
+        time = time * 1000
 
-            # receive packet
-            if srcport == '443':
-                rx_packets += 1
+        # receive packet
+        if srcport == 443:
+            rx_packets += 1
 
-                end_time = max(end_time, time)
+            end_time = max(end_time, time)
 
-                bytes_seq = int(tcp['tcp.seq'])
-                bytes_len = int(tcp['tcp.len'])
-
-                if bytes_len == 0:
-                    continue
+            if bytes_len == 0:
+                continue
 
-                # Since pcap captures all packets before the filter, it will capture 'lost' packets as well
-                # So a lost packet is when we receive the same seq multiple times
-                if bytes_seq in rx_seq:
-                    losses.append({'of': bytes_seq})
-                else:
-                    rx_seq.add(bytes_seq)
+            # Since pcap captures all packets before the filter, it will capture 'lost' packets as well
+            # So a lost packet is when we receive the same seq multiple times
+            if bytes_seq in rx_seq:
+                losses.append({'of': bytes_seq})
+            else:
+                rx_seq.add(bytes_seq)
 
     losses.sort(key=lambda x: x['of'])
     return losses, end_time, rx_packets
 
 
 def analyze_qlog(filename: str):
-    start_time = None
     end_time = 0
     losses = []
-    rx_packets = 0
 
-    with open(filename) as f:
-        data = json.load(f)
-        traces = data['traces'][0]
-        events = traces['events']
-        if 'configuration' in traces:
-            time_units = traces['configuration']['time_units']
+    tables = parse_qlog(filename)
+    start_time = tables['meta']['start']
+    packets = tables['packets']
+
+    for pn in since_start(tables, 'lost')['packet_number'].tolist():
+        losses.append({'pn': pn, 'dl': 0, 'of': 0})
+
+    received = started(tables, 'packets') & (packets['direction'] == RECEIVED) & (
+        packets['frame_count'] > 0)
+    rx_packets = int(received.sum())
+    if rx_packets > 0:
+        end_time = float(to_ms(packets['time'][received].max() - start_time))
+
+    prev_pkt = {'pn': -1, 'of': -1}
+
+    # Store all stream packets received by client
+    frames = since_start(tables, 'frames')
+    stream = (frames['direction'] == RECEIVED) & (
+        frames['frame_type'] == 'stream') & (frames['stream_id'] == 0)
+
+    for pkt_num, offset in zip(packets['packet_number'][frames['packet'][stream]].tolist(),
+                               frames['offset'][stream].tolist()):
+        # if current packet offset is greater than prev packet, there is no loss
+        if prev_pkt['of'] < offset:
+            prev_pkt = {'pn': pkt_num, 'of': offset}
+        # here, current packet offset is less than or equal to prev packet
+        # in that case, current packet number is greater than prev packet number,
+        # there was loss at the offset defined in the current packet
+        elif prev_pkt['pn'] < pkt_num:
+            losses.append({'pn': pkt_num, 'of': offset})
         else:
-            time_units = 'ms'
-
-        prev_pkt = {'pn': -1, 'of': -1}
+            print('out of order packet')
 
-        # Store all stream packets received by client
-        for event in events:
-            if not event:
-                continue
+    losses.sort(key=lambda x: x['of'])
+    return losses, end_time, rx_packets
 
-            if time_units == 'ms':
-                ts = int(event[0])
-            else:
-                ts = int(event[0]) / 1000
 
-            event_type = event[2]
-            event_data = event[3]
+def load_counters(metricsdir: str) -> dict:
+    """Per-iteration counter deltas recorded by client.py, keyed by (path, client, iteration)"""
+    counters = {}
 
-            if event_type.lower() == 'packet_sent' and start_time is None:
-                start_time = ts
+    for filename in glob('{}/**/*.json'.format(metricsdir), recursive=True):
+        path = Path(filename)
+        with open(path) as f:
+            metrics = json.load(f)
 
-            if start_time is None:
-                continue
+        for i, res in enumerate(metrics):
+            if isinstance(res, dict) and 'counters' in res:
+                key = (str(path.parent.relative_to(metricsdir)), path.stem, i)
+                counters[key] = res['counters']
 
-            ts -= start_time
+    return counters
 
-            if event_type.lower() == 'packets_lost':
-                losses.append(
-                    {'pn': event_data['largest_lost_packet_num'], 'dl': 0, 'of': 0})
 
-            if event_type.lower() == 'packet_received':
+def reconcile(filename: str, basedir: str, counters: dict, losses: list) -> dict:
+    # Iteration files are <path>/<client>/<client>_<i>.<ext>
+    path = Path(filename)
+    client = path.parent.name
+    # Compressed iterations are <client>_<i>.<ext>.<codec>
+    iteration = strip_codec(path).stem.split('_')[-1]
+    if not iteration.isdigit():
+        return None
 
-                if 'frames' not in event_data:
-                    continue
+    i = int(iteration)
+    key = (str(path.parent.parent.relative_to(basedir)), client, i)
 
-                rx_packets += 1
+    if key not in counters:
+        return None
 
-                frames = event_data['frames']
-                for frame in frames:
-                    if frame['frame_type'].lower() == 'stream':
-                        if frame['stream_id'] != '0':
-                            continue
+    egress, ingress = counters[key]['egress'], counters[key]['ingress']
+    injected = egress['netem_dropped'] + ingress['netem_dropped']
+    host = sum([x['htb_dropped'] + x['dev_rx_dropped'] + x['dev_tx_dropped']
+                for x in [egress, ingress]])
 
-                        pkt_num = int(event_data['header']['packet_number'])
-                        offset = int(frame['offset'])
+    return {
+        'file': filename,
+        'observed': len(losses),
+        'injected_egress': egress['netem_dropped'],
+        'injected_ingress': ingress['netem_dropped'],
+        'host': host,
+        # Losses neither netem nor the host account for happened on the endpoint path
+        'path': max(len(losses) - injected - host, 0),
+    }
 
-                        # if current packet offset is greater than prev packet, there is no loss
-                        if prev_pkt['of'] < offset:
-                            prev_pkt = {'pn': pkt_num, 'of': offset}
-                        # here, current packet offset is less than or equal to prev packet
-                        # in that case, current packet number is greater than prev packet number,
-                        # there was loss at the offset defined in the current packet
-                        elif prev_pkt['pn'] < pkt_num:
-                            losses.append({'pn': pkt_num, 'of': offset})
-                        else:
-                            print('out of order packet')
 
-                end_time = max(end_time, ts)
+def print_reconciliation(rows: list):
+    print('{:<60} {:>9} {:>9} {:>9} {:>6} {:>6}'.format(
+        'file', 'observed', 'inj. egr', 'inj. ing', 'host', 'path'))
 
-    losses.sort(key=lambda x: x['of'])
-    return losses, end_time, rx_packets
+    for row in rows:
+        print('{:<60} {:>9} {:>9} {:>9} {:>6} {:>6}'.format(
+            row['file'][-60:], row['observed'], row['injected_egress'],
+            row['injected_ingress'], row['host'], row['path']))
 
 
 def plot(data, graph_title: str):
@@ -183,31 +205,51 @@ def main():
     parser.add_argument("--qlogdir")
     parser.add_argument("--pcapdir")
     parser.add_argument("--title")
+    parser.add_argument("--metricsdir",
+                        help="Metrics of the same runs, to reconcile observed with injected loss")
 
     args = parser.parse_args()
 
+    counters = load_counters(
+        args.metricsdir) if args.metricsdir is not None else {}
+
     if args.qlogdir is not None:
         data = []
+        rows = []
         qlogdir = args.qlogdir
-        files = glob('{}/**/*.qlog'.format(qlogdir), recursive=True)
+        files = artifact_files(qlogdir, '.qlog')
         files.sort()
         for qlog in files:
             res = analyze_qlog(qlog)
             data.append(res)
 
+            row = reconcile(qlog, qlogdir, counters, res[0])
+            if row is not None:
+                rows.append(row)
+
+        if len(rows) > 0:
+            print_reconciliation(rows)
+
         plot(
             data, f'quic-{args.title}-loss_analysis' if args.title is not None else None)
 
     if args.pcapdir is not None:
         data = []
         pcapdir = args.pcapdir
-        files = glob('{}/**/*.json'.format(pcapdir), recursive=True)
-        files.sort()
+        files = pcap_files(pcapdir)
+        rows = []
         for pcap in files:
             res = analyze_pcap(pcap)
             if len(res[0]) > 0:
                 data.append(res)
 
+            row = reconcile(pcap, pcapdir, counters, res[0])
+            if row is not None:
+                rows.append(row)
+
+        if len(rows) > 0:
+            print_reconciliation(rows)
+
         plot(
             data, f'tcp-{args.title}-loss_analysis' if args.title is not None else None)
 
@@ -1,4 +1,5 @@
 import os
+import re
 import json
 import math
 import argparse
@@ -201,6 +202,12 @@ NETWORK_V2 = [
     # },
 ]
 
+# Network dirnames swept over queue discipline and buffer size, see netem.py
+BUFFER_PATTERN = re.compile(
+    r'^(?P<network>loss-.+?_bw-\d+)(?:_qdisc-(?P<qdisc>[a-z_]+?))?(?:_buf-(?P<buf>[0-9dot]+))?$')
+# netem shapes with this queue discipline unless a profile names one
+DEFAULT_QDISC = 'pfifo'
+
 
 def facebook_patch(timings: object, sizes):
     for obj in [
@@ -571,6 +578,87 @@ def h2_vs_h3(timings: object):
         plt.close()
 
 
+def buffer_sweeps(dirnames) -> dict:
+    """
+    (buffer size in BDP, dirname) of every swept network dirname, keyed by
+    (network, qdisc). The default buffer size is infinite.
+    """
+    sweeps = {}
+    for dirname in dirnames:
+        match = BUFFER_PATTERN.match(dirname)
+        # Networks naming neither are not part of a sweep
+        if match is None or (match.group('qdisc') is None and match.group('buf') is None):
+            continue
+
+        buf = float(match.group('buf').replace('dot', '.')
+                    ) if match.group('buf') else math.inf
+        sweeps.setdefault((match.group('network'), match.group('qdisc') or DEFAULT_QDISC), []).append(
+            (buf, dirname))
+
+    return sweeps
+
+
+def buffer_regimes(timings: object):
+    """H3 vs H2 completion time for every buffer size of a (network, qdisc) sweep"""
+    sweeps = buffer_sweeps(timings)
+
+    for (network, qdisc), regimes in sweeps.items():
+        regimes.sort()
+        col_labels = ['{:g} BDP'.format(buf) if buf != math.inf else 'default'
+                      for buf, _ in regimes]
+
+        data = []
+        row_labels = []
+
+        for domain in DOMAINS:
+            for size in SINGLE_SIZES:
+                row_labels.append('{}/{}'.format(domain, size))
+                row_data = []
+
+                for _, dirname in regimes:
+                    min_h3_median = math.inf
+                    min_h2_median = math.inf
+
+                    for client, times in timings[dirname][domain][size].items():
+                        median = np.median(times)
+
+                        if client.count('h3') > 0:
+                            min_h3_median = min(min_h3_median, median)
+                        else:
+                            min_h2_median = min(min_h2_median, median)
+
+                    if min_h3_median == math.inf or min_h2_median == math.inf:
+                        row_data.append(np.nan)
+                    else:
+                        row_data.append(
+                            (min_h3_median - min_h2_median) / min_h2_median * 100)
+
+                data.append(row_data)
+
+        title = '{}_{}'.format(network, qdisc)
+        print(title)
+        fig, ax = plt.subplots(figsize=(len(regimes) + 4, len(row_labels) / 2 + 2))
+
+        im, cbar = heatmap(
+            np.array(data),
+            row_labels,
+            col_labels,
+            ax=ax,
+            cmap="bwr",
+            vmin=-25,
+            vmax=25,
+            rotation=20,
+        )
+        annotate_heatmap(
+            im, valfmt="{x:.1f}%", threshold=5, fontsize=12, fontweight=600)
+
+        ax.set_title('{} ({})'.format(network, qdisc))
+        fig.tight_layout()
+        plt.savefig(Path.joinpath(
+            GRAPHS_PATH, f'H2vsH3_Buffer_{title}'), transparent=True)
+        plt.close()
+
+
 def heatmap(data, row_labels, col_labels, ax=None, rotation=0, show_cbar=False,
             cbar_kw={}, cbarlabel="", **kwargs):
     """
@@ -743,6 +831,7 @@ def main():
         timings[dirname] = temp
 
     facebook_patch(timings, SINGLE_SIZES)
+    buffer_regimes(timings)
     # facebook_patch(timings, MULTI_SIZES)
     # h2_vs_h3(timings)
     # client_consistency(timings)
@@ -1,5 +1,4 @@
 import argparse
-import json
 import math
 import numpy as np
 import matplotlib.pyplot as plt
@@ -9,6 +8,8 @@ import random
 
 from matplotlib.ticker import StrMethodFormatter
 from glob import glob
+from artifact import open_artifact
+from netlog import NetlogReader, NetlogIndex
 from pathlib import Path
 from collections import defaultdict, deque
 from scipy import stats
@@ -53,34 +54,43 @@ def get_host_path(headers) -> str:
     raise 'No authority and path found'
 
 
-def analyze_netlog(filename):
+# Netlog events analyze_netlog reads, everything else is skipped unparsed
+NETLOG_EVENTS = [
+    'QUIC_SESSION',
+    'TCP_CONNECT',
+    'HTTP2_SESSION',
+    'HTTP2_SESSION_SEND_HEADERS',
+    'HTTP3_HEADERS_SENT',
+    'HTTP2_SESSION_RECV_DATA',
+    'HTTP3_DATA_FRAME_RECEIVED',
+]
+
+
+def analyze_netlog(filename, host=None):
     connections = {}
 
     try:
-        with open(filename) as f:
-            data = json.load(f)
-
-            constants = data['constants']
-            events = data['events']
-            event_types = {v: k for k,
-                           v in constants['logEventTypes'].items()}
-            source_types = {v: k for k,
-                            v in constants['logSourceType'].items()}
-            phases = {v: k for k,
-                      v in constants['logEventPhase'].items()}
+        with open_artifact(filename, 'rt') as f:
+            if host is None:
+                netlog = NetlogReader(f, NETLOG_EVENTS)
+                events = iter(netlog)
+            else:
+                # Only the sessions to host, plus the connects the start time is taken from
+                netlog = NetlogIndex(filename)
+                rows = np.union1d(
+                    netlog.rows(netlog.select_sources(host=host), NETLOG_EVENTS),
+                    netlog.rows(event_types=['TCP_CONNECT', 'QUIC_SESSION'], phase='PHASE_BEGIN'))
+                events = netlog.read(rows)
 
             start_time = None
             total_size = 0
 
             for event in events:
-                # source_type in string
-                source_type = source_types[event['source']['type']]
                 # source id
                 source_id = event['source']['id']
-                # event_type in string
-                event_type = event_types[event['type']]
-                # phase in string
-                phase = phases[event['phase']]
+                # event_type in string, only for the wanted events
+                event_type = netlog.name(event['type'])
+                phase = event['phase']
 
                 if 'params' not in event:
                     continue
@@ -90,7 +100,7 @@ def analyze_netlog(filename):
                 # event time
                 event_time = int(event['time'])
 
-                if event_type == 'QUIC_SESSION' and phase == 'PHASE_BEGIN':
+                if event_type == 'QUIC_SESSION' and phase == netlog.phases['PHASE_BEGIN']:
                     if start_time is None:
                         start_time = event_time
 
@@ -102,7 +112,7 @@ def analyze_netlog(filename):
                         'frame': 0
                     }
 
-                if event_type == 'TCP_CONNECT' and phase == 'PHASE_BEGIN':
+                if event_type == 'TCP_CONNECT' and phase == netlog.phases['PHASE_BEGIN']:
                     if start_time is None:
                         start_time = event_time
 
@@ -312,7 +322,7 @@ def main():
     host = args.host
     title = args.title
 
-    conns = analyze_netlog(str(netlog))
+    conns = analyze_netlog(str(netlog), host)
 
     plot(
         conns, f'{title}_{"h3" if str(netlog).count("h3") > 0 else "h2"}', host=host)
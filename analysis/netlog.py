@@ -0,0 +1,495 @@
+import argparse
+import functools
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import numpy as np
+
+from pathlib import Path
+from artifact import open_artifact, mappable, codec_open, detect, artifact_files
+from jsonlib import loads
+
+# Chrome writes one event per line, keys sorted, so an event's own type is
+# the last key. Events whose type is not wanted are skipped on this match
+# without being decoded
+TYPE_PATTERN = re.compile(r'"type":\s*(\d+)\s*\}\s*,?\s*$')
+
+HEADER_PATTERN = re.compile(r'"(constants|events)"\s*:\s*')
+
+# Give up on a header or multi-line event larger than this
+MAX_EVENT = 64 * 1024 * 1024
+
+# Sidecar next to every indexed netlog
+INDEX_SUFFIX = '.index.npz'
+INDEX_VERSION = 1
+
+# Params naming the host a source talks to, in order of preference
+HOST_PARAMS = ['host', 'server_id', 'url']
+
+# The constants of a Chrome build are the same in every netlog it writes.
+# Archived netlogs keep only the keys below, which change from run to run,
+# and the hash of the rest, stored once in a directory of this name above
+# them (or in ANALYSIS_NETLOG_CONSTANTS)
+CONSTANTS_DIR = 'netlog-constants'
+CONSTANTS_ENV = 'ANALYSIS_NETLOG_CONSTANTS'
+CONSTANTS_REF = 'constantsRef'
+RUN_CONSTANTS = ['activeFieldTrialGroups', 'clientInfo', 'timeTickOffset']
+
+
+def constants_key(shared: dict) -> str:
+    text = json.dumps(shared, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def save_constants(directory: str, shared: dict) -> str:
+    """Adds constants to the store at `directory`, returns their key"""
+    key = constants_key(shared)
+    path = Path.joinpath(Path(directory), '{}.json'.format(key))
+
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name('{}.{}.tmp'.format(path.name, os.getpid()))
+        with open(tmp, mode='w') as f:
+            json.dump(shared, f)
+        os.replace(tmp, path)
+
+    return key
+
+
+@functools.lru_cache(maxsize=None)
+def find_constants(directory: str) -> Path:
+    """The store of the netlogs in `directory`, the nearest one above it"""
+    if os.environ.get(CONSTANTS_ENV):
+        return Path(os.environ[CONSTANTS_ENV])
+
+    path = Path(directory).resolve()
+    for parent in [path] + list(path.parents):
+        store = Path.joinpath(parent, CONSTANTS_DIR)
+        if store.is_dir():
+            return store
+    return None
+
+
+def compile_tables(constants: dict) -> tuple:
+    """Event type, source type and phase lookups, by name and by id"""
+    tables = []
+    for key in ['logEventTypes', 'logSourceType', 'logEventPhase']:
+        tables.append(constants[key])
+        tables.append({v: k for k, v in constants[key].items()})
+    return tuple(tables)
+
+
+@functools.lru_cache(maxsize=None)
+def shared_tables(store: Path, key: str) -> tuple:
+    """Tables of stored constants, compiled once per process"""
+    path = Path.joinpath(store, '{}.json'.format(key))
+    with open(path) as f:
+        return compile_tables(json.load(f))
+
+
+class NetlogConstants:
+    """
+    Name and id lookups over the `constants` block of a netlog. A reference
+    to stored constants is resolved from the store above `filename`.
+    """
+
+    def __init__(self, constants: dict, filename: str = None):
+        self.constants = constants
+
+        key = constants.get(CONSTANTS_REF)
+        if key is None:
+            tables = compile_tables(constants)
+        else:
+            store = find_constants(str(Path(filename or '.').parent))
+            if store is None or not Path.joinpath(store, '{}.json'.format(key)).exists():
+                raise Exception('netlog constants {} not found, set {} to their store'.format(key, CONSTANTS_ENV))
+            tables = shared_tables(store, key)
+
+        self.event_types, self.names, self.source_types, self.source_names, self.phases, self.phase_names = tables
+
+    def id(self, event_type: str) -> int:
+        return self.event_types.get(event_type)
+
+    def name(self, event_type: int) -> str:
+        return self.names[event_type]
+
+    def ids(self, event_types: list) -> set:
+        return set([self.event_types[x] for x in event_types if x in self.event_types])
+
+
+class NetlogReader(NetlogConstants):
+    """
+    Streams the events of a Chrome netlog. `constants` is decoded first and
+    the wanted `event_types` are compiled to their integer ids. Events of
+    other types are dropped before they are decoded, so memory stays
+    bounded and only wanted events are decoded, by the fastest JSON
+    backend installed (see `jsonlib`).
+    """
+
+    def __init__(self, f, event_types: list = None, max_event: int = MAX_EVENT):
+        self.f = f
+        self.max_event = max_event
+        self.decoder = json.JSONDecoder()
+        self.rest = ''
+        # Byte offset of the first event line
+        self.offset = 0
+
+        super().__init__(self.read_header(), getattr(f, 'name', None))
+
+        self.wanted = None
+        if event_types is not None:
+            self.wanted = self.ids(event_types)
+
+    def read_header(self) -> dict:
+        buffer = ''
+        pos = 0
+        constants = None
+
+        while True:
+            match = HEADER_PATTERN.search(buffer, pos)
+
+            if match is not None and match.group(1) == 'events':
+                if constants is None:
+                    raise Exception('netlog constants must precede its events')
+                # Everything after the opening bracket belongs to the events
+                self.rest = buffer[match.end():].lstrip()[1:]
+                self.offset -= len(self.rest.encode())
+                return constants
+
+            if match is not None:
+                try:
+                    constants, pos = self.decoder.raw_decode(
+                        buffer, match.end())
+                    continue
+                except json.JSONDecodeError:
+                    pass
+
+            line = self.f.readline()
+            if not line or len(buffer) > self.max_event:
+                raise Exception('netlog has no events')
+            buffer += line
+            self.offset += len(line.encode())
+
+    def lines(self):
+        offset = self.offset
+        if self.rest.strip():
+            yield offset, self.rest
+        offset += len(self.rest.encode())
+
+        for line in self.f:
+            yield offset, line
+            offset += len(line.encode())
+
+    def records(self):
+        """
+        Yields the byte offset, byte length and decoded event of every
+        wanted event. Offsets only hold for files opened with newline=''
+        """
+        pending = ''
+        start = 0
+
+        for offset, line in self.lines():
+            if pending:
+                pending += line
+                try:
+                    event, _ = self.decoder.raw_decode(pending.strip().lstrip(','))
+                except json.JSONDecodeError:
+                    if len(pending) > self.max_event:
+                        raise
+                    continue
+                line = pending
+                offset = start
+                pending = ''
+            else:
+                text = line.strip()
+                if text in ['', ',']:
+                    continue
+                # End of the events array, the rest is polled data
+                if text.startswith(']'):
+                    return
+
+                match = TYPE_PATTERN.search(text)
+                if match is not None and self.wanted is not None and int(match.group(1)) not in self.wanted:
+                    continue
+
+                try:
+                    event = loads(text.rstrip(','))
+                except json.JSONDecodeError:
+                    # An event spread over several lines
+                    pending = line
+                    start = offset
+                    continue
+
+            if self.wanted is None or event.get('type') in self.wanted:
+                yield offset, len(line.encode()), event
+
+    def __iter__(self):
+        for _, _, event in self.records():
+            yield event
+
+
+def split_constants(filename: str, root: str) -> str:
+    """
+    Moves the constants of a netlog to the store under `root`, a directory
+    above it, and leaves a reference in their place. The netlog is rewritten
+    with the codec it was compressed with. Returns the key of its constants.
+    """
+    with open_artifact(filename, 'rt', newline='') as f:
+        netlog = NetlogReader(f)
+        if CONSTANTS_REF in netlog.constants:
+            return netlog.constants[CONSTANTS_REF]
+
+        shared = {k: v for k, v in netlog.constants.items() if k not in RUN_CONSTANTS}
+        reference = {k: v for k, v in netlog.constants.items() if k in RUN_CONSTANTS}
+        reference[CONSTANTS_REF] = save_constants(Path.joinpath(Path(root), CONSTANTS_DIR), shared)
+
+        codec = detect(filename)
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+        with (open(tmp, mode='w', newline='') if codec is None else codec_open(codec, tmp, 'wt', newline='')) as out:
+            out.write('{{"constants":{},\n"events": ['.format(json.dumps(reference)))
+            out.write(netlog.rest)
+            shutil.copyfileobj(f, out)
+
+    os.replace(tmp, filename)
+
+    return reference[CONSTANTS_REF]
+
+
+def netlog_files(netlogdir: str) -> list:
+    """Netlogs under `netlogdir`, compressed or not, leaving out stored constants"""
+    return [x for x in artifact_files(netlogdir, '.json')
+            if CONSTANTS_DIR not in Path(x).relative_to(netlogdir).parts]
+
+
+def index_path(filename: str) -> str:
+    return str(filename) + INDEX_SUFFIX
+
+
+def build_index(filename: str) -> dict:
+    """
+    Scans a netlog once and records where every event is in the file.
+    `events` is in file order, `sources` has one row per source id with its
+    type, time range, host and the rows of its events in `order`.
+    """
+    columns = {
+        'offset': [],
+        'length': [],
+        'source': [],
+        'type': [],
+        'phase': [],
+        'time': [],
+    }
+    hosts = {}
+    source_types = {}
+
+    with open_artifact(filename, 'rt', newline='') as f:
+        netlog = NetlogReader(f)
+
+        for offset, length, event in netlog.records():
+            source = event['source']
+
+            columns['offset'].append(offset)
+            columns['length'].append(length)
+            columns['source'].append(source['id'])
+            columns['type'].append(event['type'])
+            columns['phase'].append(event['phase'])
+            columns['time'].append(int(event['time']))
+
+            source_types.setdefault(source['id'], source['type'])
+
+            if source['id'] not in hosts and 'params' in event:
+                for key in HOST_PARAMS:
+                    if isinstance(event['params'].get(key), str):
+                        hosts[source['id']] = event['params'][key]
+                        break
+
+    events = {
+        'offset': np.array(columns['offset'], dtype=np.int64),
+        'length': np.array(columns['length'], dtype=np.int64),
+        'source': np.array(columns['source'], dtype=np.int64),
+        'type': np.array(columns['type'], dtype=np.int32),
+        'phase': np.array(columns['phase'], dtype=np.int8),
+        'time': np.array(columns['time'], dtype=np.int64),
+    }
+
+    # Rows grouped by source, each group in file order
+    order = np.argsort(events['source'], kind='stable')
+    ids, first, count = np.unique(events['source'][order], return_index=True, return_counts=True)
+
+    sources = {
+        'id': ids,
+        'type': np.array([source_types[x] for x in ids], dtype=np.int32),
+        'start': np.minimum.reduceat(events['time'][order], first) if len(ids) > 0 else np.array([], dtype=np.int64),
+        'end': np.maximum.reduceat(events['time'][order], first) if len(ids) > 0 else np.array([], dtype=np.int64),
+        'host': np.array([hosts.get(x, '') for x in ids], dtype=str),
+        'first': first.astype(np.int64),
+        'count': count.astype(np.int64),
+    }
+
+    return {
+        'constants': netlog.constants,
+        'events': events,
+        'sources': sources,
+        'order': order.astype(np.int64),
+    }
+
+
+def save_index(filename: str, index: dict, stat: os.stat_result):
+    arrays = {
+        'version': np.array(INDEX_VERSION),
+        'size': np.array(stat.st_size),
+        'mtime': np.array(stat.st_mtime_ns),
+        'constants': np.array(json.dumps(index['constants'])),
+        'order': index['order'],
+    }
+    for table in ['events', 'sources']:
+        for key, value in index[table].items():
+            arrays['{}_{}'.format(table, key)] = value
+
+    np.savez(index_path(filename), **arrays)
+
+
+def load_index(filename: str) -> dict:
+    """
+    The index of a netlog, read from its sidecar when that is still
+    current and built (and saved next to the netlog) otherwise
+    """
+    stat = os.stat(filename)
+
+    try:
+        with np.load(index_path(filename)) as data:
+            if int(data['version']) == INDEX_VERSION \
+                    and int(data['size']) == stat.st_size \
+                    and int(data['mtime']) == stat.st_mtime_ns:
+                index = {
+                    'constants': json.loads(str(data['constants'])),
+                    'events': {},
+                    'sources': {},
+                    'order': data['order'],
+                }
+                for key in data.files:
+                    table, _, column = key.partition('_')
+                    if table in ['events', 'sources']:
+                        index[table][column] = data[key]
+                return index
+    except (OSError, KeyError, ValueError):
+        pass
+
+    index = build_index(filename)
+
+    try:
+        save_index(filename, index, stat)
+    except OSError as e:
+        print('Could not save netlog index for', filename, e)
+
+    return index
+
+
+class NetlogIndex(NetlogConstants):
+    """
+    Random access into a netlog through its index. Queries select sources
+    and event rows from the index and only the selected events are read
+    back and decoded.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.index = load_index(filename)
+        self.events = self.index['events']
+        self.sources = self.index['sources']
+
+        super().__init__(self.index['constants'], filename)
+
+    def select_sources(self, source_type: str = None, host: str = None, source_ids: list = None) -> np.ndarray:
+        """Positions in `sources` of the matching sources"""
+        mask = np.ones(len(self.sources['id']), dtype=bool)
+
+        if source_type is not None:
+            mask &= self.sources['type'] == self.source_types.get(source_type, -1)
+        if host is not None:
+            # HTTP2 sessions carry host:port, QUIC sessions the bare host
+            hosts = np.array([x.split(':')[0] for x in self.sources['host']], dtype=str)
+            mask &= (self.sources['host'] == host) | (hosts == host)
+        if source_ids is not None:
+            mask &= np.isin(self.sources['id'], source_ids)
+
+        return np.flatnonzero(mask)
+
+    def rows(self, sources: np.ndarray = None, event_types: list = None, phase: str = None) -> np.ndarray:
+        """Event rows, in file order, of the given sources and types"""
+        if sources is None:
+            rows = np.arange(len(self.events['offset']))
+        else:
+            order = self.index['order']
+            rows = np.concatenate([order[self.sources['first'][x]:self.sources['first'][x] + self.sources['count'][x]]
+                                   for x in sources]) if len(sources) > 0 else np.array([], dtype=np.int64)
+
+        if event_types is not None:
+            rows = rows[np.isin(self.events['type'][rows], list(self.ids(event_types)))]
+        if phase is not None:
+            rows = rows[self.events['phase'][rows] == self.phases[phase]]
+
+        return np.sort(rows)
+
+    def read(self, rows: np.ndarray):
+        """
+        Decodes the events at `rows`, in the order given. Offsets are into
+        the decompressed netlog, so compressed netlogs are best read in
+        file order
+        """
+        with open_artifact(self.filename) as f:
+            if not mappable(f):
+                for row in rows:
+                    f.seek(self.events['offset'][row])
+                    yield loads(f.read(self.events['length'][row]).strip().rstrip(b','))
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for row in rows:
+                    offset = self.events['offset'][row]
+                    event = data[offset:offset + self.events['length'][row]]
+                    yield loads(event.strip().rstrip(b','))
+
+    def query(self, event_types: list = None, source_type: str = None, host: str = None,
+              source_ids: list = None, phase: str = None):
+        """
+        Events of the given types from the matching sources, e.g. every
+        HTTP3 event of the QUIC_SESSION to one host
+        """
+        sources = None
+        if source_type is not None or host is not None or source_ids is not None:
+            sources = self.select_sources(source_type, host, source_ids)
+
+        return self.read(self.rows(sources, event_types, phase))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('netlog', nargs='+')
+    parser.add_argument('--split-constants', metavar='ROOT',
+                        help='Move the constants of the netlogs to the store under ROOT, a directory above them')
+
+    args = parser.parse_args()
+
+    if args.split_constants is not None:
+        for filename in args.netlog:
+            print(filename, split_constants(filename, args.split_constants))
+        return
+
+    for filename in args.netlog:
+        netlog = NetlogIndex(filename)
+        sources = netlog.sources
+        source_names = netlog.source_names
+
+        print(filename, len(netlog.events['offset']), 'events', len(sources['id']), 'sources')
+        for i in range(len(sources['id'])):
+            print('{:>8} {:<24} {:>8} {:>8} {:>6} {}'.format(
+                sources['id'][i], source_names.get(sources['type'][i], sources['type'][i]),
+                sources['start'][i], sources['end'][i], sources['count'][i], sources['host'][i]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import re
+
+from multiprocessing import Pool
+from pathlib import Path
+from artifact import open_artifact, strip_codec
+from netlog import NetlogReader, netlog_files
+
+QLOG_VERSION = 'draft-02'
+EVENT_FIELDS = ['relative_time', 'category', 'event', 'data']
+
+# Chrome frame events are QUIC_SESSION_<frame>_FRAME_SENT/RECEIVED
+FRAME_PATTERN = re.compile(r'^QUIC_SESSION_(\w+)_FRAME_(SENT|RECEIVED)$')
+
+FRAME_TYPES = {
+    'STREAM': 'stream',
+    'ACK': 'ack',
+    'WINDOW_UPDATE': 'max_stream_data',
+    'BLOCKED': 'stream_data_blocked',
+    'RST_STREAM': 'reset_stream',
+    'STOP_SENDING': 'stop_sending',
+    'CONNECTION_CLOSE': 'connection_close',
+    'GOAWAY': 'goaway',
+    'PING': 'ping',
+    'PADDING': 'padding',
+    'CRYPTO': 'crypto',
+    'HANDSHAKE_DONE': 'handshake_done',
+    'MAX_STREAMS': 'max_streams',
+    'STREAMS_BLOCKED': 'streams_blocked',
+    'NEW_CONNECTION_ID': 'new_connection_id',
+    'RETIRE_CONNECTION_ID': 'retire_connection_id',
+    'NEW_TOKEN': 'new_token',
+    'MESSAGE': 'datagram',
+}
+
+PACKET_EVENTS = [
+    'QUIC_SESSION',
+    'QUIC_SESSION_PACKET_SENT',
+    'QUIC_SESSION_PACKET_RECEIVED',
+    'QUIC_SESSION_UNAUTHENTICATED_PACKET_HEADER_RECEIVED',
+    'QUIC_SESSION_PACKET_LOST',
+]
+FRAME_EVENTS = ['QUIC_SESSION_{}_FRAME_{}'.format(x, y)
+                for x in FRAME_TYPES for y in ['SENT', 'RECEIVED']]
+
+PACKET_TYPES = {
+    'INITIAL': 'initial',
+    'HANDSHAKE': 'handshake',
+    'ZERO_RTT_PROTECTED': '0RTT',
+    'RETRY': 'retry',
+    'ENCRYPTION_INITIAL': 'initial',
+    'ENCRYPTION_HANDSHAKE': 'handshake',
+    'ENCRYPTION_ZERO_RTT': '0RTT',
+    'ENCRYPTION_FORWARD_SECURE': '1RTT',
+}
+
+# Connection level window updates use the invalid stream id
+CONNECTION_STREAM = 2 ** 32 - 1
+
+
+def acked_ranges(params: dict) -> list:
+    """
+    Chrome logs the largest acked packet and the missing ones below it, qlog
+    the acknowledged ranges
+    """
+    largest = params.get('largest_observed')
+    if largest is None:
+        return []
+
+    lowest = params.get('smallest_observed', 0)
+    ranges = []
+    begin = lowest
+
+    for missing in sorted(set(params.get('missing_packets', []))):
+        if missing < begin or missing > largest:
+            continue
+        if missing > begin:
+            ranges.append([begin, missing - 1])
+        begin = missing + 1
+
+    if begin <= largest:
+        ranges.append([begin, largest])
+
+    return ranges
+
+
+def convert_frame(frame: str, params: dict) -> dict:
+    frame_type = FRAME_TYPES[frame]
+    res = {'frame_type': frame_type}
+
+    if 'stream_id' in params:
+        res['stream_id'] = params['stream_id']
+
+    if frame_type == 'stream':
+        res['offset'] = params.get('offset', 0)
+        res['length'] = params.get('length', 0)
+        res['fin'] = params.get('fin', False)
+    elif frame_type == 'crypto':
+        res['offset'] = params.get('offset', 0)
+        res['length'] = params.get('data_length', params.get('length', 0))
+    elif frame_type == 'ack':
+        res['acked_ranges'] = acked_ranges(params)
+        if 'delta_time_largest_observed_us' in params:
+            res['ack_delay'] = params['delta_time_largest_observed_us'] / 1000
+    elif frame_type == 'max_stream_data':
+        res['maximum'] = params.get('byte_offset')
+        if params.get('stream_id', -1) in [CONNECTION_STREAM, -1]:
+            res['frame_type'] = 'max_data'
+            res.pop('stream_id', None)
+    elif frame_type == 'max_streams':
+        res['maximum'] = params.get('stream_count')
+
+    return res
+
+
+class SessionConverter:
+    """
+    Builds the qlog trace of one QUIC session from its netlog events.
+
+    Received frames follow the header of the packet they came in, sent
+    frames are logged before their packet. Netlog times are ms, and Chrome
+    logs no congestion window, so only the latest RTT is derived from the
+    ACKs received.
+    """
+
+    def __init__(self, source_id: int, host: str, start: int):
+        self.source_id = source_id
+        self.host = host
+        self.start = start
+        self.events = []
+        self.received = 0
+        self.sent_times = {}
+        self.sent_frames = []
+        self.packet = None
+        self.size = None
+
+    def append(self, time: int, category: str, event_type: str, data: dict):
+        self.events.append([time - self.start, category, event_type, data])
+
+    def add(self, event_type: str, time: int, params: dict):
+        if event_type == 'QUIC_SESSION_PACKET_SENT':
+            number = params.get('packet_number')
+            self.sent_times[number] = time
+            self.append(time, 'transport', 'packet_sent', {
+                'packet_type': PACKET_TYPES.get(params.get('encryption_level'), '1RTT'),
+                'header': {
+                    'packet_number': number,
+                    'packet_size': params.get('size'),
+                },
+                'frames': self.sent_frames,
+            })
+            self.sent_frames = []
+        elif event_type == 'QUIC_SESSION_PACKET_RECEIVED':
+            self.size = params.get('size')
+        elif event_type == 'QUIC_SESSION_UNAUTHENTICATED_PACKET_HEADER_RECEIVED':
+            self.received += 1
+            packet_type = PACKET_TYPES.get(params.get('long_header_type'), '1RTT')
+            self.packet = {
+                'packet_type': packet_type,
+                'header': {
+                    'packet_number': params.get('packet_number'),
+                    'packet_size': self.size,
+                },
+                'frames': [],
+            }
+            self.size = None
+            self.append(time, 'transport', 'packet_received', self.packet)
+        elif event_type == 'QUIC_SESSION_PACKET_LOST':
+            self.append(time, 'recovery', 'packet_lost', {
+                'header': {
+                    'packet_number': params.get('packet_number'),
+                },
+                'trigger': params.get('transmission_type'),
+            })
+        else:
+            match = FRAME_PATTERN.match(event_type)
+            if match is None:
+                return
+
+            frame = convert_frame(match.group(1), params)
+
+            if match.group(2) == 'SENT':
+                self.sent_frames.append(frame)
+                return
+
+            if self.packet is not None:
+                self.packet['frames'].append(frame)
+
+            if frame['frame_type'] == 'ack':
+                self.add_rtt(time, params)
+
+    def add_rtt(self, time: int, params: dict):
+        sent = self.sent_times.get(params.get('largest_observed'))
+        if sent is None:
+            return
+
+        rtt = time - sent - params.get('delta_time_largest_observed_us', 0) / 1000
+        if rtt < 0:
+            return
+
+        self.append(time, 'recovery', 'metrics_updated', {'latest_rtt': rtt})
+
+    def trace(self, title: str) -> dict:
+        return {
+            'vantage_point': {
+                'name': 'chrome',
+                'type': 'client',
+            },
+            'title': title,
+            'description': '{} (netlog source {})'.format(self.host, self.source_id),
+            'configuration': {
+                'time_units': 'ms',
+            },
+            'common_fields': {
+                'reference_time': self.start,
+            },
+            'event_fields': EVENT_FIELDS,
+            'events': self.events,
+        }
+
+
+def convert_netlog(filename: str, host: str = None) -> dict:
+    """
+    A qlog of the QUIC session to `host` in a Chrome netlog, or of the session
+    that received the most packets
+    """
+    sessions = {}
+
+    with open_artifact(filename, 'rt') as f:
+        netlog = NetlogReader(f, PACKET_EVENTS + FRAME_EVENTS)
+        session_type = netlog.id('QUIC_SESSION')
+        phase_begin = netlog.phases['PHASE_BEGIN']
+
+        for event in netlog:
+            source_id = event['source']['id']
+            time = int(event['time'])
+            params = event.get('params', {})
+
+            if event['type'] == session_type:
+                if event['phase'] == phase_begin and (host is None or params.get('host') == host):
+                    sessions[source_id] = SessionConverter(source_id, params.get('host'), time)
+                continue
+
+            if source_id in sessions:
+                sessions[source_id].add(netlog.name(event['type']), time, params)
+
+    if len(sessions) == 0:
+        return None
+
+    session = max(sessions.values(), key=lambda x: x.received)
+    title = strip_codec(filename).stem
+
+    return {
+        'qlog_version': QLOG_VERSION,
+        'title': title,
+        'traces': [session.trace(title)],
+    }
+
+
+def qlog_path(filename: str, netlogdir: str = None, outdir: str = None) -> Path:
+    if outdir is None:
+        return strip_codec(filename).with_suffix('.qlog')
+    return Path.joinpath(Path(outdir), strip_codec(filename).relative_to(netlogdir)).with_suffix('.qlog')
+
+
+def convert(job: tuple) -> (str, str):
+    filename, output, host = job
+
+    try:
+        qlog = convert_netlog(filename, host)
+    except Exception as e:
+        return filename, 'error {}'.format(e)
+
+    if qlog is None:
+        return filename, 'no QUIC session'
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, mode='w') as f:
+        json.dump(qlog, f, separators=(',', ':'))
+
+    return filename, str(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('netlogdir')
+    parser.add_argument('--outdir', help='Mirror the netlog directory here instead of writing next to each netlog')
+    parser.add_argument('--host', help='Convert the QUIC session to this host')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--force', action='store_true',
+                        help='Convert netlogs that already have an up to date qlog')
+
+    args = parser.parse_args()
+
+    netlogdir = Path.joinpath(Path.cwd(), args.netlogdir)
+    files = [netlogdir] if netlogdir.is_file() else \
+        [Path(x) for x in netlog_files(netlogdir)]
+
+    jobs = []
+    for filename in files:
+        output = qlog_path(filename, netlogdir if netlogdir.is_dir() else netlogdir.parent, args.outdir)
+        if not args.force and output.exists() and output.stat().st_mtime >= filename.stat().st_mtime:
+            continue
+        jobs.append((filename, output, args.host))
+
+    with Pool(args.processes) as pool:
+        for filename, res in pool.imap_unordered(convert, jobs):
+            print(filename, res)
+
+
+if __name__ == "__main__":
+    main()
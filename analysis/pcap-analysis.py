@@ -1,6 +1,5 @@
 import argparse
 import sys
-import json
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
@@ -11,6 +10,10 @@ from matplotlib.ticker import StrMethodFormatter
 from collections import deque
 from pathlib import Path
 from glob import glob
+from netlog import NetlogReader
+from artifact import open_artifact
+from pcap import load_packets, decode_quic
+from qlog import parse_qlog, since_start, SENT, RECEIVED
 
 BLUE = deque(['#0000FF', '#0000B3', '#0081B3',
               '#14293D', '#A7DFE2', '#8ED9CD'])
@@ -26,27 +29,25 @@ YELLOW = deque(['#FFFF00', '#DCFF20', '#DCC05A'])
 PURPLE = deque(['#6A00CD', '#A100CD', '#7653DE'])
 
 
-def analyze_pcap(filename: str) -> (dict, str):
+def analyze_pcap(filename: str, port: int = 30000, keylog: str = None) -> (dict, str):
+    # With the TLS keys the QUIC packets themselves can be counted
+    if keylog is not None:
+        return analyze_tables(decode_quic(filename, keylog, port)), filename
+
     tx_packets = 0
     rx_packets = 0
 
-    with open(filename) as f:
-        data = json.load(f)
-
-        # Associate each ACK offset with a timestamp
-        for packet in data:
-            udp = packet['_source']['layers']['udp']
-            srcport = udp['udp.srcport']
-            dstport = udp['udp.dstport']
-            time = float(udp['Timestamps']['udp.time_relative']) * 1000
+    packets = load_packets(filename)
 
-            # receive packet
-            if srcport == '30000':
-                rx_packets += 1
+    # Associate each ACK offset with a timestamp
+    for srcport in packets['srcport'].tolist():
+        # receive packet
+        if srcport == port:
+            rx_packets += 1
 
-            # send packet
-            else:
-                tx_packets += 1
+        # send packet
+        else:
+            tx_packets += 1
 
     return {
         'tx_packets': tx_packets,
@@ -54,67 +55,47 @@ def analyze_pcap(filename: str) -> (dict, str):
     }, filename
 
 
-def analyze_qlog(filename: str) -> (dict, str):
-    tx_packets = 0
-    rx_packets = 0
+def analyze_tables(tables: dict) -> dict:
     lost_packets = []
 
-    with open(filename) as f:
-        data = json.load(f)
-        traces = data['traces'][0]
-        events = traces['events']
-        if 'configuration' in traces:
-            time_units = traces['configuration']['time_units']
-        else:
-            time_units = 'ms'
+    packets = since_start(tables, 'packets')
 
-        prev_rx_ptype = None
-        prev_rx_pn = None
-        first_time = None
-
-        # Store all stream packets received by client
-        for event in events:
-            if not event:
-                continue
-
-            if time_units == 'ms':
-                ts = int(event[0])
-            else:
-                ts = int(event[0]) / 1000
+    received = packets['direction'] == RECEIVED
+    tx_packets = int((packets['direction'] == SENT).sum())
+    rx_packets = int(received.sum())
 
-            event_type = event[2]
-            event_data = event[3]
+    prev_rx_ptype = None
+    prev_rx_pn = None
 
-            if event_type.lower() == 'packet_sent' and first_time is None:
-                first_time = ts
+    for ptype, pn in zip(packets['packet_type'][received].tolist(),
+                         packets['packet_number'][received].tolist()):
+        if prev_rx_pn is not None \
+                and ptype == prev_rx_ptype \
+                and pn != prev_rx_pn + 1:
+            lost_packets.append(prev_rx_pn + 1)
 
-            if first_time is None:
-                continue
-
-            ts -= first_time
-
-            if event_type.lower() == 'packet_received':
-                rx_packets += 1
-
-                ptype = event_data['packet_type']
-                pn = int(event_data['header']['packet_number'])
-
-                if prev_rx_pn is not None \
-                        and ptype == prev_rx_ptype \
-                        and pn != prev_rx_pn + 1:
-                    lost_packets.append(prev_rx_pn + 1)
-
-                prev_rx_ptype = ptype
-                prev_rx_pn = pn
-
-            if event_type.lower() == 'packet_sent':
-                tx_packets += 1
+        prev_rx_ptype = ptype
+        prev_rx_pn = pn
 
     return {
         'tx_packets': tx_packets,
         'rx_packets': rx_packets,
         'lost_packets': lost_packets
-    }, filename
+    }
+
+
+def analyze_qlog(filename: str) -> (dict, str):
+    return analyze_tables(parse_qlog(filename)), filename
+
+
+# Netlog events analyze_netlog reads, everything else is skipped unparsed
+NETLOG_EVENTS = [
+    'TCP_CONNECT',
+    'QUIC_SESSION',
+    'QUIC_SESSION_PACKET_SENT',
+    'QUIC_SESSION_UNAUTHENTICATED_PACKET_HEADER_RECEIVED',
+    'QUIC_SESSION_STREAM_FRAME_RECEIVED',
+]
 
 
 def analyze_netlog(filename: str) -> (dict, str):
@@ -122,31 +103,19 @@ def analyze_netlog(filename: str) -> (dict, str):
     rx_packets = 0
     lost_packets = []
 
-    with open(filename) as f:
-        data = json.load(f)
-
-        constants = data['constants']
-        events = data['events']
-        event_types = {v: k for k,
-                       v in constants['logEventTypes'].items()}
-        source_types = {v: k for k,
-                        v in constants['logSourceType'].items()}
-        phases = {v: k for k,
-                  v in constants['logEventPhase'].items()}
+    with open_artifact(filename, 'rt') as f:
+        netlog = NetlogReader(f, NETLOG_EVENTS)
 
         start_time = None
         prev_rx_pn = None
         prev_rx_pt = None
 
-        for event in events:
-            # source_type in string
-            source_type = source_types[event['source']['type']]
+        for event in netlog:
             # source id
             source_id = event['source']['id']
-            # event_type in string
-            event_type = event_types[event['type']]
-            # phase in string
-            phase = phases[event['phase']]
+            # event_type in string, only for the wanted events
+            event_type = netlog.name(event['type'])
+            phase = event['phase']
 
             if 'params' not in event:
                 continue
@@ -159,7 +128,7 @@ def analyze_netlog(filename: str) -> (dict, str):
             if start_time is not None:
                 ts = event_time - start_time
 
-            if (event_type == 'TCP_CONNECT' or event_type == 'QUIC_SESSION') and phase == 'PHASE_BEGIN':
+            if (event_type == 'TCP_CONNECT' or event_type == 'QUIC_SESSION') and phase == netlog.phases['PHASE_BEGIN']:
                 if start_time is None:
                     start_time = event_time
 
@@ -197,6 +166,8 @@ def main():
     parser.add_argument("--qlog")
     parser.add_argument("--netlog")
     parser.add_argument("--pcap")
+    parser.add_argument("--port", type=int, default=30000)
+    parser.add_argument("--keylog", help='TLS key log to decrypt the QUIC packets of the pcap with')
 
     args = parser.parse_args()
 
@@ -214,7 +185,7 @@ def main():
 
     if args.pcap is not None:
         pcappath = Path.joinpath(Path.cwd(), args.pcap)
-        pcap_data = analyze_pcap(pcappath)
+        pcap_data = analyze_pcap(pcappath, args.port, args.keylog)
 
     print('qlog', qlog_data)
     print('netlog', netlog_data)
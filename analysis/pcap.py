@@ -0,0 +1,862 @@
+import json
+import os
+import struct
+import subprocess
+import numpy as np
+
+from array import array
+from glob import glob
+from pathlib import Path
+from artifact import open_artifact, artifact_files, artifact_suffix, strip_codec
+from cache import cached
+from qlog import TableBuilder
+
+# Placeholder for integer fields a packet does not carry
+MISSING = -1
+
+# tshark field, column and type of the per-packet columns of each protocol
+TCP_FIELDS = [
+    ('tcp.time_relative', 'time', np.float64),
+    ('tcp.srcport', 'srcport', np.int32),
+    ('tcp.dstport', 'dstport', np.int32),
+    ('tcp.seq', 'seq', np.int64),
+    ('tcp.nxtseq', 'nxtseq', np.int64),
+    ('tcp.ack', 'ack', np.int64),
+    ('tcp.len', 'len', np.int64),
+    ('tcp.window_size', 'window_size', np.int64),
+    ('tcp.flags.syn', 'syn', np.int8),
+    ('tcp.flags.fin', 'fin', np.int8),
+    ('tcp.analysis.initial_rtt', 'initial_rtt', np.float64),
+    ('tcp.analysis.acks_frame', 'acks_frame', np.int64),
+    ('tcp.analysis.ack_rtt', 'ack_rtt', np.float64),
+    ('tcp.options.timestamp.tsval', 'tsval', np.int64),
+    ('tcp.options.timestamp.tsecr', 'tsecr', np.int64),
+]
+
+UDP_FIELDS = [
+    ('udp.time_relative', 'time', np.float64),
+    ('udp.srcport', 'srcport', np.int32),
+    ('udp.dstport', 'dstport', np.int32),
+    ('udp.length', 'len', np.int64),
+]
+
+# Fields with any number of values per packet. They are stored flat, and
+# the values of packet i are column[index[i]:index[i + 1]] with the offsets
+# in <column>_index
+TCP_LISTS = [
+    ('tcp.options.sack_le', 'sack_le', np.int64),
+    ('tcp.options.sack_re', 'sack_re', np.int64),
+    ('http2.streamid', 'http2_stream', np.int64),
+]
+
+# A datagram can coalesce several QUIC packets, each with several frames.
+# Fields that only some frames carry are listed in frame order, so they are
+# matched back to their frames by frame type
+QUIC_LISTS = [
+    ('quic.header_form', 'header_form', np.int8),
+    ('quic.long.packet_type', 'long_packet_type', np.int8),
+    ('quic.packet_number', 'packet_number', np.int64),
+    ('quic.frame_type', 'frame_type', np.int64),
+    ('quic.stream.stream_id', 'stream_id', np.int64),
+    ('quic.stream.offset', 'stream_offset', np.int64),
+    ('quic.stream.length', 'stream_length', np.int64),
+    ('quic.crypto.offset', 'crypto_offset', np.int64),
+    ('quic.crypto.length', 'crypto_length', np.int64),
+    ('quic.ack.largest_acknowledged', 'ack_largest', np.int64),
+    ('quic.ack.first_ack_range', 'ack_first_range', np.int64),
+    ('quic.ack.ack_range_count', 'ack_range_count', np.int64),
+    ('quic.ack.gap', 'ack_gap', np.int64),
+    ('quic.ack.ack_range', 'ack_range', np.int64),
+    ('quic.md.maximum_data', 'max_data', np.int64),
+    ('quic.msd.stream_id', 'max_stream_id', np.int64),
+    ('quic.msd.maximum_stream_data', 'max_stream_data', np.int64),
+]
+
+PROTOCOLS = {
+    'tcp': (TCP_FIELDS, TCP_LISTS),
+    'udp': (UDP_FIELDS, []),
+    'quic': (UDP_FIELDS, QUIC_LISTS),
+}
+
+# Protocol whose timestamps tshark calculates for each protocol
+TRANSPORTS = {
+    'tcp': 'tcp',
+    'udp': 'udp',
+    'quic': 'udp',
+}
+
+# qlog names of the QUIC long header packet types and frame types
+QUIC_PACKET_TYPES = {
+    0: 'initial',
+    1: '0RTT',
+    2: 'handshake',
+    3: 'retry',
+}
+
+QUIC_FRAME_TYPES = {
+    0x00: 'padding',
+    0x01: 'ping',
+    0x02: 'ack',
+    0x03: 'ack',
+    0x04: 'reset_stream',
+    0x05: 'stop_sending',
+    0x06: 'crypto',
+    0x07: 'new_token',
+    **{x: 'stream' for x in range(0x08, 0x10)},
+    0x10: 'max_data',
+    0x11: 'max_stream_data',
+    0x12: 'max_streams',
+    0x13: 'max_streams',
+    0x14: 'data_blocked',
+    0x15: 'stream_data_blocked',
+    0x16: 'streams_blocked',
+    0x17: 'streams_blocked',
+    0x18: 'new_connection_id',
+    0x19: 'retire_connection_id',
+    0x1a: 'path_challenge',
+    0x1b: 'path_response',
+    0x1c: 'connection_close',
+    0x1d: 'connection_close',
+    0x1e: 'handshake_done',
+    0x30: 'datagram',
+    0x31: 'datagram',
+}
+
+# STREAM frame type bits
+STREAM_FIN = 0x01
+STREAM_LEN = 0x02
+STREAM_OFF = 0x04
+
+TYPECODES = {
+    np.int64: 'q',
+    np.int32: 'i',
+    np.int8: 'b',
+    np.float64: 'd',
+}
+
+# Booleans are 1/0 in older tshark and True/False in newer ones
+BOOLEANS = {
+    'True': 1,
+    'False': 0,
+}
+
+
+def to_value(text: str, dtype):
+    if text == '':
+        return np.nan if dtype is np.float64 else MISSING
+    if dtype is np.float64:
+        return float(text)
+    if text in BOOLEANS:
+        return BOOLEANS[text]
+    return int(text, 0)
+
+
+class ColumnBuilder:
+    """
+    Packs the fields of one packet at a time into typed arrays. Every field
+    is given as the list of its values in the packet.
+    """
+
+    def __init__(self, protocol: str):
+        self.protocol = protocol
+        self.fields, self.lists = PROTOCOLS[protocol]
+        self.columns = {column: array(TYPECODES[dtype])
+                        for _, column, dtype in self.fields + self.lists}
+        for _, column, _ in self.lists:
+            self.columns['{}_index'.format(column)] = array('q', [0])
+
+    def add(self, values: list):
+        for (_, column, dtype), value in zip(self.fields, values):
+            self.columns[column].append(
+                to_value(value[0] if len(value) > 0 else '', dtype))
+
+        for (_, column, dtype), value in zip(self.lists, values[len(self.fields):]):
+            self.columns[column].extend([to_value(x, dtype) for x in value if x != ''])
+            self.columns['{}_index'.format(column)].append(len(self.columns[column]))
+
+    def packets(self) -> dict:
+        packets = {'protocol': self.protocol}
+        for _, column, dtype in self.fields + self.lists:
+            packets[column] = np.frombuffer(self.columns[column], dtype=dtype)
+        for _, column, _ in self.lists:
+            index = '{}_index'.format(column)
+            packets[index] = np.frombuffer(self.columns[index], dtype=np.int64)
+        return packets
+
+
+def tshark_command(pcap: str, protocol: str = 'tcp', keylog: str = None) -> list:
+    fields, lists = PROTOCOLS[protocol]
+
+    command = [
+        'tshark',
+        '-r', str(pcap),
+        '-n',
+        '-Y', protocol,
+        '-o', '{}.calculate_timestamps:TRUE'.format(TRANSPORTS[protocol]),
+        '-T', 'fields',
+        '-E', 'header=n',
+        '-E', 'separator=/t',
+        '-E', 'occurrence=a',
+        '-E', 'aggregator=,',
+    ]
+
+    if keylog is not None:
+        command += ['-o', 'tls.keylog_file:{}'.format(keylog)]
+
+    for field, _, _ in fields + lists:
+        command += ['-e', field]
+
+    return command
+
+
+def read_fields(lines, protocol: str = 'tcp') -> dict:
+    """Columns of `tshark -T fields` output, read one line at a time"""
+    builder = ColumnBuilder(protocol)
+    count = len(builder.fields) + len(builder.lists)
+
+    for line in lines:
+        values = line.rstrip('\r\n').split('\t')
+        if len(values) < count:
+            continue
+        builder.add([x.split(',') for x in values])
+
+    return builder.packets()
+
+
+def decode_pcap(pcap: str, protocol: str = 'tcp', keylog: str = None) -> dict:
+    """
+    Decode the packets of a capture with tshark, streaming only the fields
+    analyses use into typed columns
+    """
+    process = subprocess.Popen(tshark_command(pcap, protocol, keylog),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    packets = read_fields(process.stdout, protocol)
+    _, stderr = process.communicate()
+
+    if process.returncode != 0:
+        raise Exception('tshark failed on {}: {}'.format(pcap, stderr.strip()))
+
+    return packets
+
+
+def quic_frames(values: dict) -> list:
+    """qlog frames of one datagram from its frame field lists"""
+    fields = {column: iter(value) for column, value in values.items()}
+
+    def take(column: str) -> int:
+        return next(fields[column], MISSING)
+
+    frames = []
+    for frame_type in values['frame_type']:
+        frame = {'frame_type': QUIC_FRAME_TYPES.get(frame_type, 'unknown')}
+
+        if frame['frame_type'] == 'stream':
+            frame['stream_id'] = take('stream_id')
+            frame['offset'] = take('stream_offset') if frame_type & STREAM_OFF else 0
+            frame['length'] = take('stream_length') if frame_type & STREAM_LEN else MISSING
+            frame['fin'] = bool(frame_type & STREAM_FIN)
+        elif frame['frame_type'] == 'crypto':
+            frame['offset'] = take('crypto_offset')
+            frame['length'] = take('crypto_length')
+        elif frame['frame_type'] == 'ack':
+            # The first range ends at the largest acknowledged packet, every
+            # further one sits a gap below the previous
+            largest = take('ack_largest')
+            smallest = largest - take('ack_first_range')
+            ranges = [[smallest, largest]]
+            for _ in range(take('ack_range_count')):
+                largest = smallest - take('ack_gap') - 2
+                smallest = largest - take('ack_range')
+                ranges.append([smallest, largest])
+            frame['acked_ranges'] = ranges[::-1]
+        elif frame['frame_type'] == 'max_data':
+            frame['maximum'] = take('max_data')
+        elif frame['frame_type'] == 'max_stream_data':
+            frame['stream_id'] = take('max_stream_id')
+            frame['maximum'] = take('max_stream_data')
+
+        frames.append(frame)
+
+    return frames
+
+
+def quic_packets(values: dict, size: int) -> list:
+    """
+    qlog packets of one datagram. Frames are not attributed to the packets of
+    a coalesced datagram, they stay with its last packet
+    """
+    long_types = iter(values['long_packet_type'])
+    numbers = iter(values['packet_number'])
+
+    packets = []
+    for header_form in values['header_form']:
+        packet_type = QUIC_PACKET_TYPES.get(next(long_types, None), 'unknown') if header_form else '1RTT'
+        packets.append({
+            'packet_type': packet_type,
+            'header': {
+                'packet_number': next(numbers, MISSING),
+                'packet_size': size if len(values['header_form']) == 1 else MISSING,
+            },
+            'frames': [],
+        })
+
+    if len(packets) > 0:
+        packets[-1]['frames'] = quic_frames(values)
+
+    return packets
+
+
+def quic_tables(packets: dict, port: int) -> dict:
+    """
+    The qlog packet, frame and ack tables (see `qlog.SCHEMA`) of decoded QUIC
+    datagrams, from the side of the client talking to `port`
+    """
+    builder = TableBuilder('ms', 'tshark')
+
+    for i in range(len(packets['time'])):
+        values = {column: packet_values(packets, column, i).tolist() for _, column, _ in QUIC_LISTS}
+        event_type = 'packet_sent' if packets['dstport'][i] == port else 'packet_received'
+        # UDP length counts its own 8 byte header
+        size = int(packets['len'][i]) - 8
+
+        for data in quic_packets(values, size):
+            builder.add(float(packets['time'][i]) * 1000, 'transport', event_type, data)
+
+    return builder.tables()
+
+
+@cached('quic', 2, files=['keylog'])
+def decode_quic(pcap: str, keylog: str, port: int = 443) -> dict:
+    """
+    Decrypt the QUIC packets of a capture with the TLS keys in `keylog`, as
+    written to SSLKEYLOGFILE, into the tables a qlog of the client would give
+    """
+    return quic_tables(decode_pcap(pcap, 'quic', keylog), port)
+
+
+def save_packets(filename: str, packets: dict):
+    np.savez_compressed(filename, **packets)
+
+
+def collect_pairs(pairs):
+    # tshark repeats keys such as the SACK edges, keep every value
+    dct = {}
+    for key, value in pairs:
+        if key not in dct:
+            dct[key] = value
+        elif isinstance(dct[key], list):
+            dct[key].append(value)
+        else:
+            dct[key] = [dct[key], value]
+    return dct
+
+
+def leaves(tree, res: dict, key: str = None):
+    """Values of every field in a tshark JSON layer tree, by field name"""
+    if isinstance(tree, dict):
+        for k, v in tree.items():
+            leaves(v, res, k)
+    elif isinstance(tree, list):
+        for x in tree:
+            leaves(x, res, key)
+    else:
+        res.setdefault(key, []).append(tree)
+
+
+@cached('tshark_json', 1)
+def read_json(filename: str, protocol: str = None) -> dict:
+    """Columns of a capture exported by the former `tshark -T json` step"""
+    with open_artifact(filename, 'rt') as f:
+        data = json.load(f, object_pairs_hook=collect_pairs)
+
+    if protocol is None:
+        protocol = 'udp' if len(data) > 0 and 'udp' in data[0]['_source']['layers'] else 'tcp'
+
+    builder = ColumnBuilder(protocol)
+
+    for packet in data:
+        values = {}
+        leaves(packet['_source']['layers'], values)
+        builder.add([values.get(field, []) for field, _, _ in builder.fields + builder.lists])
+
+    return builder.packets()
+
+
+# Capture file magic numbers, with the byte order and resolution they imply
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+
+PCAP_HEADER = 24
+
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 1
+PCAPNG_EPB = 6
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+PCAPNG_TSRESOL = 9
+
+# Length of the link layer header of each supported link type
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+LINK_HEADERS = {
+    LINKTYPE_NULL: 4,
+    LINKTYPE_ETHERNET: 14,
+    12: 0,
+    14: 0,
+    LINKTYPE_RAW: 0,
+    LINKTYPE_LOOP: 4,
+    LINKTYPE_LINUX_SLL: 16,
+    LINKTYPE_LINUX_SLL2: 20,
+}
+
+ETHERTYPE_IP = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = 0x8100
+IPPROTO_TCP = 6
+
+CAPTURE_SUFFIXES = ['.pcap', '.pcapng']
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_ACK = 0x10
+
+# NOP, NOP, timestamp: the options of nearly every segment after the handshake
+TIMESTAMP_OPTIONS = np.array([1, 1, 8, 10], dtype=np.uint8)
+
+
+def no_records() -> dict:
+    return {
+        'time': np.zeros(0, dtype=np.float64),
+        'offset': np.zeros(0, dtype=np.int64),
+        'caplen': np.zeros(0, dtype=np.int64),
+        'linktype': np.zeros(0, dtype=np.int64),
+        'frame': np.zeros(0, dtype=np.int64),
+    }
+
+
+def pcap_records(data: np.ndarray) -> dict:
+    # A capture cut off inside its header has no records
+    if len(data) < PCAP_HEADER:
+        return no_records()
+
+    endian, scale = PCAP_MAGIC[bytes(data[:4])]
+    header = struct.Struct(endian + 'IIII')
+    linktype = struct.unpack_from(endian + 'I', data, 20)[0] & 0xFFFF
+
+    seconds = array('d')
+    offsets = array('q')
+    lengths = array('q')
+
+    pos = PCAP_HEADER
+    size = len(data)
+    while pos + header.size <= size:
+        sec, frac, caplen, _ = header.unpack_from(data, pos)
+        pos += header.size
+        # A capture cut off mid-packet drops its last record
+        if pos + caplen > size:
+            break
+        seconds.append(sec + frac * scale)
+        offsets.append(pos)
+        lengths.append(caplen)
+        pos += caplen
+
+    return {
+        'time': np.frombuffer(seconds, dtype=np.float64),
+        'offset': np.frombuffer(offsets, dtype=np.int64),
+        'caplen': np.frombuffer(lengths, dtype=np.int64),
+        'linktype': np.full(len(offsets), linktype, dtype=np.int64),
+        'frame': np.arange(1, len(offsets) + 1, dtype=np.int64),
+    }
+
+
+def pcapng_resolution(data: np.ndarray, endian: str, pos: int, end: int) -> float:
+    """Timestamp resolution in seconds from the options of an interface block"""
+    while pos + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', data, pos)
+        if code == 0:
+            break
+        if code == PCAPNG_TSRESOL and length >= 1:
+            value = int(data[pos + 4])
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        pos += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def pcapng_records(data: np.ndarray) -> dict:
+    seconds = array('d')
+    offsets = array('q')
+    lengths = array('q')
+    linktypes = array('q')
+
+    endian = '<'
+    interfaces = []
+
+    pos = 0
+    size = len(data)
+    while pos + 12 <= size:
+        block_type = struct.unpack_from(endian + 'I', data, pos)[0]
+
+        if block_type == PCAPNG_SHB:
+            magic = struct.unpack_from('<I', data, pos + 8)[0]
+            endian = '<' if magic == PCAPNG_BYTE_ORDER else '>'
+            # Interfaces are numbered per section
+            interfaces = []
+
+        length = struct.unpack_from(endian + 'I', data, pos + 4)[0]
+        if length < 12 or pos + length > size:
+            break
+
+        if block_type == PCAPNG_IDB:
+            linktype = struct.unpack_from(endian + 'H', data, pos + 8)[0]
+            interfaces.append((linktype, pcapng_resolution(data, endian, pos + 16, pos + length - 4)))
+        elif block_type == PCAPNG_EPB:
+            interface, high, low, caplen = struct.unpack_from(endian + 'IIII', data, pos + 8)
+            linktype, resolution = interfaces[interface]
+            seconds.append(((high << 32) | low) * resolution)
+            offsets.append(pos + 28)
+            lengths.append(caplen)
+            linktypes.append(linktype)
+
+        pos += length
+
+    return {
+        'time': np.frombuffer(seconds, dtype=np.float64),
+        'offset': np.frombuffer(offsets, dtype=np.int64),
+        'caplen': np.frombuffer(lengths, dtype=np.int64),
+        'linktype': np.frombuffer(linktypes, dtype=np.int64),
+        'frame': np.arange(1, len(offsets) + 1, dtype=np.int64),
+    }
+
+
+def be16(data: np.ndarray, index: np.ndarray) -> np.ndarray:
+    return (data[index].astype(np.int64) << 8) | data[index + 1]
+
+
+def be32(data: np.ndarray, index: np.ndarray) -> np.ndarray:
+    return (be16(data, index) << 16) | be16(data, index + 2)
+
+
+def parse_options(options: bytes) -> dict:
+    res = {}
+    i = 0
+
+    while i < len(options):
+        kind = options[i]
+        if kind == 0:
+            break
+        if kind == 1:
+            i += 1
+            continue
+        if i + 1 >= len(options):
+            break
+
+        length = options[i + 1]
+        if length < 2 or i + length > len(options):
+            break
+        value = options[i + 2:i + length]
+
+        if kind == 3 and length == 3:
+            res['wscale'] = value[0]
+        elif kind == 8 and length == 10:
+            res['tsval'], res['tsecr'] = struct.unpack('!II', value)
+        elif kind == 5:
+            res['sack'] = [struct.unpack_from('!II', value, j)
+                           for j in range(0, len(value) - 7, 8)]
+
+        i += length
+
+    return res
+
+
+def select_records(records: dict, mask: np.ndarray) -> dict:
+    return {key: value[mask] for key, value in records.items()}
+
+
+def tcp_segments(data: np.ndarray, records: dict) -> dict:
+    """IP and TCP header fields of the TCP segments among `records`"""
+    records = select_records(records, np.isin(records['linktype'], list(LINK_HEADERS)))
+    offset = records['offset']
+    caplen = records['caplen']
+
+    ip = offset + np.array([LINK_HEADERS[x] for x in records['linktype']], dtype=np.int64)
+
+    # Step over one VLAN tag and drop what is not IP
+    ethernet = (records['linktype'] == LINKTYPE_ETHERNET) & (caplen >= 18)
+    vlan = np.zeros(len(ip), dtype=bool)
+    vlan[ethernet] = be16(data, offset[ethernet] + 12) == ETHERTYPE_VLAN
+    ip[vlan] += 4
+
+    keep = ip - offset + 20 <= caplen
+    records = select_records(records, keep)
+    ip = ip[keep]
+
+    version = data[ip] >> 4
+    keep = (version == 4) | ((version == 6) & (ip - records['offset'] + 40 <= records['caplen']))
+    records = select_records(records, keep)
+    ip = ip[keep]
+    version = version[keep]
+
+    v6 = version == 6
+    header = np.where(v6, 40, (data[ip] & 0x0F).astype(np.int64) * 4)
+    protocol = np.where(v6, data[np.where(v6, ip + 6, ip)], data[ip + 9])
+    length = np.where(v6, 0, be16(data, ip + 2) - header)
+    length[v6] = be16(data, ip[v6] + 4)
+
+    # Addresses as two 64 bit halves, IPv4 only uses the low one
+    src = np.zeros((len(ip), 2), dtype=np.uint64)
+    dst = np.zeros((len(ip), 2), dtype=np.uint64)
+    src[~v6, 1] = be32(data, ip[~v6] + 12)
+    dst[~v6, 1] = be32(data, ip[~v6] + 16)
+    for half in range(2):
+        for k in range(8):
+            src[v6, half] = (src[v6, half] << np.uint64(8)) | data[ip[v6] + 8 + half * 8 + k]
+            dst[v6, half] = (dst[v6, half] << np.uint64(8)) | data[ip[v6] + 24 + half * 8 + k]
+
+    tcp = ip + header
+    keep = (protocol == IPPROTO_TCP) & (tcp - records['offset'] + 20 <= records['caplen'])
+
+    tcp = tcp[keep]
+    options = (data[tcp + 12] >> 4).astype(np.int64) * 4
+
+    return {
+        'time': records['time'][keep],
+        'frame': records['frame'][keep],
+        'caplen': records['caplen'][keep],
+        'offset': records['offset'][keep],
+        'tcp': tcp,
+        'src': src[keep],
+        'dst': dst[keep],
+        'srcport': be16(data, tcp),
+        'dstport': be16(data, tcp + 2),
+        'seq': be32(data, tcp + 4),
+        'ack': be32(data, tcp + 8),
+        'header': options,
+        'flags': data[tcp + 13].astype(np.int64),
+        'window': be16(data, tcp + 14),
+        'len': np.maximum(length[keep] - options, 0),
+    }
+
+
+def select_flow(segments: dict, port: int = None) -> np.ndarray:
+    """Mask of the segments of the first connection to `port`"""
+    candidates = np.flatnonzero((segments['dstport'] == port) | (segments['srcport'] == port)) \
+        if port is not None else np.arange(len(segments['srcport']))
+    if len(candidates) == 0:
+        return np.zeros(len(segments['srcport']), dtype=bool)
+
+    # Prefer the connection whose SYN is in the capture
+    syn = candidates[(segments['flags'][candidates] & (TCP_SYN | TCP_ACK)) == TCP_SYN]
+    first = syn[0] if len(syn) > 0 else candidates[0]
+
+    src, dst = segments['src'][first], segments['dst'][first]
+    sport, dport = segments['srcport'][first], segments['dstport'][first]
+
+    forward = (segments['srcport'] == sport) & (segments['dstport'] == dport) & \
+        np.all(segments['src'] == src, axis=1) & np.all(segments['dst'] == dst, axis=1)
+    backward = (segments['srcport'] == dport) & (segments['dstport'] == sport) & \
+        np.all(segments['src'] == dst, axis=1) & np.all(segments['dst'] == src, axis=1)
+
+    return forward | backward
+
+
+@cached('pcap', 2)
+def read_capture(filename: str, port: int = 443) -> dict:
+    """
+    Packet columns (see `TCP_FIELDS`) of the first TCP connection to `port`
+    in a pcap or pcapng file, decoded without tshark. Sequence numbers are
+    relative like tshark's, windows are scaled, and `initial_rtt`,
+    `acks_frame` and `ack_rtt` follow tshark's TCP analysis, with frames
+    numbered from 1 by their position in the capture. HTTP/2 is not decoded.
+    """
+    # tcpdump leaves an empty capture behind when a run dies early, and
+    # empty files cannot be mapped
+    if os.path.getsize(filename) == 0:
+        data = np.zeros(0, dtype=np.uint8)
+        records = no_records()
+    else:
+        data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+        if bytes(data[:4]) in PCAP_MAGIC:
+            records = pcap_records(data)
+        elif len(data) >= 4 and struct.unpack_from('<I', data, 0)[0] == PCAPNG_SHB:
+            records = pcapng_records(data)
+        else:
+            raise Exception('{} is not a pcap or pcapng capture'.format(filename))
+
+    segments = tcp_segments(data, records)
+    flow = select_flow(segments, port)
+    segments = {key: value[flow] for key, value in segments.items()}
+    count = len(segments['time'])
+
+    flags = segments['flags']
+    syn = (flags & TCP_SYN) > 0
+    fin = (flags & TCP_FIN) > 0
+    has_ack = (flags & TCP_ACK) > 0
+
+    # The client is whoever sent the first SYN, or else the side not on port
+    client_syn = np.flatnonzero(syn & ~has_ack)
+    if len(client_syn) > 0:
+        client = (segments['srcport'] == segments['srcport'][client_syn[0]]) & \
+            np.all(segments['src'] == segments['src'][client_syn[0]], axis=1)
+    else:
+        client = segments['dstport'] == port
+
+    # Options: the NOP NOP timestamp layout is read in bulk, anything else one segment at a time
+    tsval = np.full(count, MISSING, dtype=np.int64)
+    tsecr = np.full(count, MISSING, dtype=np.int64)
+    wscale = np.full(count, MISSING, dtype=np.int64)
+    sacks = {}
+
+    start = segments['tcp'] + 20
+    timestamps = segments['header'] == 32
+    if timestamps.any():
+        pattern = np.stack([data[start[timestamps] + k] for k in range(4)], axis=1)
+        timestamps[timestamps] = np.all(pattern == TIMESTAMP_OPTIONS, axis=1)
+    tsval[timestamps] = be32(data, start[timestamps] + 4)
+    tsecr[timestamps] = be32(data, start[timestamps] + 8)
+
+    for i in np.flatnonzero(~timestamps & (segments['header'] > 20)).tolist():
+        end = min(segments['tcp'][i] + segments['header'][i], segments['offset'][i] + segments['caplen'][i])
+        options = parse_options(bytes(data[start[i]:end]))
+        tsval[i] = options.get('tsval', MISSING)
+        tsecr[i] = options.get('tsecr', MISSING)
+        wscale[i] = options.get('wscale', MISSING)
+        if 'sack' in options:
+            sacks[i] = options['sack']
+
+    # Relative sequence numbers start at each side's SYN, or its first segment
+    isn = {}
+    for side, mask in [('client', client), ('server', ~client)]:
+        rows = np.flatnonzero(mask & syn)
+        rows = rows if len(rows) > 0 else np.flatnonzero(mask)
+        isn[side] = int(segments['seq'][rows[0]]) if len(rows) > 0 else 0
+    own = np.where(client, isn['client'], isn['server'])
+    other = np.where(client, isn['server'], isn['client'])
+
+    seq = (segments['seq'] - own) % 2 ** 32
+    ack = np.where(has_ack, (segments['ack'] - other) % 2 ** 32, 0)
+    nxtseq = seq + segments['len'] + syn + fin
+
+    # Windows are scaled once both SYNs offered scaling
+    window = segments['window'].copy()
+    scales = [wscale[np.flatnonzero(mask & syn)] for mask in [client, ~client]]
+    if all([len(x) > 0 and x[0] != MISSING for x in scales]):
+        shift = np.where(client, scales[0][0], scales[1][0])
+        window[~syn] = window[~syn] << shift[~syn]
+
+    time = segments['time'] - segments['time'][0] if count > 0 else segments['time']
+
+    # Initial RTT from the SYN to the ACK that completes the handshake
+    initial_rtt = np.full(count, np.nan)
+    synack = np.flatnonzero(syn & has_ack & ~client)
+    if len(client_syn) > 0 and len(synack) > 0:
+        third = np.flatnonzero(client & has_ack & ~syn & (np.arange(count) > synack[0]))
+        if len(third) > 0:
+            initial_rtt[third[0]:] = time[third[0]] - time[client_syn[0]]
+
+    # Every segment is acked by the first ACK from the other side whose ack
+    # number is the segment's next sequence number
+    acks_frame = np.full(count, MISSING, dtype=np.int64)
+    ack_rtt = np.full(count, np.nan)
+    for mask in [client, ~client]:
+        sent = np.flatnonzero(mask & (nxtseq > seq))
+        if len(sent) == 0:
+            continue
+        ends, first = np.unique(nxtseq[sent], return_index=True)
+        sent = sent[first]
+
+        acking = np.flatnonzero(~mask & has_ack)
+        match = np.searchsorted(ends, ack[acking])
+        found = (match < len(ends)) & (ends[np.minimum(match, len(ends) - 1)] == ack[acking])
+        acking, match = acking[found], match[found]
+        later = acking > sent[match]
+        acking, match = acking[later], match[later]
+
+        _, first = np.unique(match, return_index=True)
+        acking, match = acking[first], match[first]
+        acks_frame[acking] = segments['frame'][sent[match]]
+        ack_rtt[acking] = time[acking] - time[sent[match]]
+
+    builder = ColumnBuilder('tcp')
+    packets = builder.packets()
+    packets.update({
+        'time': time,
+        'srcport': segments['srcport'],
+        'dstport': segments['dstport'],
+        'seq': seq,
+        'nxtseq': nxtseq,
+        'ack': ack,
+        'len': segments['len'],
+        'window_size': window,
+        'syn': syn,
+        'fin': fin,
+        'initial_rtt': initial_rtt,
+        'acks_frame': acks_frame,
+        'ack_rtt': ack_rtt,
+        'tsval': tsval,
+        'tsecr': tsecr,
+    })
+    for _, column, dtype in TCP_FIELDS:
+        packets[column] = np.asarray(packets[column]).astype(dtype)
+
+    # SACK edges are relative to the other side's sequence numbers
+    le, re, index = [], [], [0]
+    for i in range(count):
+        for left, right in sacks.get(i, []):
+            le.append((left - other[i]) % 2 ** 32)
+            re.append((right - other[i]) % 2 ** 32)
+        index.append(len(le))
+    packets['sack_le'] = np.array(le, dtype=np.int64)
+    packets['sack_re'] = np.array(re, dtype=np.int64)
+    packets['sack_le_index'] = np.array(index, dtype=np.int64)
+    packets['sack_re_index'] = np.array(index, dtype=np.int64)
+    packets['http2_stream_index'] = np.zeros(count + 1, dtype=np.int64)
+
+    return packets
+
+
+def load_packets(filename: str) -> dict:
+    """
+    Packet columns of a capture: decoded .npz, a legacy tshark .json, or a
+    raw .pcap/.pcapng read natively
+    """
+    if artifact_suffix(filename) == '.json':
+        return read_json(filename)
+    if Path(filename).suffix in CAPTURE_SUFFIXES:
+        return read_capture(filename)
+
+    with np.load(filename) as data:
+        packets = {key: data[key] for key in data.files}
+    packets['protocol'] = str(packets['protocol'])
+
+    return packets
+
+
+def packet_values(packets: dict, column: str, i: int) -> np.ndarray:
+    """Values of a list column in packet `i`"""
+    index = packets['{}_index'.format(column)]
+    return packets[column][index[i]:index[i + 1]]
+
+
+def pcap_files(pcapdir: str) -> list:
+    """
+    Captures under `pcapdir`, one per run: its .npz, else its raw capture,
+    else a legacy .json
+    """
+    files = {}
+    # Only the legacy .json is ever compressed, the rest is binary already
+    for filename in artifact_files(pcapdir, '.json'):
+        files[strip_codec(filename).with_suffix('')] = filename
+    for suffix in CAPTURE_SUFFIXES + ['.npz']:
+        for filename in glob('{}/**/*{}'.format(pcapdir, suffix), recursive=True):
+            files[Path(filename).with_suffix('')] = filename
+
+    return sorted(files.values())
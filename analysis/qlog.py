@@ -0,0 +1,666 @@
+import io
+import json
+import os
+import re
+import sys
+import numpy as np
+
+from array import array
+from artifact import open_artifact, mappable
+from cache import cached
+from jsonlib import BACKEND, load, loads
+
+# Directions in the packet, frame and ack tables
+SENT = 0
+RECEIVED = 1
+
+# Placeholder for integer fields a qlog does not carry
+MISSING = -1
+
+# Nanoseconds per qlog time unit
+TIME_UNITS = {
+    'ms': 1000000,
+    'us': 1000,
+    'ns': 1,
+}
+
+# Default order of the fields of a list-form event
+EVENT_FIELDS = ['relative_time', 'category', 'event', 'data']
+
+# The streaming reader reads this much at a time and gives up on any
+# single event or trace header larger than the limit
+CHUNK_SIZE = 64 * 1024
+MAX_EVENT = 16 * 1024 * 1024
+
+# With a faster JSON backend, qlogs up to this size are decoded whole
+# instead of streamed
+MAX_DOCUMENT = 64 * 1024 * 1024
+
+# RFC 7464 record separator that starts every JSON-SEQ record
+RS = b'\x1e'
+
+# Trace keys the reader looks for ahead of the events array
+HEADER_PATTERN = re.compile(r'"(qlog_version|title|vantage_point|configuration|event_fields|events)"\s*:\s*')
+WHITESPACE = re.compile(r'[\s,]*')
+
+# array typecodes of numeric columns
+TYPECODES = {
+    np.int64: 'q',
+    np.int8: 'b',
+    np.float64: 'd',
+}
+
+SCHEMA = {
+    'events': {
+        'time': np.int64,
+        'category': str,
+        'type': str,
+    },
+    'packets': {
+        'event': np.int64,
+        'time': np.int64,
+        'direction': np.int8,
+        'packet_type': str,
+        'packet_number': np.int64,
+        'size': np.int64,
+        'frame_count': np.int64,
+    },
+    'frames': {
+        'packet': np.int64,
+        'time': np.int64,
+        'direction': np.int8,
+        'frame_type': str,
+        'stream_id': np.int64,
+        'offset': np.int64,
+        'length': np.int64,
+        'maximum': np.int64,
+    },
+    'acks': {
+        'frame': np.int64,
+        'packet': np.int64,
+        'time': np.int64,
+        'direction': np.int8,
+        'begin': np.int64,
+        'end': np.int64,
+    },
+    'lost': {
+        'event': np.int64,
+        'time': np.int64,
+        'packet_number': np.int64,
+    },
+    'metrics': {
+        'event': np.int64,
+        'time': np.int64,
+        'latest_rtt': np.float64,
+        'min_rtt': np.float64,
+        'smoothed_rtt': np.float64,
+        'congestion_window': np.float64,
+        'bytes_in_flight': np.float64,
+        'bandwidth': np.float64,
+    },
+}
+
+# Congestion metrics under the names used by different implementations
+METRIC_ALIASES = {
+    'latest_rtt': ['latest_rtt'],
+    'min_rtt': ['min_rtt'],
+    'smoothed_rtt': ['smoothed_rtt'],
+    'congestion_window': ['congestion_window', 'current_cwnd', 'cwnd'],
+    'bytes_in_flight': ['bytes_in_flight'],
+    'bandwidth': ['bandwidth_bytes', 'bandwidth'],
+}
+RTT_METRICS = ['latest_rtt', 'min_rtt', 'smoothed_rtt']
+
+# Canonical event types under the names older drafts and mvfst (proxygen's
+# draft-29 stack) log them as. mvfst logs its congestion controller and its
+# bandwidth estimator as separate events, both are metric updates here
+EVENT_TYPES = {
+    'packets_lost': 'packet_lost',
+    'metric_update': 'metrics_updated',
+    'congestion_metric_update': 'metrics_updated',
+    'bandwidth_est_update': 'metrics_updated',
+}
+
+# Category of the canonical event types the tables are built from
+EVENT_CATEGORIES = {
+    'packet_sent': 'transport',
+    'packet_received': 'transport',
+    'packet_lost': 'recovery',
+    'metrics_updated': 'recovery',
+}
+
+# Canonical packet and frame types, keyed by the lowercase names producers
+# log. Any other name is kept in lowercase
+PACKET_TYPES = {
+    '0rtt': '0RTT',
+    'zerortt': '0RTT',
+    'zero_rtt': '0RTT',
+    '1rtt': '1RTT',
+    'onertt': '1RTT',
+    'one_rtt': '1RTT',
+    'short': '1RTT',
+    'versionnegotiation': 'version_negotiation',
+}
+FRAME_TYPES = {
+    'crypto_frame': 'crypto',
+    'rst_stream': 'reset_stream',
+}
+
+# Table and key column whose time each row of the other tables takes
+TIME_PARENTS = {
+    'packets': ('events', 'event'),
+    'frames': ('packets', 'packet'),
+    'acks': ('packets', 'packet'),
+    'lost': ('events', 'event'),
+    'metrics': ('events', 'event'),
+}
+
+# Name columns mapped onto the canonical types once the tables are built
+CANONICAL_COLUMNS = {
+    ('packets', 'packet_type'): PACKET_TYPES,
+    ('frames', 'frame_type'): FRAME_TYPES,
+}
+
+# Producers, told apart by the title or vantage point of their traces.
+# Traces of any other are plain qlogs of their draft
+PRODUCERS = {
+    'mvfst': 'proxygen',
+    'proxygen': 'proxygen',
+    'ngtcp2': 'ngtcp2',
+    'chrome': 'chrome',
+}
+
+
+def to_int(value, default: int = MISSING) -> int:
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return int(float(value))
+
+
+def to_float(value) -> float:
+    if value is None:
+        return np.nan
+    return float(value)
+
+
+def qlog_dialect(header: dict) -> str:
+    """The producer of a trace from its header fields, 'qlog' if unknown"""
+    vantage_point = header.get('vantage_point')
+    names = [header.get('title'), vantage_point.get('name') if isinstance(vantage_point, dict) else None]
+
+    for name in names:
+        if not isinstance(name, str):
+            continue
+        for producer, dialect in PRODUCERS.items():
+            if producer in name.lower():
+                return dialect
+    return 'qlog'
+
+
+def canonical(values: list, aliases: dict) -> np.ndarray:
+    """`values` mapped through `aliases`, one lookup per distinct name"""
+    if len(values) == 0:
+        return np.array([], dtype='<U1')
+
+    names, inverse = np.unique(np.array(values, dtype=str), return_inverse=True)
+    names = [aliases.get(x.lower(), x.lower()) for x in names.tolist()]
+    return np.array(names, dtype=str)[inverse]
+
+
+def event_fields(fields: list) -> list:
+    # Positions of time, category, event type and data in list-form events
+    time_field = 'relative_time' if 'relative_time' in fields else 'time'
+    return [fields.index(x) if x in fields else None
+            for x in [time_field, 'category', 'event', 'data']]
+
+
+class TableBuilder:
+    """
+    Collects qlog events into the columns of `SCHEMA`. Events are added one
+    at a time, so any reader that yields them can fill the tables, but they
+    are only normalized once they are all in: `tables()` converts every
+    timestamp and RTT to its canonical unit and maps type names onto their
+    canonical names column by column. Whatever the `dialect`, the tables use
+    the canonical event, packet and frame types, so analyses never deal
+    with producers.
+    """
+
+    def __init__(self, time_units: str = 'ms', dialect: str = 'qlog', qlog_version: str = None):
+        self.scale = TIME_UNITS.get(time_units, TIME_UNITS['ms'])
+        self.time_units = time_units
+        self.dialect = dialect
+        self.qlog_version = qlog_version
+        # Numeric columns are packed as they are collected. Only events keep
+        # a time, in trace units, every other row takes its event's
+        self.columns = {table: {column: [] if dtype is str else array(TYPECODES[dtype])
+                                for column, dtype in columns.items()
+                                if column != 'time' or table not in TIME_PARENTS}
+                        for table, columns in SCHEMA.items()}
+        self.columns['events']['time'] = array('d')
+        # Canonical event type and category of each raw type and category
+        self.names = {}
+        self.start_event = None
+
+    def append(self, table: str, **row):
+        for column, values in self.columns[table].items():
+            values.append(row[column])
+
+    def canonical_name(self, category: str, event_type: str) -> tuple:
+        key = (category, event_type)
+        if key not in self.names:
+            name = event_type.lower()
+            name = EVENT_TYPES.get(name, name)
+            self.names[key] = (sys.intern(EVENT_CATEGORIES.get(name, category.lower() if category else '')),
+                               sys.intern(name))
+        return self.names[key]
+
+    def add(self, time, category: str, event_type: str, data: dict):
+        event = len(self.columns['events']['time'])
+        category, event_type = self.canonical_name(category, event_type)
+        data = data if isinstance(data, dict) else {}
+
+        self.append('events', time=float(time), category=category, type=event_type)
+
+        if event_type in ['packet_sent', 'packet_received']:
+            direction = SENT if event_type == 'packet_sent' else RECEIVED
+            if direction == SENT and self.start_event is None:
+                self.start_event = event
+            self.add_packet(event, direction, data)
+        elif event_type == 'packet_lost':
+            header = data.get('header', {})
+            number = data.get('largest_lost_packet_num',
+                              header.get('packet_number', data.get('packet_number')))
+            self.append('lost', event=event, packet_number=to_int(number))
+        elif event_type == 'metrics_updated':
+            row = {'event': event}
+            for column, aliases in METRIC_ALIASES.items():
+                value = next((data[x] for x in aliases if x in data), None)
+                row[column] = to_float(value)
+            self.append('metrics', **row)
+
+    def add_packet(self, event: int, direction: int, data: dict):
+        packet = len(self.columns['packets']['event'])
+        header = data.get('header', {})
+        frames = data.get('frames', [])
+
+        self.append('packets',
+                    event=event,
+                    direction=direction,
+                    packet_type=sys.intern(str(data.get('packet_type',
+                                                        header.get('packet_type', '')))),
+                    packet_number=to_int(header.get(
+                        'packet_number', data.get('packet_number'))),
+                    size=to_int(header.get('packet_size', data.get(
+                        'packet_size', data.get('raw', {}).get('length')))),
+                    frame_count=len(frames))
+
+        for frame in frames:
+            index = len(self.columns['frames']['packet'])
+            self.append('frames',
+                        packet=packet,
+                        direction=direction,
+                        frame_type=sys.intern(str(frame.get('frame_type', ''))),
+                        stream_id=to_int(frame.get('stream_id')),
+                        offset=to_int(frame.get('offset')),
+                        length=to_int(frame.get('length')),
+                        maximum=to_int(frame.get('maximum')))
+
+            for ack in frame.get('acked_ranges', []):
+                # A single packet number is a range of one
+                if len(ack) == 0:
+                    continue
+                self.append('acks',
+                            frame=index,
+                            packet=packet,
+                            direction=direction,
+                            begin=to_int(ack[0]),
+                            end=to_int(ack[-1]))
+
+    def tables(self) -> dict:
+        tables = {}
+        for table, columns in SCHEMA.items():
+            tables[table] = {}
+            for column, dtype in columns.items():
+                if column == 'time' and table in TIME_PARENTS:
+                    # Rows happened at the time of the row they belong to,
+                    # whose key precedes `time` in SCHEMA
+                    parent, key = TIME_PARENTS[table]
+                    tables[table][column] = tables[parent]['time'][tables[table][key]]
+                    continue
+
+                values = self.columns[table][column]
+                if (table, column) in CANONICAL_COLUMNS:
+                    tables[table][column] = canonical(values, CANONICAL_COLUMNS[(table, column)])
+                elif dtype is str:
+                    tables[table][column] = np.array(values, dtype=str) if len(
+                        values) > 0 else np.array([], dtype='<U1')
+                elif table == 'events' and column == 'time':
+                    tables[table][column] = np.rint(np.frombuffer(values, dtype=np.float64) *
+                                                    self.scale).astype(np.int64)
+                else:
+                    tables[table][column] = np.frombuffer(values, dtype=dtype)
+
+        # RTTs are given in the trace's time units, store ms
+        for column in RTT_METRICS:
+            tables['metrics'][column] = tables['metrics'][column] * self.scale / TIME_UNITS['ms']
+
+        events = tables['events']['time']
+        tables['meta'] = {
+            'time_units': self.time_units,
+            'dialect': self.dialect,
+            'qlog_version': self.qlog_version,
+            # Most analyses measure from the first packet the client sent
+            'start': int(events[self.start_event]) if self.start_event is not None else None,
+            'start_event': self.start_event,
+            'first': int(events[0]) if len(events) > 0 else None,
+        }
+
+        return tables
+
+
+def add_events(builder: TableBuilder, fields: list, events):
+    for event in events:
+        if not event:
+            continue
+
+        if isinstance(event, dict):
+            name = event.get('name', '')
+            category, _, event_type = name.rpartition(':')
+            builder.add(event.get('time', event.get('relative_time', 0)),
+                        event.get('category', category), event.get('event', event_type), event.get('data', {}))
+        else:
+            builder.add(*[event[i] if i is not None else None for i in fields])
+
+
+class QlogReader:
+    """
+    Yields the events of the first trace of a qlog while reading it, so
+    memory is bounded by the largest event rather than the file. The
+    trace's `configuration` and `event_fields`, and the header fields that
+    tell its producer, are picked up on the way to the events array.
+    """
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE, max_event: int = MAX_EVENT):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.max_event = max_event
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.eof = False
+
+        self.time_units = 'ms'
+        self.event_fields = EVENT_FIELDS
+        self.header = {}
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer += chunk
+        return True
+
+    def decode(self, pos: int):
+        """Decode the value at `pos`, reading until it is complete"""
+        while True:
+            try:
+                return self.decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                if len(self.buffer) - pos > self.max_event or not self.fill():
+                    raise
+
+    def read_header(self):
+        pos = 0
+        while True:
+            match = HEADER_PATTERN.search(self.buffer, pos)
+            if match is None:
+                # Keep enough to catch a key split across chunks
+                self.buffer = self.buffer[-32:]
+                pos = 0
+                if len(self.buffer) > self.max_event or not self.fill():
+                    raise Exception('qlog has no events')
+                continue
+
+            key = match.group(1)
+            if key == 'events':
+                self.buffer = self.buffer[match.end():]
+                return
+
+            value, pos = self.decode(match.end())
+            if key == 'configuration':
+                self.time_units = value.get('time_units', self.time_units)
+            elif key == 'event_fields':
+                self.event_fields = value
+            else:
+                self.header.setdefault(key, value)
+
+    def __iter__(self):
+        self.read_header()
+
+        # Step over the opening bracket of the events array
+        self.buffer = self.buffer.lstrip()
+        while len(self.buffer) == 0 and self.fill():
+            self.buffer = self.buffer.lstrip()
+        self.buffer = self.buffer[1:]
+
+        pos = 0
+        while True:
+            pos = WHITESPACE.match(self.buffer, pos).end()
+            if pos == len(self.buffer):
+                self.buffer = ''
+                pos = 0
+                if not self.fill():
+                    raise Exception('qlog events array is not terminated')
+                continue
+
+            if self.buffer[pos] == ']':
+                return
+
+            event, pos = self.decode(pos)
+            yield event
+
+            # Drop what has been decoded once it is worth the copy
+            if pos > self.chunk_size:
+                self.buffer = self.buffer[pos:]
+                pos = 0
+
+
+def iter_json_seq(f, chunk_size: int = CHUNK_SIZE):
+    """
+    Yield the records of an RFC 7464 JSON text sequence read from binary
+    `f`. Records are split on RS before anything is decoded. A truncated
+    last record, as left by a client that was killed, is dropped.
+    """
+    buffer = b''
+
+    while True:
+        chunk = f.read(chunk_size)
+        buffer += chunk
+
+        records = buffer.split(RS)
+        # The last piece may still be incomplete
+        buffer = records.pop() if chunk else b''
+
+        for record in records + ([buffer] if not chunk else []):
+            if len(record.strip()) == 0:
+                continue
+            try:
+                yield loads(record)
+            except json.JSONDecodeError:
+                if chunk:
+                    raise
+
+        if not chunk:
+            return
+
+
+class SqlogReader:
+    """
+    Yields the events of a JSON-SEQ qlog (ngtcp2 `.sqlog`), after taking
+    the time units from its header record, like `QlogReader`.
+    """
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.records = iter_json_seq(f, chunk_size)
+        self.time_units = 'ms'
+        self.event_fields = EVENT_FIELDS
+        self.header = {}
+
+    def __iter__(self):
+        for record in self.records:
+            if 'qlog_version' in record or 'qlog_format' in record:
+                trace = record.get('trace', {})
+                self.time_units = trace.get('configuration', {}).get(
+                    'time_units', trace.get('common_fields', {}).get('time_units', self.time_units))
+                self.header = {
+                    'qlog_version': record.get('qlog_version'),
+                    'title': record.get('title', trace.get('title')),
+                    'vantage_point': trace.get('vantage_point'),
+                }
+                continue
+
+            yield record
+
+
+class QlogDocument:
+    """
+    The events of the first trace of a qlog decoded in one go, with the
+    `time_units` and `event_fields` of `QlogReader`
+    """
+
+    def __init__(self, qlog: dict):
+        traces = qlog.get('traces', [qlog])
+        self.trace = traces[0] if len(traces) > 0 else {}
+        if 'events' not in self.trace:
+            raise Exception('qlog has no events')
+
+        self.time_units = self.trace.get('configuration', {}).get('time_units', 'ms')
+        self.event_fields = self.trace.get('event_fields', EVENT_FIELDS)
+        self.header = {
+            'qlog_version': qlog.get('qlog_version'),
+            'title': qlog.get('title', self.trace.get('title')),
+            'vantage_point': self.trace.get('vantage_point'),
+        }
+
+    def __iter__(self):
+        events = self.trace['events']
+        for i in range(len(events)):
+            event = events[i]
+            # Let go of every event once it is handed out
+            events[i] = None
+            yield event
+
+
+def open_qlog(f):
+    """A reader for binary `f`, JSON-SEQ or a single JSON document"""
+    if f.peek(1)[:1] == RS:
+        return SqlogReader(f)
+    if BACKEND != 'json' and mappable(f) and os.fstat(f.fileno()).st_size <= MAX_DOCUMENT:
+        return QlogDocument(load(f))
+    return QlogReader(io.TextIOWrapper(f, encoding='utf-8'))
+
+
+@cached('qlog', 2)
+def parse_qlog(filename: str) -> dict:
+    """
+    Decode the first trace of a qlog or JSON-SEQ qlog into columnar tables
+    (see `SCHEMA`) with int64 ns timestamps and canonical types, plus a
+    `meta` dict naming the producer's dialect. Compressed qlogs are
+    decompressed while they are read.
+    """
+    with open_artifact(filename) as f:
+        reader = open_qlog(f)
+        events = iter(reader)
+
+        # The reader knows the trace's time units once the first event is read
+        first = next(events, None)
+        builder = TableBuilder(reader.time_units, qlog_dialect(reader.header), reader.header.get('qlog_version'))
+        fields = event_fields(reader.event_fields)
+
+        if first is not None:
+            add_events(builder, fields, [first])
+        add_events(builder, fields, events)
+
+    return builder.tables()
+
+
+def select(table: dict, mask: np.ndarray) -> dict:
+    return {column: values[mask] for column, values in table.items()}
+
+
+def started(tables: dict, table: str) -> np.ndarray:
+    """Mask of the rows of `table` logged after the client sent its first packet"""
+    start_event = tables['meta']['start_event']
+    if start_event is None:
+        return np.zeros(len(tables[table]['time']), dtype=bool)
+
+    events = tables[table]['event'] if 'event' in tables[table] else \
+        tables['packets']['event'][tables[table]['packet']]
+    return events >= start_event
+
+
+def since_start(tables: dict, table: str) -> dict:
+    return select(tables[table], started(tables, table))
+
+
+def to_ms(ns) -> np.ndarray:
+    return np.asarray(ns) / TIME_UNITS['ms']
+
+
+def stream_acks(tables: dict, mask: np.ndarray) -> dict:
+    """
+    The ack ranges of `mask` carried in 1RTT packets. Initial and Handshake
+    acks are of other packet number spaces and never acknowledge stream data.
+    Packets of qlogs that do not log their type are taken to be 1RTT.
+    """
+    acks = tables['acks']
+    return select(acks, mask & np.isin(tables['packets']['packet_type'][acks['packet']], ['1RTT', '']))
+
+
+def max_acked(acks: dict, numbers: np.ndarray, values: np.ndarray, times: np.ndarray) -> dict:
+    """
+    For every packet carrying `acks`, the largest of `values` among the packet
+    `numbers` it acknowledges that had arrived, at `times`, by the time of the
+    ack. Later entries win for repeated numbers.
+    """
+    numbers = np.asarray(numbers)
+    if len(numbers) == 0:
+        return {}
+
+    # Packets are filled in, in arrival order, at their place among all numbers
+    order = np.argsort(times, kind='stable')
+    distinct = np.unique(numbers)
+    positions = np.searchsorted(distinct, numbers[order]).tolist()
+    values = np.asarray(values)[order]
+    times = np.asarray(times)[order].tolist()
+
+    latest = np.zeros(len(distinct), dtype=values.dtype)
+    arrived = np.zeros(len(distinct), dtype=bool)
+    count = 0
+
+    res = {}
+    lo = np.searchsorted(distinct, acks['begin'], side='left').tolist()
+    hi = np.searchsorted(distinct, acks['end'], side='right').tolist()
+
+    for row in np.argsort(acks['time'], kind='stable').tolist():
+        while count < len(times) and times[count] <= acks['time'][row]:
+            latest[positions[count]] = values[count]
+            arrived[positions[count]] = True
+            count += 1
+
+        i, j = lo[row], hi[row]
+        if j <= i or not arrived[i:j].any():
+            continue
+
+        packet = int(acks['packet'][row])
+        value = latest[i:j][arrived[i:j]].max()
+        res[packet] = max(res[packet], value) if packet in res else value
+
+    return res
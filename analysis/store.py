@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import numpy as np
+
+from collections.abc import Mapping
+from pathlib import Path
+from artifact import artifact_files, strip_codec
+from cache import flatten, unflatten
+from pcap import load_packets, pcap_files
+from qlog import parse_qlog
+
+# Every trace is a directory of .npy columns plus the JSON values that are
+# not columns, listed in the catalog at the root of the store
+CATALOG = 'catalog.npz'
+TRACES = 'traces'
+META = 'meta.json'
+
+QLOG_SUFFIXES = ['.qlog', '.sqlog']
+
+# Campaigns are written as <scenario>/<domain>/<size>/<client>/<client>_<i>
+ITERATION_PATTERN = re.compile(r'_(\d+)$')
+
+CATALOG_COLUMNS = {
+    'path': str,
+    'source': str,
+    'kind': str,
+    'scenario': str,
+    'domain': str,
+    'size': str,
+    'client': str,
+    'iteration': np.int64,
+    'rows': np.int64,
+    'source_size': np.int64,
+    'source_mtime': np.int64,
+}
+
+
+class MappedTable(Mapping):
+    """
+    Columns of a stored trace, memory-mapped the first time they are used,
+    so only the pages of the rows an analysis touches are read
+    """
+
+    def __init__(self, directory: Path, files: dict, values: dict):
+        self.directory = directory
+        self.files = files
+        self.values = values
+
+    def __getitem__(self, key):
+        if key not in self.values:
+            if key not in self.files:
+                raise KeyError(key)
+            self.values[key] = np.load(Path.joinpath(self.directory, self.files[key]), mmap_mode='r')
+        return self.values[key]
+
+    def __iter__(self):
+        return iter(list(self.files) + [x for x in self.values if x not in self.files])
+
+    def __len__(self):
+        return len(set(self.files) | set(self.values))
+
+
+def mapped(directory: Path, columns: dict, scalars: dict) -> MappedTable:
+    files = {key: value for key, value in columns.items() if isinstance(value, str)}
+    values = {key: mapped(directory, value, scalars.get(key, {}))
+              for key, value in columns.items() if isinstance(value, dict)}
+    values.update({key: value for key, value in scalars.items() if key not in values})
+    return MappedTable(directory, files, values)
+
+
+def save_trace(directory: Path, trace: dict):
+    """Write the columns of parsed tables, e.g. from `parse_qlog`, as .npy files"""
+    arrays = {}
+    scalars = {}
+    flatten(trace, arrays, scalars)
+
+    # Written aside and moved in place, so a trace is never half there
+    tmp = directory.with_name('{}.{}.tmp'.format(directory.name, os.getpid()))
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    for name, values in arrays.items():
+        np.save(Path.joinpath(tmp, '{}.npy'.format(name)), values)
+    with open(Path.joinpath(tmp, META), mode='w') as f:
+        json.dump({'columns': list(arrays), 'scalars': scalars}, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+
+
+def open_trace(directory: str) -> MappedTable:
+    """
+    A stored trace with the layout it was saved with, every column a
+    read-only `np.memmap`
+    """
+    directory = Path(directory)
+    with open(Path.joinpath(directory, META)) as f:
+        meta = json.load(f)
+
+    columns = unflatten({name: '{}.npy'.format(name) for name in meta['columns']}, {})
+    return mapped(directory, columns, unflatten({}, meta['scalars']))
+
+
+def load_tables(filename: str):
+    """Tables of a qlog, or of a qlog trace in a store"""
+    if Path(filename).is_dir():
+        return open_trace(filename)
+    return parse_qlog(filename)
+
+
+def scenario_fields(relative: Path, scenario: str) -> dict:
+    """
+    Scenario, domain, size, client and iteration from a campaign path. A tree
+    imported from inside one scenario is that `scenario`
+    """
+    parts = relative.with_suffix('').parts
+    match = ITERATION_PATTERN.search(parts[-1])
+
+    client, size, domain = (list(parts[-2::-1]) + ['', '', ''])[:3]
+
+    return {
+        'scenario': '/'.join(parts[:-4]) or scenario,
+        'domain': domain,
+        'size': size,
+        'client': client,
+        'iteration': int(match.group(1)) if match is not None else -1,
+    }
+
+
+class TraceStore:
+    """
+    Parsed qlogs and captures of whole campaigns. The catalog is small and
+    read whole, traces are opened one at a time and mapped column by column.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.catalog = self.load_catalog()
+
+    def load_catalog(self) -> dict:
+        try:
+            with np.load(Path.joinpath(self.root, CATALOG)) as data:
+                return {column: data[column] for column in CATALOG_COLUMNS}
+        except (OSError, KeyError):
+            return {column: np.array([], dtype=dtype if dtype is not str else '<U1')
+                    for column, dtype in CATALOG_COLUMNS.items()}
+
+    def save_catalog(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = Path.joinpath(self.root, '{}.{}.tmp'.format(CATALOG, os.getpid()))
+        with open(tmp, mode='wb') as f:
+            np.savez(f, **self.catalog)
+        os.replace(tmp, Path.joinpath(self.root, CATALOG))
+
+    def select(self, kind: str = None, scenario=None, domain=None, size=None, client=None) -> np.ndarray:
+        """Catalog rows of the matching traces, each filter a value or a list of them"""
+        mask = np.ones(len(self.catalog['path']), dtype=bool)
+
+        for column, value in [('kind', kind), ('scenario', scenario), ('domain', domain),
+                              ('size', size), ('client', client)]:
+            if value is None:
+                continue
+            mask &= np.isin(self.catalog[column], value if isinstance(value, list) else [value])
+
+        return np.flatnonzero(mask)
+
+    def path(self, row: int) -> Path:
+        return Path.joinpath(self.root, self.catalog['path'][row])
+
+    def open(self, row: int) -> MappedTable:
+        return open_trace(self.path(row))
+
+    def add(self, datadir: str, force: bool = False):
+        """
+        Parse every qlog and capture under `datadir`, a campaign tree like
+        data/qlogs, into the store. Traces whose source did not change are
+        skipped unless `force`.
+        """
+        datadir = Path(datadir).resolve()
+        files = [(x, 'qlog') for suffix in QLOG_SUFFIXES for x in artifact_files(datadir, suffix)]
+        files += [(x, 'pcap') for x in pcap_files(datadir)]
+
+        rows = {source: i for i, source in enumerate(self.catalog['source'].tolist())}
+        entries = {column: self.catalog[column].tolist() for column in CATALOG_COLUMNS}
+
+        for filename, kind in sorted(files):
+            stat = os.stat(filename)
+            row = rows.get(filename)
+            if row is not None and not force \
+                    and entries['source_size'][row] == stat.st_size \
+                    and entries['source_mtime'][row] == stat.st_mtime_ns:
+                continue
+
+            try:
+                trace = parse_qlog(filename) if kind == 'qlog' else load_packets(filename)
+            except Exception as e:
+                print(filename, 'error', e)
+                continue
+
+            relative = strip_codec(filename).relative_to(datadir.parent)
+            path = Path(TRACES, kind, relative.with_suffix(''))
+            save_trace(Path.joinpath(self.root, path), trace)
+
+            entry = {
+                'path': str(path),
+                'source': filename,
+                'kind': kind,
+                **scenario_fields(strip_codec(filename).relative_to(datadir), datadir.name),
+                'rows': len(trace['packets']['time']) if kind == 'qlog' else len(trace['time']),
+                'source_size': stat.st_size,
+                'source_mtime': stat.st_mtime_ns,
+            }
+
+            if row is None:
+                row = len(entries['path'])
+                rows[filename] = row
+                for column in CATALOG_COLUMNS:
+                    entries[column].append(entry[column])
+            else:
+                for column in CATALOG_COLUMNS:
+                    entries[column][row] = entry[column]
+
+            print(filename, path)
+
+        self.catalog = {column: np.array(entries[column], dtype=dtype if dtype is not str else None)
+                        if len(entries[column]) > 0 else self.catalog[column]
+                        for column, dtype in CATALOG_COLUMNS.items()}
+        self.save_catalog()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add = subparsers.add_parser('add', help='Parse a campaign tree into the store')
+    add.add_argument('datadir', nargs='+')
+    add.add_argument('--force', action='store_true', help='Parse sources that did not change again')
+
+    query = subparsers.add_parser('list', help='List the traces of the store')
+    for column in ['kind', 'scenario', 'domain', 'size', 'client']:
+        query.add_argument('--{}'.format(column), nargs='+')
+
+    args = parser.parse_args()
+    store = TraceStore(args.store)
+
+    if args.command == 'add':
+        for datadir in args.datadir:
+            store.add(datadir, args.force)
+        return
+
+    catalog = store.catalog
+    for row in store.select(args.kind, args.scenario, args.domain, args.size, args.client):
+        print('{:<5} {:<20} {:<20} {:<8} {:<12} {:>4} {:>8} {}'.format(
+            catalog['kind'][row], catalog['scenario'][row], catalog['domain'][row], catalog['size'][row],
+            catalog['client'][row], catalog['iteration'][row], catalog['rows'][row], catalog['path'][row]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+import argparse
+import json
+import math
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+
+from pathlib import Path
+import netem
+
+CONFIG = {}
+with open(Path.joinpath(Path(__file__).parent.absolute(), 'config.json'), mode='r') as f:
+    CONFIG = json.load(f)
+
+PORT = 9876
+
+# UDP messages: echo probes, and flood requests answered with paced datagrams
+PROBE = struct.Struct('!cId')
+FLOOD = struct.Struct('!cIHI')
+DATA = struct.Struct('!cI')
+
+PROBE_INTERVAL = 0.01
+PROBE_COUNT = 1000
+FLOOD_SECONDS = 3
+FLOOD_SIZE = 1200
+TCP_SECONDS = 5
+
+# Time allowed for the last replies to arrive
+DRAIN = 1
+
+# Absolute slack on delay checks covers the unshaped base RTT
+DELAY_SLACK_MS = 5
+DELAY_TOLERANCE = 0.1
+RATE_TOLERANCE = 0.15
+# Floods are sent faster than the declared rate so the shaper is the bottleneck
+FLOOD_FACTOR = 1.5
+BURST_TOLERANCE = 0.5
+# Burst length is only checked with enough loss events to be meaningful
+MIN_LOSS_EVENTS = 20
+
+
+class UDPReflector(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+
+        if data[:1] == b'P':
+            sock.sendto(data, self.client_address)
+        elif data[:1] == b'F':
+            _, count, size, rate = FLOOD.unpack(data[:FLOOD.size])
+            # Pace at the requested kbit/s
+            interval = size * 8 / (rate * 1000)
+            start = time.monotonic()
+            padding = b'\0' * (size - DATA.size)
+
+            for i in range(count):
+                deadline = start + i * interval
+                while time.monotonic() < deadline:
+                    time.sleep(max(deadline - time.monotonic(), 0))
+                sock.sendto(DATA.pack(b'D', i) + padding, self.client_address)
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    """`size` bytes from a stream, fewer only if the peer closed it first"""
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class TCPReflector(socketserver.BaseRequestHandler):
+    def handle(self):
+        command = recv_exactly(self.request, 9)
+
+        if command[:1] == b'D' and len(command) < 9:
+            return
+
+        if command[:1] == b'D':
+            # Send for the requested number of seconds
+            duration = struct.unpack('!d', command[1:9])[0]
+            chunk = b'\0' * 65536
+            deadline = time.monotonic() + duration
+
+            try:
+                while time.monotonic() < deadline:
+                    self.request.sendall(chunk)
+            except OSError:
+                pass
+        elif command[:1] == b'U':
+            # Sink until the client is done, then report what arrived
+            received = len(command) - 1
+            while True:
+                data = self.request.recv(65536)
+                if not data:
+                    break
+                received += len(data)
+            self.request.sendall(struct.pack('!Q', received))
+
+
+class ThreadingUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Reflector:
+    """UDP echo/flood and TCP source/sink servers the probe measures against"""
+
+    def __init__(self, host: str = '0.0.0.0', port: int = PORT):
+        self.servers = [
+            ThreadingUDPServer((host, port), UDPReflector),
+            ThreadingTCPServer((host, port), TCPReflector),
+        ]
+
+    def start(self):
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+def probe_udp(host: str, port: int = PORT, count: int = PROBE_COUNT) -> dict:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect((host, port))
+    rtts = {}
+
+    def receive():
+        sock.settimeout(DRAIN)
+        while True:
+            try:
+                data = sock.recv(2048)
+            except socket.timeout:
+                return
+            _, seq, sent = PROBE.unpack(data[:PROBE.size])
+            rtts[seq] = (time.monotonic() - sent) * 1000
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+
+    start = time.monotonic()
+    for seq in range(count):
+        deadline = start + seq * PROBE_INTERVAL
+        time.sleep(max(deadline - time.monotonic(), 0))
+        sock.send(PROBE.pack(b'P', seq, time.monotonic()))
+
+    receiver.join()
+    sock.close()
+
+    lost = np.array([seq not in rtts for seq in range(count)])
+
+    # Lengths of runs of consecutive losses
+    bursts = []
+    run = 0
+    for x in lost:
+        if x:
+            run += 1
+        elif run > 0:
+            bursts.append(run)
+            run = 0
+    if run > 0:
+        bursts.append(run)
+
+    values = np.array(list(rtts.values())) if len(rtts) > 0 else np.array([np.nan])
+
+    return {
+        'count': count,
+        'loss': float(lost.mean() * 100),
+        'loss_events': len(bursts),
+        'burst_length': float(np.mean(bursts)) if len(bursts) > 0 else 0,
+        'rtt': {
+            'min': float(np.min(values)),
+            'median': float(np.median(values)),
+            'p95': float(np.percentile(values, 95)),
+            'max': float(np.max(values)),
+            'std': float(np.std(values)),
+        },
+    }
+
+
+def probe_udp_rate(host: str, rate: float, port: int = PORT,
+                   duration: float = FLOOD_SECONDS, size: int = FLOOD_SIZE) -> float:
+    """Goodput in kbit/s of a paced UDP flood from the reflector sent at `rate` kbit/s"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.connect((host, port))
+
+    count = int(rate * 1000 * duration / (size * 8))
+    sock.send(FLOOD.pack(b'F', count, size, int(rate)))
+
+    sock.settimeout(DRAIN + duration)
+    received = 0
+    first = last = None
+
+    while True:
+        try:
+            data = sock.recv(2048)
+        except socket.timeout:
+            break
+
+        now = time.monotonic()
+        first = now if first is None else first
+        last = now
+        received += len(data)
+        sock.settimeout(DRAIN)
+
+    sock.close()
+
+    if first is None or last == first:
+        return 0
+    return received * 8 / (last - first) / 1000
+
+
+def probe_tcp(host: str, port: int = PORT, duration: float = TCP_SECONDS) -> dict:
+    # Download
+    with socket.create_connection((host, port), timeout=duration + DRAIN) as sock:
+        sock.sendall(b'D' + struct.pack('!d', duration))
+        start = time.monotonic()
+        received = 0
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            received += len(data)
+        down = received * 8 / (time.monotonic() - start) / 1000
+
+    # Upload
+    with socket.create_connection((host, port), timeout=duration + DRAIN) as sock:
+        sock.sendall(b'U')
+        chunk = b'\0' * 65536
+        start = time.monotonic()
+        while time.monotonic() - start < duration:
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+        sent = struct.unpack('!Q', recv_exactly(sock, 8))[0]
+        up = sent * 8 / (time.monotonic() - start) / 1000
+
+    return {
+        'down': down,
+        'up': up,
+    }
+
+
+def measure(host: str, port: int = PORT, rate: float = None) -> dict:
+    res = {
+        'udp': probe_udp(host, port),
+        'tcp': probe_tcp(host, port),
+    }
+
+    if rate is not None:
+        res['udp']['rate'] = probe_udp_rate(host, rate * FLOOD_FACTOR, port)
+
+    return res
+
+
+def steady_loss(side: dict) -> float:
+    """Fraction of the packets one direction of a profile drops in the long run"""
+    p = side['loss'] / 100
+    r = side['burst_exit'] / 100
+    if p == 0 or side['loss_model'] == 'random':
+        return p
+
+    # Given p13 and p31 only, netem's 4-state model never enters states 2
+    # and 4, so its stationary distribution is that of states 1 and 3
+    bad = p / (p + r)
+    if side['loss_model'] == 'state':
+        return bad
+    # Gilbert-Elliott, losing bad_loss in the bad state and good_loss in the good
+    return bad * side['bad_loss'] / 100 + (1 - bad) * side['good_loss'] / 100
+
+
+def burst_rate(profile: dict, duration: float) -> float:
+    """
+    Rate in kbit/s a full HTB bucket adds to a transfer of `duration` seconds,
+    tc's KB being 1024 bytes
+    """
+    return profile['burst'] * 1024 * 8 / 1000 / duration
+
+
+def expected(profile: dict) -> dict:
+    egress, ingress = profile['egress'], profile['ingress']
+
+    # Probes and echoes each cross one direction
+    delivered = (1 - steady_loss(egress)) * (1 - steady_loss(ingress))
+
+    burst = None
+    losses = [x for x in [egress, ingress] if x['loss'] > 0]
+    if len(losses) == 1 and losses[0]['loss_model'] == 'state':
+        # Mean time in the lossy state of the 4-state model
+        burst = 100 / losses[0]['burst_exit']
+    elif len(losses) > 0 and all([x['loss_model'] == 'random' for x in losses]):
+        loss = 1 - delivered
+        burst = 1 / (1 - loss)
+
+    return {
+        'delay': egress['delay'] + ingress['delay'],
+        'jitter': egress['jitter'] + ingress['jitter'],
+        'loss': (1 - delivered) * 100,
+        'burst_length': burst,
+        'rate': profile['rate'],
+    }
+
+
+def check(measured: dict, profile: dict) -> dict:
+    want = expected(profile)
+    udp = measured['udp']
+    checks = {}
+
+    # The shaped delay is a floor on every RTT
+    checks['min_rtt'] = {
+        'measured': udp['rtt']['min'],
+        'expected': want['delay'],
+        'ok': udp['rtt']['min'] >= (want['delay'] - want['jitter']) * (1 - DELAY_TOLERANCE)
+        and udp['rtt']['min'] <= want['delay'] * (1 + DELAY_TOLERANCE) + DELAY_SLACK_MS,
+    }
+
+    checks['median_rtt'] = {
+        'measured': udp['rtt']['median'],
+        'expected': want['delay'],
+        'ok': abs(udp['rtt']['median'] - want['delay'])
+        <= want['delay'] * DELAY_TOLERANCE + want['jitter'] + DELAY_SLACK_MS,
+    }
+
+    # Three standard deviations of the binomial probe loss, in percent
+    p = want['loss'] / 100
+    sigma = math.sqrt(max(p * (1 - p), 1 / udp['count']) / udp['count']) * 100
+    checks['loss'] = {
+        'measured': udp['loss'],
+        'expected': want['loss'],
+        'ok': abs(udp['loss'] - want['loss']) <= 3 * sigma,
+    }
+
+    if want['burst_length'] is not None and udp['loss_events'] >= MIN_LOSS_EVENTS:
+        checks['burst_length'] = {
+            'measured': udp['burst_length'],
+            'expected': want['burst_length'],
+            'ok': abs(udp['burst_length'] - want['burst_length'])
+            <= want['burst_length'] * BURST_TOLERANCE,
+        }
+
+    # Probes start on a full bucket, which passes unshaped
+    if 'rate' in udp:
+        rate = min(want['rate'] * FLOOD_FACTOR, want['rate'] + burst_rate(profile, FLOOD_SECONDS))
+        checks['udp_rate'] = {
+            'measured': udp['rate'],
+            'expected': rate,
+            'ok': abs(udp['rate'] - rate) <= rate * RATE_TOLERANCE,
+        }
+
+    # TCP rarely fills a lossy or long link, so only the ceiling is checked
+    ceiling = want['rate'] * (1 + RATE_TOLERANCE) + burst_rate(profile, TCP_SECONDS)
+    for direction in ['down', 'up']:
+        checks['tcp_{}'.format(direction)] = {
+            'measured': measured['tcp'][direction],
+            'expected': want['rate'],
+            'ok': measured['tcp'][direction] <= ceiling,
+        }
+
+    return checks
+
+
+def calibrate(host: str, profile: dict = None, port: int = PORT) -> dict:
+    """
+    Probe the shaped path to a reflector and compare it with the declared
+    `profile`. `ok` is None when there was nothing to compare against.
+    """
+    measured = measure(host, port, profile['rate'] if profile is not None else None)
+
+    res = {
+        'reflector': '{}:{}'.format(host, port),
+        'time': time.time(),
+        'measured': measured,
+        'ok': None,
+    }
+
+    if profile is not None:
+        res['expected'] = expected(profile)
+        res['checks'] = check(measured, profile)
+        res['ok'] = all([x['ok'] for x in res['checks'].values()])
+
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['serve', 'probe'])
+    parser.add_argument('host', nargs='?', default=CONFIG['reflector']['value'])
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--dev', default=netem.DEVICE)
+    parser.add_argument('--ifb', default=netem.IFB)
+    parser.add_argument('--netns')
+
+    args = parser.parse_args()
+
+    if args.action == 'serve':
+        reflector = Reflector(args.host or '0.0.0.0', args.port)
+        reflector.start()
+        print('Reflecting on port {}'.format(args.port))
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            reflector.stop()
+    else:
+        if args.host is None:
+            raise Exception('no reflector host given')
+
+        profile = netem.current_profile(args.dev, args.ifb, args.netns)['declared']
+        print(json.dumps(calibrate(args.host, profile, args.port), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,19 +4,28 @@ import time
 import json
 import sys
 import pathlib
-import docker
 import os
 import shutil
 import random
 import numpy as np
 import datetime
 import shutil
+import netem
 
 from typing import List
 from pathlib import Path
 from urllib.parse import urlparse
-from docker.types import LogConfig
 from glob import glob
+from docker_pool import ContainerPool, prepare_images
+from origins import ORIGINS, OriginFleet, origins_for
+from trace_replay import TraceReplayer, read_trace
+from calibration import calibrate
+
+# The qlog parser is shared with the analysis scripts
+sys.path.append(str(Path.joinpath(Path(__file__).parent.absolute(), 'analysis')))
+from artifact import save_artifact
+from qlog import parse_qlog, since_start, RECEIVED
+from pcap import decode_pcap, save_packets, load_packets, packet_values, MISSING
 
 DOCKER_CONFIG = {}
 with open(Path.joinpath(Path(__file__).parent.absolute(), 'docker.json'), mode='r') as f:
@@ -35,22 +44,35 @@ with open(Path.joinpath(Path(__file__).parent.absolute(), 'config.json'), mode='
     CONFIG = json.load(f)
 
 RETRIES = 10
+# Docker clients reach origins on these hosts through host networking
+LOOPBACK_HOSTS = ['127.0.0.1', 'localhost']
 ITERATIONS = CONFIG['iterations']['value']
 LOCAL = CONFIG['local']['value']
+COMPRESSION = CONFIG['compression']['value']
 DATA_PATH = Path.joinpath(
     Path(__file__).parent.absolute(), CONFIG['data_path']['value'])
 
-TMP_DIR = Path.joinpath(DATA_PATH, 'tmp')
+# Set by netns.py when scenarios run in parallel network namespaces
+NETNS = os.environ.get('BENCHMARK_NETNS')
+NETWORK_DEVICE = os.environ.get('BENCHMARK_DEVICE', netem.DEVICE)
+IFB_DEVICE = os.environ.get('BENCHMARK_IFB', netem.IFB)
+
+# Shaping is only recorded where tc is available
+TC = shutil.which('tc') is not None
+
+TMP_DIR = Path.joinpath(DATA_PATH, 'tmp', NETNS or '')
 TIME_DIR = Path.joinpath(DATA_PATH, 'timings')
 QLOG_DIR = Path.joinpath(DATA_PATH, 'qlogs')
 PCAP_DIR = Path.joinpath(DATA_PATH, 'pcaps')
 METRICS_DIR = Path.joinpath(DATA_PATH, 'metrics')
+METADATA_DIR = Path.joinpath(DATA_PATH, 'metadata')
 
 TMP_DIR.mkdir(parents=True, exist_ok=True)
 TIME_DIR.mkdir(parents=True, exist_ok=True)
 QLOG_DIR.mkdir(parents=True, exist_ok=True)
 PCAP_DIR.mkdir(parents=True, exist_ok=True)
 METRICS_DIR.mkdir(parents=True, exist_ok=True)
+METADATA_DIR.mkdir(parents=True, exist_ok=True)
 
 TMP_QLOG = Path.joinpath(TMP_DIR, 'qlog')
 TMP_QLOG.mkdir(parents=True, exist_ok=True)
@@ -62,6 +84,10 @@ DOMAINS = CONFIG['domains']['value']
 SIZES = CONFIG['sizes']['single']
 ENV = os.environ.copy()
 
+CONTAINER_POOL = ContainerPool(
+    '/tmp/qlog', recycle_after=CONFIG['pool_recycle']['value'])
+ORIGIN_FLEET = OriginFleet()
+
 
 def remove_files(dirname: str):
     for filename in os.listdir(dirname):
@@ -75,6 +101,22 @@ def remove_files(dirname: str):
             print('Failed to delete %s. Reason: %s' % (file_path, e))
 
 
+def update_metadata(dirpath: str, key: str, value):
+    # Run metadata lives next to the other data trees as <dir>.json
+    metadata_path = Path.joinpath(METADATA_DIR, '{}.json'.format(dirpath))
+    metadata_path.parent.mkdir(parents=True, exist_ok=True)
+
+    metadata = {}
+    if os.path.exists(metadata_path):
+        with open(metadata_path, mode='r') as f:
+            metadata = json.load(f)
+
+    metadata[key] = value
+
+    with open(metadata_path, mode='w') as f:
+        json.dump(metadata, f, indent=4)
+
+
 def record_pcap(url_host: str):
     process = subprocess.Popen([
         'tshark',
@@ -89,7 +131,7 @@ def record_pcap(url_host: str):
     return process
 
 
-def benchmark(client: str, url: str, dirs: List[str], log: bool):
+def benchmark(client: str, url: str, dirs: List[str], log: bool, replayer: TraceReplayer = None):
     timedir, qlogdir, pcapdir, metricsdir = dirs['time'], dirs['qlog'], dirs['pcap'], dirs['metrics']
 
     timings = []
@@ -114,6 +156,8 @@ def benchmark(client: str, url: str, dirs: List[str], log: bool):
         dirpath = Path.joinpath(pcapdir, client)
         Path(dirpath).mkdir(parents=True, exist_ok=True)
 
+    counters = netem.CounterMonitor(NETWORK_DEVICE, IFB_DEVICE, NETNS)
+
     for i in range(len(timings), ITERATIONS):
         for j in range(RETRIES):
 
@@ -126,10 +170,31 @@ def benchmark(client: str, url: str, dirs: List[str], log: bool):
 
                 print('{} - {} - Iteration: {}'.format(client, url, i))
 
-                if LOCAL:
-                    res = run_subprocess(client, url, dirpath, i, log)
-                else:
-                    res = run_docker(client, url, dirpath, i)
+                if TC:
+                    counters.start()
+
+                # Every iteration sees the trace from its beginning
+                if replayer is not None:
+                    replayer.start()
+
+                try:
+                    if LOCAL:
+                        res = run_subprocess(client, url, dirpath, i, log)
+                    else:
+                        res = run_docker(client, url, dirpath, i)
+                finally:
+                    if TC:
+                        deltas = counters.stop()
+                    # Raises if a step failed, which fails the iteration
+                    if replayer is not None:
+                        replay = replayer.stop()
+
+                if replayer is not None:
+                    res['trace'] = replay
+
+                # Drops by emulation, by the shaper and by the host, per side
+                if TC:
+                    res['counters'] = deltas
 
                 metrics.append(res)
                 elapsed = res['time'] * 1000
@@ -218,22 +283,11 @@ def run_subprocess(client: str, url: str, dirpath: str, i: int, log: bool) -> di
             time.sleep(1)
             process.kill()
             time.sleep(1)
-            tshark_output = subprocess.run([
-                'tshark',
-                '-r',
-                Path.joinpath(TMP_PCAP, 'out.pcapng'),
-                '-T',
-                'json',
-                '-o',
-                f'tls.keylog_file: {Path.joinpath(TMP_DIR, "sslkeylog")}',
-                '-j',
-                "Timestamps tcp tcp.flags http2 http2.stream"
-            ], capture_output=True)
-
-            with open(Path.joinpath(dirpath, f'{client}_{i}.json'), mode='w') as f:
-                json.dump(json.loads(tshark_output.stdout.decode()), f)
-
-            result = process_pcap(Path.joinpath(dirpath, f'{client}_{i}.json'))
+            packets = decode_pcap(Path.joinpath(TMP_PCAP, 'out.pcapng'),
+                                  keylog=Path.joinpath(TMP_DIR, 'sslkeylog'))
+            save_packets(Path.joinpath(dirpath, f'{client}_{i}.npz'), packets)
+
+            result = process_pcap(Path.joinpath(dirpath, f'{client}_{i}.npz'))
 
         out_arr = output.stdout.decode().split('\n')[:-1]
         dns_time = float(out_arr[0].split(':')[1])
@@ -254,11 +308,9 @@ def run_subprocess(client: str, url: str, dirpath: str, i: int, log: bool) -> di
         result = process_qlog(oldpath)
 
         if dirpath is not None:
-            with open(oldpath, mode='r') as old:
-                newpath = Path.joinpath(
-                    dirpath, '{}_{}.qlog'.format(client, i))
-                with open(newpath, mode='w') as new:
-                    new.write(old.read())
+            newpath = Path.joinpath(
+                dirpath, '{}_{}.qlog'.format(client, i))
+            save_artifact(oldpath, newpath, COMPRESSION)
 
         remove_files(TMP_QLOG)
         return result
@@ -268,8 +320,6 @@ def run_subprocess(client: str, url: str, dirpath: str, i: int, log: bool) -> di
 
 
 def run_docker(client: str, url: str, dirpath: str, i: int) -> float:
-    DOCKER_CLIENT = docker.from_env()
-
     # Parse URL object
     url_obj = urlparse(url)
     url_host = url_obj.netloc
@@ -284,16 +334,10 @@ def run_docker(client: str, url: str, dirpath: str, i: int) -> float:
     if docker_config is None:
         raise Exception('client {} is not valid'.format(client))
 
-    image = docker_config['image']
-
-    # Check if image exists
-    try:
-        DOCKER_CLIENT.images.get(image)
-    except docker.errors.ImageNotFound:
-        print('Pulling docker image: {}'.format(image))
-        DOCKER_CLIENT.images.pull(image)
-    except Exception as e:
-        raise e
+    # Local origins listen on the host's loopback, which only host networking
+    # reaches. Every other endpoint keeps docker's default bridge network.
+    if url_host in LOOPBACK_HOSTS:
+        docker_config = dict(docker_config, network_mode='host')
 
     # Modify commands
     commands = []
@@ -304,43 +348,19 @@ def run_docker(client: str, url: str, dirpath: str, i: int) -> float:
         command = command.replace('{port}', url_port)
         commands.append(command)
 
-    args = {
-        'detach': True,
-        'auto_remove': False,
-        'volumes': {
-            '/tmp/qlog': {
-                'bind': '/logs',
-                'mode': 'rw',
-            }
-        },
-        'log_config': LogConfig(type=LogConfig.types.JSON, config={'max-size': '1g'}),
-        'command': commands
-    }
-
-    if 'entrypoint' in docker_config:
-        args['entrypoint'] = docker_config['entrypoint']
-
-    if 'cap_add' in docker_config:
-        args['cap_add'] = docker_config['cap_add']
+    # Pooled containers share /tmp/qlog across iterations
+    Path('/tmp/qlog').mkdir(parents=True, exist_ok=True)
+    remove_files('/tmp/qlog')
 
-    if 'security_opt' in docker_config:
-        args['security_opt'] = docker_config['security_opt']
+    if dirpath is not None:
+        logpath = Path.joinpath(dirpath, '{}_{}.log.gz'.format(client, i))
+    else:
+        logpath = Path.joinpath(TMP_DIR, '{}.log.gz'.format(client))
 
-    container = DOCKER_CLIENT.containers.run(
-        image,
-        **args
-    )
-    container.wait()
-    out = container.logs()
-    out = out.decode('utf-8')
-    print(out)
-    container.remove()
+    out = CONTAINER_POOL.run(docker_config, commands, logpath)
 
     if client == 'curl_h2':
-        out_arr = out.split('\n')[:-1]
-        dns_time = float(out_arr[0].split(':')[1])
-        total_time = float(out_arr[1].split(':')[1])
-        return total_time - dns_time
+        return {'time': out['time_total'] - out['time_namelookup']}
 
     if len(os.listdir('/tmp/qlog')) == 0:
         raise 'no qlog created'
@@ -364,82 +384,49 @@ def run_docker(client: str, url: str, dirpath: str, i: int) -> float:
         os.remove(logpath)
     elif client.count('chrome') > 0:
         filepath = Path.joinpath(dirpath, '{}_{}.json'.format(client, i))
-        os.rename(logpath, filepath)
+        save_artifact(logpath, filepath, COMPRESSION)
     else:
         filepath = Path.joinpath(dirpath, '{}_{}.qlog'.format(client, i))
-        os.rename(logpath, filepath)
+        save_artifact(logpath, filepath, COMPRESSION)
 
     return time
 
 
 def process_qlog(qlog: str) -> dict:
-    with open(qlog, mode='r') as f:
-        data = json.load(f)
-        traces = data['traces'][0]
-        events = traces['events']
-        if 'configuration' in traces:
-            time_units = traces['configuration']['time_units']
-        else:
-            time_units = 'ms'
-
-        fin = False
-        start = None
-        end = 0
-        init_rtt = None
-        first_data_pkt_ts = None
-        init_cwnd_mss = 0
-        init_cwnd_bytes = 0
-
-        for event in events:
-            if not event:
-                continue
+    tables = parse_qlog(qlog)
+    start = tables['meta']['start']
+
+    packets = since_start(tables, 'packets')
+    received = packets['time'][packets['direction'] == RECEIVED]
+
+    # A run that received nothing took no time and has no initial window
+    init_rtt = 0
+    end = start
+    if len(received) > 0:
+        init_rtt = received[0] - start
+        end = received.max()
+
+    frames = since_start(tables, 'frames')
+    stream = (frames['direction'] == RECEIVED) & (frames['frame_type'] == 'stream') & (
+        frames['stream_id'] == 0)
+    data = frames['time'][stream]
+    lengths = frames['length'][stream]
+
+    init_cwnd_mss = 0
+    init_cwnd_bytes = 0
+    if len(data) > 0:
+        init_cwnd = data <= data[0] + init_rtt
+        init_cwnd_mss = int(init_cwnd.sum())
+        init_cwnd_bytes = int(lengths[init_cwnd].sum())
+
+    rtts = tables['metrics']['latest_rtt']
 
-            if time_units == 'ms':
-                ts = int(event[0])
-            elif time_units == 'us':
-                ts = int(event[0]) / 1000
-            else:
-                ts = int(event[0]) / 1000
-
-            event_type = event[2]
-            event_data = event[3]
-
-            if event_type.lower() == 'packet_sent' and start is None:
-                start = ts
-
-            if start is None:
-                continue
-
-            if event_type.lower() == 'packet_received':
-                if init_rtt is None:
-                    init_rtt = ts - start
-
-                end = max(end, ts)
-
-                if 'frames' not in event_data:
-                    continue
-
-                frames = event_data['frames']
-
-                for frame in frames:
-                    if frame['frame_type'].lower() == 'stream':
-                        if frame['stream_id'] != '0':
-                            continue
-
-                        length = int(frame['length'])
-
-                        if first_data_pkt_ts is None:
-                            first_data_pkt_ts = ts
-
-                        if ts <= first_data_pkt_ts + init_rtt:
-                            init_cwnd_mss += 1
-                            init_cwnd_bytes += length
-
-        return {
-            'time': (end - start) / 1000,
-            'init_cwnd_mss': init_cwnd_mss,
-            'init_cwnd_bytes': init_cwnd_bytes
-        }
+    return {
+        'time': float(end - start) / 1e9,
+        'init_cwnd_mss': init_cwnd_mss,
+        'init_cwnd_bytes': init_cwnd_bytes,
+        'queueing_delay': queueing_delay(rtts[~np.isnan(rtts)].tolist())
+    }
 
 
 def process_pcap(pcap: str) -> float:
@@ -450,59 +437,77 @@ def process_pcap(pcap: str) -> float:
     elif str(pcap).count('delay-100ms') > 0:
         delay = 100
 
-    with open(pcap, mode='r') as f:
-        data = json.load(f)
+    packets = load_packets(pcap)
 
-        start = None
-        init_rtt = None
+    start = None
+    init_rtt = None
 
-        h2_headers_received = False
-        first_data_pkt_time = None
-        init_cwnd_mss = 0
-        init_cwnd_bytes = 0
+    h2_headers_received = False
+    first_data_pkt_time = None
+    init_cwnd_mss = 0
+    init_cwnd_bytes = 0
 
-        # Associate each ACK offset with a timestamp
-        for packet in data:
-            tcp = packet['_source']['layers']['tcp']
-            h2 = packet['_source']['layers'].get('http2', {})
-            srcport = tcp['tcp.srcport']
-            time = float(tcp['Timestamps']['tcp.time_relative']) * 1000
+    # RTT samples from TCP timestamps: a TSval sent by the client until
+    # the server first echoes it back
+    tsval_sent = {}
+    rtts = []
 
-            if srcport != '443' and start is None:
-                start = time
+    # Associate each ACK offset with a timestamp
+    for i, (srcport, time, tsval, tsecr, bytes_len) in enumerate(zip(
+            *[packets[x].tolist() for x in ['srcport', 'time', 'tsval', 'tsecr', 'len']])):
+        time = time * 1000
 
-            if start is None:
-                continue
+        if srcport != 443 and tsval != MISSING:
+            tsval_sent.setdefault(tsval, time)
+        elif tsecr != MISSING and tsecr in tsval_sent:
+            rtts.append(time - tsval_sent.pop(tsecr))
 
-            # receive packet
-            if srcport == '443':
-                if init_rtt is None:
-                    init_rtt = time - start + delay
+        if srcport != 443 and start is None:
+            start = time
 
-                if not isinstance(h2, dict):
-                    continue
+        if start is None:
+            continue
 
-                stream_id = h2.get('http2.stream', {}).get(
-                    'http2.streamid', None)
+        # receive packet
+        if srcport == 443:
+            if init_rtt is None:
+                init_rtt = time - start + delay
 
-                # Find packet received with h2 headers. All packets received after that are data packets
-                if not h2_headers_received:
-                    if stream_id == '1':
-                        h2_headers_received = True
-                    continue
+            streams = packet_values(packets, 'http2_stream', i).tolist()
 
-                if first_data_pkt_time is None:
-                    first_data_pkt_time = time
+            # Find packet received with h2 headers. All packets received after that are data packets
+            if not h2_headers_received:
+                if 1 in streams:
+                    h2_headers_received = True
+                continue
 
-                bytes_len = int(tcp['tcp.len'])
+            if first_data_pkt_time is None:
+                first_data_pkt_time = time
 
-                if time <= first_data_pkt_time + init_rtt:
-                    init_cwnd_mss += 1
-                    init_cwnd_bytes += bytes_len
+            if time <= first_data_pkt_time + init_rtt:
+                init_cwnd_mss += 1
+                init_cwnd_bytes += bytes_len
 
     return {
         'init_cwnd_mss': init_cwnd_mss,
-        'init_cwnd_bytes': init_cwnd_bytes
+        'init_cwnd_bytes': init_cwnd_bytes,
+        'queueing_delay': queueing_delay(rtts)
+    }
+
+
+def queueing_delay(rtts: list) -> dict:
+    """RTT inflation over the lowest RTT seen in the connection, in ms"""
+    if len(rtts) == 0:
+        return None
+
+    inflation = np.array(rtts) - np.min(rtts)
+
+    return {
+        'base_rtt': float(np.min(rtts)),
+        'mean': float(np.mean(inflation)),
+        'median': float(np.median(inflation)),
+        'p95': float(np.percentile(inflation, 95)),
+        'max': float(np.max(inflation)),
     }
 
 
@@ -512,6 +517,16 @@ def main():
     parser.add_argument('--dir')
     parser.add_argument('--log', dest='log',
                         action='store_true', default=False)
+    parser.add_argument('--network',
+                        help='Network profile to apply for this run, e.g. loss-1_delay-50_bw-10')
+    parser.add_argument('--origin-host',
+                        help='Reach local origins at this address. The caller then manages the origins')
+    parser.add_argument('--calibrate', choices=['strict', 'flag', 'off'], default=CONFIG['calibration']['value'],
+                        help='Probe the shaped path before the campaign and refuse to start or flag the run when it disagrees with the profile')
+    parser.add_argument('--trace',
+                        help='Mahimahi or CSV (time_ms,rate_kbit[,delay_ms]) trace replayed during every iteration')
+    parser.add_argument('--trace-direction', choices=['egress', 'ingress', 'both'], default='ingress',
+                        help='Side of the shaped link the trace drives')
 
     args = parser.parse_args()
 
@@ -526,30 +541,94 @@ def main():
     # Not using chrome via python script for now
     clients = [x for x in clients if x.count('chrome') == 0]
 
-    for domain in DOMAINS:
-        for size in SIZES:
-
-            dirs = {}
-            for name in ['time', 'qlog', 'pcap', 'metrics']:
-                if name == 'time':
-                    dirname = TIME_DIR
-                elif name == 'qlog':
-                    dirname = QLOG_DIR
-                elif name == 'pcap':
-                    dirname = PCAP_DIR
-                else:
-                    dirname = METRICS_DIR
+    # Local domains are served by origin servers managed by this script
+    origin_names = origins_for(DOMAINS) if args.origin_host is None else []
+
+    images = [ORIGINS[x]['image'] for x in origin_names]
+    if not LOCAL:
+        images += [DOCKER_CONFIG[x]['image']
+                   for x in clients if x in DOCKER_CONFIG]
+
+    # Pull and pin every docker image up front so iterations never block on a pull
+    if len(images) > 0:
+        pinned = prepare_images(images)
+        CONTAINER_POOL.pin(pinned)
+        ORIGIN_FLEET.pin(pinned)
+        update_metadata(dirpath, 'images', pinned)
+
+    if args.network is not None:
+        netem.apply(netem.profile_from_name(args.network),
+                    NETWORK_DEVICE, IFB_DEVICE, NETNS)
+
+    # Record the shaping in effect, however it was applied
+    network = None
+    if TC:
+        network = netem.current_profile(NETWORK_DEVICE, IFB_DEVICE, NETNS)
+        update_metadata(dirpath, 'network', network)
+
+    # Origins reached over a scenario's link share the host with its reflector
+    reflector = args.origin_host or CONFIG['reflector']['value']
+    if args.calibrate != 'off' and reflector is not None:
+        declared = network['declared'] if network is not None else None
+        calibration = calibrate(reflector, declared)
+        update_metadata(dirpath, 'calibration', calibration)
+
+        if calibration['ok'] is False:
+            failed = [x for x, y in calibration['checks'].items() if not y['ok']]
+            if args.calibrate == 'strict':
+                if args.network is not None:
+                    netem.teardown(NETWORK_DEVICE, IFB_DEVICE, NETNS)
+                raise Exception('calibration failed: {}'.format(', '.join(failed)))
+            print('Calibration failed, flagging run: {}'.format(', '.join(failed)))
+
+    replayer = None
+    if args.trace is not None:
+        if network is None or network['declared'] is None:
+            raise Exception('trace replay needs a profile applied by netem.py')
+
+        replayer = TraceReplayer(read_trace(args.trace), network['declared'],
+                                 args.trace_direction, NETWORK_DEVICE, IFB_DEVICE, NETNS)
+        update_metadata(dirpath, 'trace', {
+            'path': str(Path(args.trace).absolute()),
+            'direction': args.trace_direction,
+            'steps': len(replayer.schedule),
+        })
 
-                tmp_dir = Path.joinpath(dirname, dirpath, domain, size)
-                tmp_dir.mkdir(parents=True, exist_ok=True)
-                dirs[name] = tmp_dir
-
-            pcapdir = Path.joinpath(PCAP_DIR, dirpath, domain, size)
-            pcapdir.mkdir(parents=True, exist_ok=True)
-
-            for client in clients:
-                url = ENDPOINTS[domain][size]
-                benchmark(client, url, dirs, args.log)
+    try:
+        ORIGIN_FLEET.start(origin_names)
+
+        for domain in DOMAINS:
+            for size in SIZES:
+
+                dirs = {}
+                for name in ['time', 'qlog', 'pcap', 'metrics']:
+                    if name == 'time':
+                        dirname = TIME_DIR
+                    elif name == 'qlog':
+                        dirname = QLOG_DIR
+                    elif name == 'pcap':
+                        dirname = PCAP_DIR
+                    else:
+                        dirname = METRICS_DIR
+
+                    tmp_dir = Path.joinpath(dirname, dirpath, domain, size)
+                    tmp_dir.mkdir(parents=True, exist_ok=True)
+                    dirs[name] = tmp_dir
+
+                pcapdir = Path.joinpath(PCAP_DIR, dirpath, domain, size)
+                pcapdir.mkdir(parents=True, exist_ok=True)
+
+                for client in clients:
+                    url = ENDPOINTS[domain][size]
+                    if args.origin_host is not None and len(origins_for([domain])) > 0:
+                        url = url.replace('127.0.0.1', args.origin_host)
+                    benchmark(client, url, dirs, args.log, replayer)
+    finally:
+        CONTAINER_POOL.close()
+        ORIGIN_FLEET.stop(origin_names)
+
+        if args.network is not None:
+            netem.teardown(NETWORK_DEVICE, IFB_DEVICE, NETNS)
 
 
 if __name__ == "__main__":
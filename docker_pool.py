@@ -0,0 +1,282 @@
+import docker
+import gzip
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from docker.types import LogConfig
+from docker.utils import parse_repository_tag
+
+# Keeps a pooled container alive without doing any work
+KEEPALIVE = ['tail', '-f', '/dev/null']
+
+# Seconds between pull progress reports
+PROGRESS_INTERVAL = 5
+
+# Lines longer than this are spilled to disk but never buffered whole
+MAX_LINE = 64 * 1024
+
+_DOCKER_CLIENT = None
+_IMAGES = set()
+
+
+def get_client() -> docker.DockerClient:
+    global _DOCKER_CLIENT
+
+    if _DOCKER_CLIENT is None:
+        _DOCKER_CLIENT = docker.from_env()
+
+    return _DOCKER_CLIENT
+
+
+def ensure_image(image: str):
+    # Only ask the daemon once per image per process
+    if image in _IMAGES:
+        return
+
+    client = get_client()
+
+    try:
+        client.images.get(image)
+    except docker.errors.ImageNotFound:
+        print('Pulling docker image: {}'.format(image))
+        client.images.pull(image)
+
+    _IMAGES.add(image)
+
+
+def stream_output(chunks, logpath: str, prefix: bytes = b'time_') -> dict:
+    """
+    Spill container output to a gzipped log while keeping only `key:value`
+    lines that start with `prefix` in memory.
+    """
+    timings = {}
+    pending = b''
+    overflow = False
+    size = 0
+
+    with gzip.open(logpath, mode='wb') as log:
+        for chunk in chunks:
+            log.write(chunk)
+            size += len(chunk)
+
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+
+            for line in lines:
+                if overflow:
+                    overflow = False
+                    continue
+
+                if line.startswith(prefix) and line.count(b':') > 0:
+                    key, value = line.decode('utf-8').split(':', 1)
+                    timings[key] = float(value)
+
+            # Drop the rest of an overlong line instead of buffering it
+            if len(pending) > MAX_LINE:
+                pending = b''
+                overflow = True
+
+    if not overflow and pending.startswith(prefix) and pending.count(b':') > 0:
+        key, value = pending.decode('utf-8').split(':', 1)
+        timings[key] = float(value)
+
+    print('Container output: {} bytes written to {}'.format(size, logpath))
+
+    return timings
+
+
+def resolve_image(image: str) -> str:
+    """Resolve an image reference to an immutable `repo@sha256:...` reference"""
+    client = get_client()
+    repository, _ = parse_repository_tag(image)
+
+    try:
+        digest = client.images.get_registry_data(image).id
+    except docker.errors.APIError:
+        # Locally built images (e.g. chrome) are not in any registry, so pin
+        # them to the local image id instead
+        return client.images.get(image).id
+
+    return '{}@{}'.format(repository, digest)
+
+
+def pull_image(reference: str):
+    client = get_client()
+
+    try:
+        client.images.get(reference)
+        print('Image up to date: {}'.format(reference))
+        return
+    except docker.errors.ImageNotFound:
+        pass
+
+    repository, tag = parse_repository_tag(reference)
+    layers = {}
+    last_report = time.time()
+
+    for status in client.api.pull(repository, tag=tag, stream=True, decode=True):
+        if 'error' in status:
+            raise Exception('Failed to pull {}: {}'.format(
+                reference, status['error']))
+
+        detail = status.get('progressDetail') or {}
+        if 'id' in status and 'total' in detail:
+            layers[status['id']] = (detail.get('current', 0), detail['total'])
+
+        if time.time() - last_report > PROGRESS_INTERVAL:
+            current = sum(x[0] for x in layers.values())
+            total = sum(x[1] for x in layers.values())
+            print('Pulling {}: {:.1f}/{:.1f} MB'.format(
+                reference, current / 1024 / 1024, total / 1024 / 1024))
+            last_report = time.time()
+
+    print('Pulled {}'.format(reference))
+
+
+def prepare_images(images: list) -> dict:
+    """
+    Resolve every image to a digest and pull the missing ones concurrently.
+    Returns a map of image name to pinned reference.
+    """
+    images = sorted(set(images))
+
+    with ThreadPoolExecutor(max_workers=max(len(images), 1)) as executor:
+        references = list(executor.map(resolve_image, images))
+        list(executor.map(pull_image, references))
+
+    pinned = dict(zip(images, references))
+    _IMAGES.update(pinned.values())
+
+    return pinned
+
+
+def pool_key(docker_config: dict) -> tuple:
+    # A container's network mode is fixed when it is created
+    return (docker_config['image'], docker_config.get('network_mode'))
+
+
+class ContainerPool:
+    """
+    One long-lived container per client image and network mode. Iterations
+    are run inside it with `exec_run`, and the container is recreated after
+    `recycle_after` iterations or whenever it fails a health check.
+    """
+
+    def __init__(self, qlog_dir: str, recycle_after: int = 50):
+        self.qlog_dir = str(qlog_dir)
+        self.recycle_after = recycle_after
+        self.entries = {}
+        self.pinned = {}
+
+    def pin(self, pinned: dict):
+        self.pinned.update(pinned)
+
+    def run(self, docker_config: dict, commands: list, logpath: str) -> dict:
+        key = pool_key(docker_config)
+        entry = self.acquire(docker_config)
+        entry['iterations'] += 1
+
+        # The low-level exec API, unlike exec_run, reports the exit code of a
+        # streamed exec once its output ends
+        api = get_client().api
+        try:
+            exec_id = api.exec_create(entry['container'].id, entry['entrypoint'] + commands)['Id']
+            timings = stream_output(api.exec_start(exec_id, stream=True), logpath)
+            exit_code = api.exec_inspect(exec_id)['ExitCode']
+        except docker.errors.APIError as e:
+            self.discard(key)
+            raise e
+
+        if exit_code != 0:
+            raise Exception('client in {} exited with code {}, see {}'.format(
+                docker_config['image'], exit_code, logpath))
+
+        return timings
+
+    def acquire(self, docker_config: dict) -> dict:
+        key = pool_key(docker_config)
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            if entry['iterations'] >= self.recycle_after:
+                print('Recycling container for {}'.format(key[0]))
+                self.discard(key)
+            elif not self.healthy(entry):
+                print('Replacing unhealthy container for {}'.format(key[0]))
+                self.discard(key)
+
+        if key not in self.entries:
+            self.entries[key] = self.start(docker_config)
+
+        return self.entries[key]
+
+    def start(self, docker_config: dict) -> dict:
+        client = get_client()
+        image = self.pinned.get(docker_config['image'], docker_config['image'])
+
+        ensure_image(image)
+
+        args = {
+            'detach': True,
+            'auto_remove': False,
+            'entrypoint': KEEPALIVE,
+            'volumes': {
+                self.qlog_dir: {
+                    'bind': '/logs',
+                    'mode': 'rw',
+                }
+            },
+            # Client output is streamed from exec, the container itself only runs KEEPALIVE
+            'log_config': LogConfig(type=LogConfig.types.JSON, config={'max-size': '10m'}),
+        }
+
+        if 'cap_add' in docker_config:
+            args['cap_add'] = docker_config['cap_add']
+
+        if 'security_opt' in docker_config:
+            args['security_opt'] = docker_config['security_opt']
+
+        if 'network_mode' in docker_config:
+            args['network_mode'] = docker_config['network_mode']
+
+        # Pooled containers run KEEPALIVE, so the client entrypoint is
+        # prepended to every exec instead
+        if 'entrypoint' in docker_config:
+            entrypoint = docker_config['entrypoint']
+            entrypoint = [entrypoint] if entrypoint else []
+        else:
+            entrypoint = client.images.get(
+                image).attrs['Config'].get('Entrypoint') or []
+
+        container = client.containers.run(image, **args)
+
+        return {
+            'container': container,
+            'entrypoint': entrypoint,
+            'iterations': 0,
+        }
+
+    def healthy(self, entry: dict) -> bool:
+        try:
+            entry['container'].reload()
+            if entry['container'].status != 'running':
+                return False
+
+            exit_code, _ = entry['container'].exec_run(['true'])
+            return exit_code == 0
+        except docker.errors.APIError:
+            return False
+
+    def discard(self, key: tuple):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        try:
+            entry['container'].remove(force=True)
+        except docker.errors.APIError as e:
+            print('Failed to remove container for {}. Reason: {}'.format(key[0], e))
+
+    def close(self):
+        for key in list(self.entries.keys()):
+            self.discard(key)
@@ -26,7 +26,7 @@ NETWORK_CONDITIONS=(
 
 for network in "${NETWORK_CONDITIONS[@]}"; do
     echo "$network"
-    $BASEDIR/network/"$network".sh
+    python3 $BASEDIR/../netem.py apply "$network"
     runuser -l ayu9 -c "$BASEDIR/run_benchmark.sh $network"
 done
 
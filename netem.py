@@ -0,0 +1,658 @@
+import argparse
+import json
+import math
+import re
+import subprocess
+import threading
+
+from pathlib import Path
+
+CONFIG = {}
+with open(Path.joinpath(Path(__file__).parent.absolute(), 'config.json'), mode='r') as f:
+    CONFIG = json.load(f)
+
+DEVICE = CONFIG['network_device']['value']
+IFB = CONFIG['ifb_device']['value']
+
+# The last applied profile per device, so unprivileged processes can record it
+STATE_DIR = Path('/tmp/netem')
+
+# Handles used by the hand-written network/*.sh scripts
+ROOT_HANDLE = '1a64:'
+SHAPED_CLASS = '1a64:104'
+NETEM_HANDLE = '2054:'
+
+# Queue disciplines that can hold the bottleneck queue, attached below netem
+AQM_HANDLE = '2055:'
+QDISCS = ['pfifo', 'fq_codel', 'codel', 'pie']
+
+# Buffers are sized from the profile's delay, but never for less than this RTT
+MIN_BDP_RTT = 10
+MTU = 1500
+
+# Relative tolerance when comparing tc read-back with the declared profile
+TOLERANCE = 0.01
+
+# Seconds between backlog samples while counters are being tracked
+BACKLOG_INTERVAL = 0.05
+
+STATS_PATTERN = re.compile(
+    r'Sent (\d+) bytes (\d+) pkt \(dropped (\d+), overlimits (\d+) requeues (\d+)\)')
+BACKLOG_PATTERN = re.compile(r'backlog (\S+) (\d+)p')
+
+NAME_PATTERN = re.compile(
+    r'^loss-(?P<loss>[0-9dot]+)(?P<burst>burst)?(?P<direction>egress|ingress)?'
+    r'_delay-(?P<delay>\d+)(?P<jitter>jitter)?_bw-(?P<bw>\d+)'
+    r'(?:_qdisc-(?P<qdisc>' + '|'.join(QDISCS) + r'))?(?:_buf-(?P<buf>[0-9dot]+))?$')
+
+# HTB bursts of the network/*.sh scripts that differ from the 12500KB default
+SCRIPT_BURSTS = {
+    'loss-1burst_delay-0_bw-10': 1250,
+}
+
+
+def build_direction(delay: float = 0, jitter: float = 0, loss: float = 0,
+                    loss_model: str = 'random', burst_exit: float = 75,
+                    bad_loss: float = 100, good_loss: float = 0,
+                    limit: int = None) -> dict:
+    if loss_model not in ['random', 'state', 'gemodel']:
+        raise Exception('loss model {} is not valid'.format(loss_model))
+
+    return {
+        'delay': float(delay),
+        'jitter': float(jitter),
+        'loss': float(loss),
+        'loss_model': loss_model,
+        'burst_exit': float(burst_exit),
+        'bad_loss': float(bad_loss),
+        'good_loss': float(good_loss),
+        'limit': limit,
+    }
+
+
+def build_profile(rate: float, delay: float = 0, jitter: float = 0, loss: float = 0,
+                  loss_model: str = 'random', burst_exit: float = 75,
+                  bad_loss: float = 100, good_loss: float = 0,
+                  direction: str = 'both', delay_direction: str = 'egress',
+                  limit: int = None, burst: float = 12500, name: str = None,
+                  qdisc: str = None, buffer_bdp: float = None) -> dict:
+    """
+    Rate is in kbit, delay and jitter in ms, loss in percent. `direction`
+    selects where loss is injected. With `delay_direction='both'` the delay
+    is split evenly between egress and ingress.
+
+    `qdisc` attaches a queue discipline below netem that holds the
+    bottleneck queue, limited to `buffer_bdp` bandwidth-delay products.
+    """
+    if direction not in ['both', 'egress', 'ingress']:
+        raise Exception('direction {} is not valid'.format(direction))
+
+    if buffer_bdp is not None and qdisc is None:
+        qdisc = 'pfifo'
+
+    if qdisc is not None and qdisc not in QDISCS:
+        raise Exception('qdisc {} is not valid'.format(qdisc))
+
+    if delay_direction not in ['both', 'egress', 'ingress']:
+        raise Exception('delay direction {} is not valid'.format(delay_direction))
+
+    profile = {
+        'name': name,
+        'rate': float(rate),
+        'burst': float(burst),
+        'qdisc': qdisc,
+        'buffer_bdp': float(buffer_bdp) if buffer_bdp is not None else None,
+        'buffer_packets': buffer_packets(rate, delay, buffer_bdp) if buffer_bdp is not None else None,
+    }
+
+    for side in ['egress', 'ingress']:
+        side_delay = 0
+        side_jitter = 0
+        if delay_direction == 'both':
+            side_delay = delay / 2
+            side_jitter = jitter / 2
+        elif delay_direction == side:
+            side_delay = delay
+            side_jitter = jitter
+
+        side_loss = loss if direction in ['both', side] else 0
+
+        profile[side] = build_direction(
+            delay=side_delay,
+            jitter=side_jitter,
+            loss=side_loss,
+            loss_model=loss_model,
+            burst_exit=burst_exit,
+            bad_loss=bad_loss,
+            good_loss=good_loss,
+            limit=limit)
+
+    return profile
+
+
+def buffer_packets(rate: float, rtt: float, bdp: float) -> int:
+    """Packets in `bdp` bandwidth-delay products of a `rate` kbit link with `rtt` ms"""
+    bdp_bytes = rate * 1000 / 8 * max(rtt, MIN_BDP_RTT) / 1000
+    return max(int(math.ceil(bdp * bdp_bytes / MTU)), 1)
+
+
+def profile_from_name(name: str) -> dict:
+    """
+    Build the profile equivalent to one of the network/*.sh scripts. The
+    device is the caller's, so `_local` scripts, which shape lo, are not
+    accepted by name.
+    """
+    if name.endswith('_local'):
+        raise Exception('network profile {} shapes lo, apply {} to lo instead'.format(
+            name, name[:-len('_local')]))
+
+    match = NAME_PATTERN.match(name)
+    if match is None:
+        raise Exception('network profile {} is not valid'.format(name))
+
+    loss = float(match.group('loss').replace('dot', '.'))
+    delay = float(match.group('delay'))
+
+    return build_profile(
+        rate=int(match.group('bw')) * 1000,
+        delay=delay,
+        jitter=30 if match.group('jitter') else 0,
+        loss=loss,
+        loss_model='state' if match.group('burst') else 'random',
+        direction=match.group('direction') or 'both',
+        # Lossy profiles with delay split it across both directions
+        delay_direction='both' if loss > 0 and delay > 0 else 'egress',
+        burst=SCRIPT_BURSTS.get(name[:match.end('bw')], 12500),
+        name=name,
+        qdisc=match.group('qdisc'),
+        buffer_bdp=float(match.group('buf').replace('dot', '.')) if match.group('buf') else None)
+
+
+def netem_args(side: dict) -> str:
+    args = []
+
+    if side['limit'] is not None:
+        args.append('limit {}'.format(side['limit']))
+
+    if side['loss'] > 0:
+        if side['loss_model'] == 'random':
+            args.append('loss {:f}%'.format(side['loss']))
+        elif side['loss_model'] == 'state':
+            args.append('loss state {:g}% {:g}%'.format(
+                side['loss'], side['burst_exit']))
+        else:
+            args.append('loss gemodel {:g}% {:g}% {:g}% {:g}%'.format(
+                side['loss'], side['burst_exit'], side['bad_loss'], side['good_loss']))
+
+    if side['delay'] > 0:
+        delay = 'delay {:.1f}ms'.format(side['delay'])
+        if side['jitter'] > 0:
+            delay += ' {:.1f}ms'.format(side['jitter'])
+        args.append(delay)
+
+    return ' '.join(args)
+
+
+def shaping_lines(profile: dict, dev: str, side: dict, root_rate: str) -> list:
+    rate = profile['rate']
+    burst = profile['burst']
+
+    return [
+        'qdisc add dev {} root handle {} htb default 1'.format(dev, ROOT_HANDLE),
+        'class add dev {} parent {} classid 1a64:1 htb rate {}'.format(
+            dev, ROOT_HANDLE, root_rate),
+        'class add dev {} parent {} classid {} htb rate {:.1f}Kbit ceil {:.1f}Kbit burst {:.1f}KB cburst {:.1f}KB'.format(
+            dev, ROOT_HANDLE, SHAPED_CLASS, rate, rate, burst, burst),
+        'qdisc add dev {} parent {} handle {} netem {}'.format(
+            dev, SHAPED_CLASS, NETEM_HANDLE, netem_args(side)).rstrip(),
+    ] + aqm_lines(profile, dev) + [
+        'filter add dev {} protocol ip parent {} prio 5 u32 match ip dst 0.0.0.0/0 match ip src 0.0.0.0/0 flowid {}'.format(
+            dev, ROOT_HANDLE, SHAPED_CLASS),
+    ]
+
+
+def aqm_lines(profile: dict, dev: str) -> list:
+    # netem hands packets to its child once their delay has passed, so the
+    # child holds the queue that builds up behind the HTB rate
+    if profile.get('qdisc') is None:
+        return []
+
+    line = 'qdisc add dev {} parent {}1 handle {} {}'.format(
+        dev, NETEM_HANDLE, AQM_HANDLE, profile['qdisc'])
+    if profile['buffer_packets'] is not None:
+        line += ' limit {}'.format(profile['buffer_packets'])
+
+    return [line]
+
+
+def tc_lines(profile: dict, dev: str = DEVICE, ifb: str = IFB) -> list:
+    """tc commands (without the leading `tc`) that install a profile"""
+    lines = shaping_lines(profile, dev, profile['egress'], '10000000.0kbit')
+
+    # Ingress traffic is redirected to the ifb device and shaped on its egress
+    lines += [
+        'qdisc add dev {} ingress'.format(dev),
+        'filter add dev {} parent ffff: protocol ip u32 match u32 0 0 flowid {} action mirred egress redirect dev {}'.format(
+            dev, ROOT_HANDLE, ifb),
+    ]
+    lines += shaping_lines(profile, ifb, profile['ingress'], '32000000.0kbit')
+
+    return lines
+
+
+def script(profile: dict, dev: str = DEVICE, ifb: str = IFB) -> str:
+    """Render a profile in the format of the network/*.sh scripts"""
+    lines = ['#/bin/bash', '']
+    lines += ['/sbin/tc qdisc del dev {} root'.format(dev),
+              '/sbin/tc qdisc del dev {} ingress'.format(dev),
+              '/sbin/tc qdisc del dev {} root'.format(ifb),
+              '/usr/bin/ip link set dev {} down'.format(ifb),
+              '/usr/bin/ip link delete {} type ifb'.format(ifb),
+              '']
+    lines += ['modprobe ifb',
+              '/usr/bin/ip link add {} type ifb'.format(ifb),
+              '/usr/bin/ip link set dev {} up'.format(ifb)]
+    lines += ['/sbin/tc {}'.format(x) for x in tc_lines(profile, dev, ifb)]
+
+    return '\n'.join(lines)
+
+
+def ns_args(netns: str) -> list:
+    return ['-n', netns] if netns is not None else []
+
+
+def teardown(dev: str = DEVICE, ifb: str = IFB, netns: str = None):
+    # Deleting a qdisc that does not exist fails, which is fine here
+    for command in [
+        ['tc'] + ns_args(netns) + ['qdisc', 'del', 'dev', dev, 'root'],
+        ['tc'] + ns_args(netns) + ['qdisc', 'del', 'dev', dev, 'ingress'],
+        ['ip'] + ns_args(netns) + ['link', 'delete', ifb, 'type', 'ifb'],
+    ]:
+        subprocess.run(command, capture_output=True)
+
+    state_path(dev, netns).unlink(missing_ok=True)
+
+
+def apply(profile: dict, dev: str = DEVICE, ifb: str = IFB, netns: str = None) -> dict:
+    """
+    Replace any shaping on `dev` with `profile`. All tc commands run in one
+    `tc -batch` invocation and anything half-installed is torn down if it
+    fails. Returns the verified read-back.
+    """
+    teardown(dev, ifb, netns)
+
+    subprocess.run(['modprobe', 'ifb'], capture_output=True)
+    subprocess.run(['ip'] + ns_args(netns) +
+                   ['link', 'add', ifb, 'type', 'ifb'], check=True, capture_output=True)
+    subprocess.run(['ip'] + ns_args(netns) +
+                   ['link', 'set', 'dev', ifb, 'up'], check=True, capture_output=True)
+
+    output = subprocess.run(['tc'] + ns_args(netns) + ['-batch', '-'],
+                            input='\n'.join(tc_lines(profile, dev, ifb)) + '\n',
+                            capture_output=True, text=True)
+
+    if output.returncode != 0:
+        teardown(dev, ifb, netns)
+        raise Exception('failed to apply profile: {}'.format(output.stderr.strip()))
+
+    try:
+        observed = verify(profile, dev, ifb, netns)
+    except Exception as e:
+        teardown(dev, ifb, netns)
+        raise e
+
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(state_path(dev, netns), mode='w') as f:
+        json.dump(profile, f)
+
+    return observed
+
+
+def state_path(dev: str, netns: str = None) -> Path:
+    if netns is not None:
+        return Path.joinpath(STATE_DIR, '{}-{}.json'.format(netns, dev))
+    return Path.joinpath(STATE_DIR, '{}.json'.format(dev))
+
+
+def parse_time(value: str) -> float:
+    # tc prints times as e.g. 50ms, 1.5s or 500us; returns ms
+    match = re.match(r'([\d.]+)(s|ms|us)', value)
+    number = float(match.group(1))
+    return {'s': number * 1000, 'ms': number, 'us': number / 1000}[match.group(2)]
+
+
+def parse_rate(value: str) -> float:
+    # tc prints rates as e.g. 10Mbit or 800Kbit; returns kbit
+    match = re.match(r'([\d.]+)([KMG]?)bit', value)
+    number = float(match.group(1))
+    return number * {'': 0.001, 'K': 1, 'M': 1000, 'G': 1000000}[match.group(2)]
+
+
+def parse_netem(line: str) -> dict:
+    side = build_direction()
+
+    match = re.search(r'limit (\d+)', line)
+    if match is not None:
+        side['limit'] = int(match.group(1))
+
+    match = re.search(r'delay ([\d.]+\w+)(?:\s+([\d.]+\w+))?', line)
+    if match is not None:
+        side['delay'] = parse_time(match.group(1))
+        if match.group(2) is not None:
+            side['jitter'] = parse_time(match.group(2))
+
+    match = re.search(r'loss state p13 ([\d.]+)% p31 ([\d.]+)%', line)
+    if match is not None:
+        side['loss_model'] = 'state'
+        side['loss'] = float(match.group(1))
+        side['burst_exit'] = float(match.group(2))
+
+    match = re.search(
+        r'loss gemodel p ([\d.]+)% r ([\d.]+)% 1-h ([\d.]+)% 1-k ([\d.]+)%', line)
+    if match is not None:
+        side['loss_model'] = 'gemodel'
+        side['loss'] = float(match.group(1))
+        side['burst_exit'] = float(match.group(2))
+        side['bad_loss'] = float(match.group(3))
+        side['good_loss'] = float(match.group(4))
+
+    match = re.search(r'loss ([\d.]+)%', line)
+    if match is not None:
+        side['loss'] = float(match.group(1))
+
+    return side
+
+
+def read_device(dev: str, netns: str = None) -> dict:
+    qdiscs = subprocess.run(['tc'] + ns_args(netns) + ['-s', 'qdisc', 'show', 'dev', dev],
+                            capture_output=True, text=True).stdout
+    classes = subprocess.run(['tc'] + ns_args(netns) + ['-s', 'class', 'show', 'dev', dev],
+                             capture_output=True, text=True).stdout
+
+    side = None
+    aqm = None
+    for line in qdiscs.split('\n'):
+        if line.startswith('qdisc netem {}'.format(NETEM_HANDLE)):
+            side = parse_netem(line)
+        elif line.startswith('qdisc ') and line.split()[2] == AQM_HANDLE:
+            limit = re.search(r' limit (\d+)p', line)
+            aqm = {
+                'qdisc': line.split()[1],
+                'limit': int(limit.group(1)) if limit is not None else None,
+            }
+
+    rate = None
+    for line in classes.split('\n'):
+        if line.startswith('class htb {}'.format(SHAPED_CLASS)):
+            rate = parse_rate(re.search(r' rate (\S+)', line).group(1))
+
+    return {
+        'rate': rate,
+        'netem': side,
+        'aqm': aqm,
+        'qdisc': qdiscs,
+        'class': classes,
+    }
+
+
+def read_profile(dev: str = DEVICE, ifb: str = IFB, netns: str = None) -> dict:
+    """Read the installed shaping back from `tc -s`"""
+    return {
+        'egress': read_device(dev, netns),
+        'ingress': read_device(ifb, netns),
+    }
+
+
+def close(a: float, b: float) -> bool:
+    return abs(a - b) <= TOLERANCE * max(abs(a), abs(b), 1)
+
+
+def verify(profile: dict, dev: str = DEVICE, ifb: str = IFB, netns: str = None) -> dict:
+    observed = read_profile(dev, ifb, netns)
+
+    for side in ['egress', 'ingress']:
+        declared = profile[side]
+        device = observed[side]
+
+        if device['rate'] is None or device['netem'] is None:
+            raise Exception('{} shaping is not installed'.format(side))
+
+        if not close(device['rate'], profile['rate']):
+            raise Exception('{} rate is {} kbit, expected {} kbit'.format(
+                side, device['rate'], profile['rate']))
+
+        for key in ['delay', 'jitter', 'loss']:
+            if not close(device['netem'][key], declared[key]):
+                raise Exception('{} {} is {}, expected {}'.format(
+                    side, key, device['netem'][key], declared[key]))
+
+        if declared['loss'] > 0 and device['netem']['loss_model'] != declared['loss_model']:
+            raise Exception('{} loss model is {}, expected {}'.format(
+                side, device['netem']['loss_model'], declared['loss_model']))
+
+        if profile.get('qdisc') is not None:
+            if device['aqm'] is None or device['aqm']['qdisc'] != profile['qdisc']:
+                raise Exception('{} qdisc is {}, expected {}'.format(
+                    side, device['aqm'], profile['qdisc']))
+
+            if profile['buffer_packets'] is not None and device['aqm']['limit'] != profile['buffer_packets']:
+                raise Exception('{} buffer is {} packets, expected {}'.format(
+                    side, device['aqm']['limit'], profile['buffer_packets']))
+
+    return observed
+
+
+def parse_size(value: str) -> int:
+    # tc prints sizes as e.g. 0b, 1514b, 12Kb or 3Mb; returns bytes
+    match = re.match(r'([\d.]+)([KMG]?)b', value)
+    return int(float(match.group(1)) * {'': 1, 'K': 1000, 'M': 1000000, 'G': 1000000000}[match.group(2)])
+
+
+def parse_stats(output: str) -> dict:
+    """Counters per handle from `tc -s qdisc show` or `tc -s class show`"""
+    stats = {}
+    handle = None
+
+    for line in output.split('\n'):
+        if line.startswith('qdisc ') or line.startswith('class '):
+            handle = line.split()[2]
+            continue
+
+        match = STATS_PATTERN.search(line)
+        if match is not None and handle is not None:
+            stats[handle] = {
+                'bytes': int(match.group(1)),
+                'packets': int(match.group(2)),
+                'dropped': int(match.group(3)),
+                'overlimits': int(match.group(4)),
+                'requeues': int(match.group(5)),
+            }
+
+        match = BACKLOG_PATTERN.search(line)
+        if match is not None and handle in stats:
+            stats[handle]['backlog_bytes'] = parse_size(match.group(1))
+            stats[handle]['backlog_packets'] = int(match.group(2))
+
+    return stats
+
+
+def read_netdev(dev: str, netns: str = None) -> dict:
+    if netns is not None:
+        output = subprocess.run(['ip', 'netns', 'exec', netns, 'cat', '/proc/net/dev'],
+                                capture_output=True, text=True).stdout
+    else:
+        with open('/proc/net/dev', mode='r') as f:
+            output = f.read()
+
+    for line in output.split('\n'):
+        if ':' not in line or line.split(':')[0].strip() != dev:
+            continue
+
+        fields = [int(x) for x in line.split(':')[1].split()]
+        return {
+            'rx_bytes': fields[0],
+            'rx_packets': fields[1],
+            'rx_dropped': fields[3],
+            'tx_bytes': fields[8],
+            'tx_packets': fields[9],
+            'tx_dropped': fields[11],
+        }
+
+    return {}
+
+
+def read_counters(dev: str = DEVICE, netns: str = None) -> dict:
+    def show(kind: str) -> str:
+        return subprocess.run(['tc'] + ns_args(netns) + ['-s', kind, 'show', 'dev', dev],
+                              capture_output=True, text=True).stdout
+
+    return {
+        'qdisc': parse_stats(show('qdisc')),
+        'class': parse_stats(show('class')),
+        'netdev': read_netdev(dev, netns),
+    }
+
+
+def counter_deltas(before: dict, after: dict) -> dict:
+    def delta(kind: str, handle: str, key: str) -> int:
+        return after[kind].get(handle, {}).get(key, 0) - before[kind].get(handle, {}).get(key, 0)
+
+    return {
+        'netem_packets': delta('qdisc', NETEM_HANDLE, 'packets'),
+        'netem_dropped': delta('qdisc', NETEM_HANDLE, 'dropped'),
+        'shaped_bytes': delta('class', SHAPED_CLASS, 'bytes'),
+        'shaped_packets': delta('class', SHAPED_CLASS, 'packets'),
+        'htb_dropped': delta('class', SHAPED_CLASS, 'dropped'),
+        'htb_overlimits': delta('class', SHAPED_CLASS, 'overlimits'),
+        'dev_rx_dropped': after['netdev'].get('rx_dropped', 0) - before['netdev'].get('rx_dropped', 0),
+        'dev_tx_dropped': after['netdev'].get('tx_dropped', 0) - before['netdev'].get('tx_dropped', 0),
+    }
+
+
+class CounterMonitor:
+    """
+    Snapshots qdisc, class and interface counters of both shaped devices
+    around an iteration, sampling the shaped backlog in between.
+    """
+
+    def __init__(self, dev: str = DEVICE, ifb: str = IFB, netns: str = None):
+        self.devices = {'egress': dev, 'ingress': ifb}
+        self.netns = netns
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.stopped.clear()
+        self.backlog = {side: 0 for side in self.devices}
+        self.before = {side: read_counters(dev, self.netns)
+                       for side, dev in self.devices.items()}
+
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        while not self.stopped.wait(BACKLOG_INTERVAL):
+            for side, dev in self.devices.items():
+                output = subprocess.run(['tc'] + ns_args(self.netns) + ['-s', 'class', 'show', 'dev', dev],
+                                        capture_output=True, text=True).stdout
+                backlog = parse_stats(output).get(SHAPED_CLASS, {}).get('backlog_bytes', 0)
+                self.backlog[side] = max(self.backlog[side], backlog)
+
+    def stop(self) -> dict:
+        self.stopped.set()
+        self.thread.join()
+
+        deltas = {}
+        for side, dev in self.devices.items():
+            after = read_counters(dev, self.netns)
+            deltas[side] = counter_deltas(self.before[side], after)
+            deltas[side]['backlog_max_bytes'] = self.backlog[side]
+
+        return deltas
+
+
+def current_profile(dev: str = DEVICE, ifb: str = IFB, netns: str = None) -> dict:
+    """The declared profile last applied by `apply`, plus what tc reports now"""
+    declared = None
+    if state_path(dev, netns).exists():
+        with open(state_path(dev, netns), mode='r') as f:
+            declared = json.load(f)
+
+    observed = read_profile(dev, ifb, netns)
+    for side in observed.values():
+        side.pop('qdisc')
+        side.pop('class')
+
+    return {
+        'device': dev,
+        'ifb': ifb,
+        'netns': netns,
+        'declared': declared,
+        'observed': observed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['apply', 'show', 'teardown'])
+    parser.add_argument('name', nargs='?',
+                        help='Profile name in the network/*.sh format, e.g. loss-1_delay-50_bw-10 or loss-0_delay-50_bw-10_qdisc-fq_codel_buf-0dot5')
+    parser.add_argument('--dev', default=DEVICE)
+    parser.add_argument('--ifb', default=IFB)
+    parser.add_argument('--netns')
+    parser.add_argument('--rate', type=float, help='kbit')
+    parser.add_argument('--delay', type=float, default=0, help='ms')
+    parser.add_argument('--jitter', type=float, default=0, help='ms')
+    parser.add_argument('--loss', type=float, default=0, help='percent')
+    parser.add_argument('--loss-model', default='random',
+                        choices=['random', 'state', 'gemodel'])
+    parser.add_argument('--burst-exit', type=float, default=75, help='percent')
+    parser.add_argument('--direction', default='both',
+                        choices=['both', 'egress', 'ingress'])
+    parser.add_argument('--delay-direction', default='egress',
+                        choices=['both', 'egress', 'ingress'])
+    parser.add_argument('--limit', type=int, help='packets')
+    parser.add_argument('--qdisc', choices=QDISCS,
+                        help='Queue discipline holding the bottleneck queue')
+    parser.add_argument('--buffer-bdp', type=float,
+                        help='Bottleneck buffer in bandwidth-delay products')
+    parser.add_argument('--dry-run', dest='dry_run',
+                        action='store_true', default=False)
+
+    args = parser.parse_args()
+
+    if args.action == 'teardown':
+        teardown(args.dev, args.ifb, args.netns)
+        return
+
+    if args.action == 'show':
+        print(json.dumps(current_profile(args.dev, args.ifb, args.netns), indent=4))
+        return
+
+    if args.name is not None:
+        profile = profile_from_name(args.name)
+    elif args.rate is not None:
+        profile = build_profile(
+            rate=args.rate,
+            delay=args.delay,
+            jitter=args.jitter,
+            loss=args.loss,
+            loss_model=args.loss_model,
+            burst_exit=args.burst_exit,
+            direction=args.direction,
+            delay_direction=args.delay_direction,
+            limit=args.limit,
+            qdisc=args.qdisc,
+            buffer_bdp=args.buffer_bdp)
+    else:
+        raise Exception('either a profile name or --rate is required')
+
+    if args.dry_run:
+        print(script(profile, args.dev, args.ifb))
+        return
+
+    apply(profile, args.dev, args.ifb, args.netns)
+    print(json.dumps(profile, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from origins import OriginFleet, origins_for
+from calibration import Reflector
+import netem
+
+CONFIG = {}
+with open(Path.joinpath(Path(__file__).parent.absolute(), 'config.json'), mode='r') as f:
+    CONFIG = json.load(f)
+
+LOCAL = CONFIG['local']['value']
+DOMAINS = CONFIG['domains']['value']
+
+# Scenario i lives in namespace qb<i> on subnet 10.200.<i>.0/24
+SUBNET = '10.200.{}.0/24'
+HOST_ADDR = '10.200.{}.1'
+NS_ADDR = '10.200.{}.2'
+
+
+def names(index: int) -> dict:
+    # Interface names are limited to 15 characters
+    return {
+        'netns': 'qb{}'.format(index),
+        'host': 'qb{}h'.format(index),
+        'device': 'qb{}n'.format(index),
+        'ifb': 'qb{}ifb'.format(index),
+    }
+
+
+def run(command: list):
+    subprocess.run(command, check=True, capture_output=True)
+
+
+def create(index: int, profile: dict = None, egress: bool = True) -> dict:
+    """
+    Create a namespace joined to the host by a veth pair, shape the
+    namespace side of the pair with `profile` and, with `egress`, NAT its
+    traffic out of the host.
+    """
+    scenario = names(index)
+    netns = scenario['netns']
+
+    destroy(index)
+
+    run(['ip', 'netns', 'add', netns])
+    run(['ip', 'link', 'add', scenario['host'], 'type',
+         'veth', 'peer', 'name', scenario['device']])
+    run(['ip', 'link', 'set', scenario['device'], 'netns', netns])
+
+    run(['ip', 'addr', 'add', '{}/24'.format(HOST_ADDR.format(index)),
+         'dev', scenario['host']])
+    run(['ip', 'link', 'set', scenario['host'], 'up'])
+
+    run(['ip', '-n', netns, 'addr', 'add', '{}/24'.format(NS_ADDR.format(index)),
+         'dev', scenario['device']])
+    run(['ip', '-n', netns, 'link', 'set', scenario['device'], 'up'])
+    run(['ip', '-n', netns, 'link', 'set', 'lo', 'up'])
+    run(['ip', '-n', netns, 'route', 'add', 'default',
+         'via', HOST_ADDR.format(index)])
+
+    if egress:
+        run(['sysctl', '-w', 'net.ipv4.ip_forward=1'])
+        run(['iptables', '-t', 'nat', '-A', 'POSTROUTING', '-s', SUBNET.format(index),
+             '!', '-o', scenario['host'], '-j', 'MASQUERADE'])
+
+    if profile is not None:
+        netem.apply(profile, scenario['device'], scenario['ifb'], netns)
+
+    return scenario
+
+
+def destroy(index: int):
+    scenario = names(index)
+
+    # Every step may fail if the scenario was never (fully) created
+    subprocess.run(['iptables', '-t', 'nat', '-D', 'POSTROUTING', '-s', SUBNET.format(index),
+                    '!', '-o', scenario['host'], '-j', 'MASQUERADE'], capture_output=True)
+    if Path('/var/run/netns', scenario['netns']).exists():
+        netem.teardown(scenario['device'], scenario['ifb'], scenario['netns'])
+    subprocess.run(['ip', 'link', 'delete', scenario['host']],
+                   capture_output=True)
+    subprocess.run(['ip', 'netns', 'delete', scenario['netns']],
+                   capture_output=True)
+
+
+def spawn(index: int, network: str, log: bool) -> subprocess.Popen:
+    scenario = names(index)
+
+    env = os.environ.copy()
+    env['BENCHMARK_NETNS'] = scenario['netns']
+    env['BENCHMARK_DEVICE'] = scenario['device']
+    env['BENCHMARK_IFB'] = scenario['ifb']
+
+    command = [
+        'ip', 'netns', 'exec', scenario['netns'],
+        sys.executable, str(Path.joinpath(Path(__file__).parent.absolute(), 'client.py')),
+        '--dir', network,
+        # Origins on the host are reached through the shaped veth pair
+        '--origin-host', HOST_ADDR.format(index),
+    ]
+
+    if log:
+        command.append('--log')
+
+    return subprocess.Popen(command, env=env)
+
+
+def run_parallel(networks: list, jobs: int, log: bool, egress: bool = True) -> dict:
+    """Run one client.py campaign per network profile, `jobs` at a time"""
+    pending = list(enumerate(networks))
+    running = {}
+    results = {}
+
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < jobs:
+                index, network = pending.pop(0)
+                print('Starting {} in {}'.format(network, names(index)['netns']))
+                create(index, netem.profile_from_name(network), egress)
+                running[index] = (network, spawn(index, network, log))
+
+            for index, (network, process) in list(running.items()):
+                if process.poll() is None:
+                    continue
+
+                print('Finished {} with exit code {}'.format(
+                    network, process.returncode))
+                results[network] = process.returncode
+                destroy(index)
+                running.pop(index)
+
+            time.sleep(1)
+    finally:
+        for index, (_, process) in running.items():
+            process.kill()
+            destroy(index)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('networks', nargs='+',
+                        help='Profile names in the network/*.sh format')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--log', dest='log',
+                        action='store_true', default=False)
+    parser.add_argument('--no-egress', dest='egress',
+                        action='store_false', default=True,
+                        help='Only reach local origins, do not NAT scenarios out of the host')
+
+    args = parser.parse_args()
+
+    if not LOCAL:
+        raise Exception('parallel scenarios require locally built clients')
+
+    # Start local origins and the calibration reflector once for every scenario
+    fleet = OriginFleet()
+    origin_names = origins_for(DOMAINS)
+    reflector = Reflector()
+
+    try:
+        # Scenarios verify the origins' certificate at their host address
+        fleet.start(origin_names, [HOST_ADDR.format(i) for i in range(len(args.networks))])
+        reflector.start()
+        results = run_parallel(
+            args.networks, min(args.jobs, len(args.networks)), args.log, args.egress)
+    finally:
+        reflector.stop()
+        fleet.stop(origin_names)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import docker
+import json
+import os
+import socket
+import subprocess
+import time
+
+from pathlib import Path
+from urllib.parse import urlparse
+from docker_pool import get_client, ensure_image
+
+ORIGINS = {}
+with open(Path.joinpath(Path(__file__).parent.absolute(), 'origins.json'), mode='r') as f:
+    ORIGINS = json.load(f)
+
+ENDPOINTS = {}
+with open(Path.joinpath(Path(__file__).parent.absolute(), 'endpoints.json'), mode='r') as f:
+    ENDPOINTS = json.load(f)
+
+CONFIG = {}
+with open(Path.joinpath(Path(__file__).parent.absolute(), 'config.json'), mode='r') as f:
+    CONFIG = json.load(f)
+
+ORIGINS_DIR = Path.joinpath(
+    Path(__file__).parent.absolute(), CONFIG['data_path']['value'], 'origins')
+
+# Seconds to wait for an origin to pass its health check
+HEALTH_TIMEOUT = 30
+
+
+def origins_for(domains: list) -> list:
+    return [name for name, origin in ORIGINS.items() if origin['domain'] in domains]
+
+
+def generate_certs(certdir: str, addresses: list = ()):
+    """
+    Self-signed leaf certificate for localhost, valid for 127.0.0.1 and any
+    other `addresses` the origins are reached at
+    """
+    certdir = Path(certdir)
+    certdir.mkdir(parents=True, exist_ok=True)
+
+    cert = Path.joinpath(certdir, 'leaf_cert.pem')
+    key = Path.joinpath(certdir, 'leaf_cert.key')
+    sanpath = Path.joinpath(certdir, 'leaf_cert.san')
+
+    san = ','.join(['DNS:localhost', 'IP:127.0.0.1'] +
+                   ['IP:{}'.format(x) for x in addresses])
+
+    if cert.exists() and key.exists() and sanpath.exists() and sanpath.read_text() == san:
+        return
+
+    subprocess.run([
+        'openssl',
+        'req',
+        '-x509',
+        '-newkey',
+        'rsa:2048',
+        '-nodes',
+        '-days',
+        '365',
+        '-subj',
+        '/CN=localhost',
+        '-addext',
+        'subjectAltName={}'.format(san),
+        '-keyout',
+        key,
+        '-out',
+        cert
+    ], check=True, capture_output=True)
+
+    sanpath.write_text(san)
+
+
+def generate_objects(wwwdir: str, domain: str):
+    # Endpoint paths of local origins are object sizes in bytes, e.g. /1048576
+    wwwdir = Path(wwwdir)
+    wwwdir.mkdir(parents=True, exist_ok=True)
+
+    for url in ENDPOINTS.get(domain, {}).values():
+        if isinstance(url, dict):
+            url = url['url']
+
+        name = urlparse(url).path.strip('/')
+        if not name.isdigit():
+            continue
+
+        size = int(name)
+        filepath = Path.joinpath(wwwdir, name)
+        if filepath.exists() and filepath.stat().st_size == size:
+            continue
+
+        with open(filepath, mode='wb') as f:
+            remaining = size
+            while remaining > 0:
+                chunk = min(remaining, 1024 * 1024)
+                f.write(os.urandom(chunk))
+                remaining -= chunk
+
+
+class OriginFleet:
+    """
+    Local origin servers run in docker on the host network, so every client
+    reaches them on 127.0.0.1 exactly like a remote endpoint.
+    """
+
+    def __init__(self, basedir: str = ORIGINS_DIR):
+        self.basedir = Path(basedir)
+        self.certdir = Path.joinpath(self.basedir, 'certs')
+        self.wwwdir = Path.joinpath(self.basedir, 'www')
+        self.logdir = Path.joinpath(self.basedir, 'logs')
+        self.pinned = {}
+
+    def pin(self, pinned: dict):
+        self.pinned.update(pinned)
+
+    def start(self, names: list, addresses: list = ()):
+        # Scenarios reaching shared origins must not regenerate their certificate
+        if len(names) == 0:
+            return
+
+        generate_certs(self.certdir, addresses)
+
+        for name in names:
+            origin = ORIGINS[name]
+            generate_objects(self.wwwdir, origin['domain'])
+
+            logdir = Path.joinpath(self.logdir, name)
+            logdir.mkdir(parents=True, exist_ok=True)
+
+            image = self.pinned.get(origin['image'], origin['image'])
+            ensure_image(image)
+
+            # Replace anything left behind by an earlier run
+            self.stop([name])
+
+            commands = [x.replace('{port}', str(origin['port']))
+                        for x in origin['commands']]
+
+            get_client().containers.run(
+                image,
+                name=container_name(name),
+                detach=True,
+                network_mode='host',
+                entrypoint=origin['entrypoint'],
+                environment=origin.get('environment', {}),
+                volumes={
+                    str(self.certdir): {'bind': '/certs', 'mode': 'ro'},
+                    str(self.wwwdir): {'bind': '/www', 'mode': 'ro'},
+                    str(logdir): {'bind': '/logs', 'mode': 'rw'},
+                },
+                command=commands
+            )
+
+            self.wait_healthy(name)
+            print('Origin {} serving {} on port {}'.format(
+                name, origin['domain'], origin['port']))
+
+    def healthy(self, name: str) -> bool:
+        origin = ORIGINS[name]
+
+        try:
+            container = get_client().containers.get(container_name(name))
+        except docker.errors.NotFound:
+            return False
+
+        if container.status != 'running':
+            return False
+
+        # QUIC-only origins have no TCP listener to probe
+        if origin.get('health') != 'tcp':
+            return True
+
+        try:
+            with socket.create_connection(('127.0.0.1', origin['port']), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def wait_healthy(self, name: str):
+        deadline = time.time() + HEALTH_TIMEOUT
+
+        while time.time() < deadline:
+            if self.healthy(name):
+                return
+            time.sleep(0.5)
+
+        raise Exception('origin {} failed health check'.format(name))
+
+    def stop(self, names: list = None):
+        for name in names if names is not None else list(ORIGINS.keys()):
+            try:
+                get_client().containers.get(
+                    container_name(name)).remove(force=True)
+            except docker.errors.NotFound:
+                pass
+
+
+def container_name(name: str) -> str:
+    return 'origin-{}'.format(name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['start', 'stop', 'status'])
+    parser.add_argument('--origins', nargs='*',
+                        default=list(ORIGINS.keys()))
+
+    args = parser.parse_args()
+
+    fleet = OriginFleet()
+
+    if args.action == 'start':
+        fleet.start(args.origins)
+    elif args.action == 'stop':
+        fleet.stop(args.origins)
+    else:
+        for name in args.origins:
+            print(name, 'healthy' if fleet.healthy(name) else 'down')
+
+
+if __name__ == "__main__":
+    main()
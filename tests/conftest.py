@@ -0,0 +1,23 @@
+import importlib.util
+import os
+import sys
+
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.absolute()
+ANALYSIS = Path.joinpath(ROOT, 'analysis')
+
+# Parse everything from scratch, never from a user's cache
+os.environ['ANALYSIS_CACHE'] = '0'
+
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ANALYSIS))
+
+
+def load_script(name: str):
+    """An analysis script, whose dashed file name cannot be imported"""
+    path = Path.joinpath(ANALYSIS, '{}.py'.format(name))
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
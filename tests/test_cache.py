@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+
+import cache
+
+
+def test_cache_key_covers_input_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_ENABLED', True)
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+
+    calls = []
+
+    @cache.cached('test', 1, files=['keylog'])
+    def parse(filename, keylog, port=443):
+        calls.append(filename)
+        with open(keylog) as f:
+            return {'secrets': np.array([len(f.read().splitlines())])}
+
+    capture = tmp_path / 'a.pcap'
+    capture.write_bytes(b'capture')
+    keylog = tmp_path / 'keys.log'
+    keylog.write_text('SECRET 1\n')
+
+    assert parse(str(capture), str(keylog))['secrets'].tolist() == [1]
+    assert parse(str(capture), str(keylog))['secrets'].tolist() == [1]
+    assert len(calls) == 1
+
+    # Secrets appended after the first run invalidate the entry
+    with open(keylog, mode='a') as f:
+        f.write('SECRET 2\n')
+    os.utime(keylog, ns=(0, os.stat(keylog).st_mtime_ns + 1000))
+
+    assert parse(str(capture), keylog=str(keylog))['secrets'].tolist() == [2]
+    assert len(calls) == 2
+
+
+def test_eviction_scans_only_past_the_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_ENABLED', True)
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(cache, '_SIZE', None)
+
+    scans = []
+    entries = cache.entries
+    monkeypatch.setattr(cache, 'entries', lambda: scans.append(1) or entries())
+
+    @cache.cached('test', 1)
+    def parse(filename):
+        return {'values': np.random.default_rng(0).random(64 * 1024)}
+
+    for i in range(4):
+        path = tmp_path / '{}.bin'.format(i)
+        path.write_bytes(b'')
+        parse(str(path))
+
+    # One scan to learn the size, none while under the cap
+    assert len(scans) == 1
+
+    # Each entry is about 0.5 MB, so a 1 MB cap evicts down to two
+    monkeypatch.setattr(cache, 'CACHE_SIZE', 1)
+    path = tmp_path / 'last.bin'
+    path.write_bytes(b'')
+    parse(str(path))
+
+    assert len(scans) == 2
+    assert len(list((tmp_path / 'cache').glob('*.npz'))) <= 2
+    assert cache._SIZE <= 1024 * 1024
@@ -0,0 +1,88 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import calibration
+import netem
+
+
+def test_expected_loss_of_state_model():
+    profile = netem.build_profile(rate=10000, loss=1, loss_model='state', burst_exit=75, direction='egress')
+    want = calibration.expected(profile)
+
+    assert want['loss'] == pytest.approx(1 / (1 + 75) * 100)
+    assert want['burst_length'] == pytest.approx(100 / 75)
+
+
+def test_expected_loss_of_random_model():
+    profile = netem.build_profile(rate=10000, loss=1, direction='both')
+    assert calibration.expected(profile)['loss'] == pytest.approx((1 - 0.99 * 0.99) * 100)
+
+
+def serve(server_side):
+    errors = []
+
+    def handle():
+        try:
+            calibration.TCPReflector(server_side, ('127.0.0.1', 0), None)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=handle)
+    thread.start()
+    return thread, errors
+
+
+def test_tcp_reflector_reads_a_split_header():
+    client, server_side = socket.socketpair()
+    thread, errors = serve(server_side)
+
+    command = b'D' + struct.pack('!d', 0.0)
+    client.sendall(command[:4])
+    time.sleep(0.1)
+    client.sendall(command[4:])
+    thread.join(timeout=5)
+
+    assert not thread.is_alive() and errors == []
+    client.close()
+
+
+def test_tcp_reflector_counts_upload():
+    client, server_side = socket.socketpair()
+    thread, errors = serve(server_side)
+
+    client.sendall(b'U' + b'\0' * 3)
+    time.sleep(0.1)
+    client.sendall(b'\0' * 1000)
+    client.shutdown(socket.SHUT_WR)
+
+    assert struct.unpack('!Q', calibration.recv_exactly(client, 8))[0] == 1003
+    thread.join(timeout=5)
+    assert errors == []
+    client.close()
+
+
+def test_check_allows_the_default_burst():
+    profile = netem.build_profile(rate=10000, direction='egress')
+    # A full 12500KB bucket passes unshaped ahead of the 10 Mbit rate
+    tcp = (10000 * calibration.TCP_SECONDS + 12500 * 1024 * 8 / 1000) / calibration.TCP_SECONDS
+    measured = {
+        'udp': {
+            'rtt': {'min': 1, 'median': 1},
+            'count': calibration.PROBE_COUNT,
+            'loss': 0,
+            'loss_events': 0,
+            'burst_length': 0,
+            'rate': 10000 * calibration.FLOOD_FACTOR,
+        },
+        'tcp': {'down': tcp, 'up': tcp},
+    }
+
+    checks = calibration.check(measured, profile)
+    assert all([x['ok'] for x in checks.values()])
+
+    measured['tcp']['down'] = tcp * 1.5
+    assert not calibration.check(measured, profile)['tcp_down']['ok']
@@ -0,0 +1,25 @@
+import client
+from test_qlog import write_qlog, packet, stream
+
+
+def test_process_qlog_without_received_packets(tmp_path):
+    qlog = write_qlog(tmp_path / 'sent.qlog', [
+        packet(0, 'packet_sent', 'initial', 0, [{'frame_type': 'crypto', 'offset': '0', 'length': '300'}]),
+        packet(300, 'packet_sent', 'initial', 1, [{'frame_type': 'crypto', 'offset': '0', 'length': '300'}]),
+    ])
+
+    res = client.process_qlog(qlog)
+    assert res['time'] == 0 and res['init_cwnd_mss'] == 0
+
+
+def test_process_qlog(tmp_path):
+    qlog = write_qlog(tmp_path / 'run.qlog', [
+        packet(0, 'packet_sent', 'initial', 0, [{'frame_type': 'crypto', 'offset': '0', 'length': '300'}]),
+        packet(50, 'packet_received', '1RTT', 0, [stream(0, 1200)]),
+        packet(80, 'packet_received', '1RTT', 1, [stream(1200, 1200)]),
+        packet(200, 'packet_received', '1RTT', 2, [stream(2400, 1200)]),
+    ])
+
+    res = client.process_qlog(qlog)
+    assert res['time'] == 0.2
+    assert res['init_cwnd_mss'] == 2 and res['init_cwnd_bytes'] == 2400
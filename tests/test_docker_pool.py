@@ -0,0 +1,58 @@
+import gzip
+
+import pytest
+
+import docker_pool
+
+
+class FakeAPI:
+    def __init__(self, output: list, exit_code: int):
+        self.output = output
+        self.exit_code = exit_code
+        self.commands = []
+
+    def exec_create(self, container, cmd):
+        self.commands.append((container, cmd))
+        return {'Id': 'exec'}
+
+    def exec_start(self, exec_id, stream):
+        return iter(self.output)
+
+    def exec_inspect(self, exec_id):
+        return {'ExitCode': self.exit_code}
+
+
+class FakeClient:
+    def __init__(self, api):
+        self.api = api
+
+
+class FakeContainer:
+    id = 'container'
+
+
+def pool(monkeypatch, api) -> docker_pool.ContainerPool:
+    monkeypatch.setattr(docker_pool, 'get_client', lambda: FakeClient(api))
+    pool = docker_pool.ContainerPool('/tmp/qlog')
+    monkeypatch.setattr(pool, 'acquire', lambda docker_config: {
+        'container': FakeContainer(), 'entrypoint': ['client'], 'iterations': 0})
+    return pool
+
+
+def test_run_returns_timings(tmp_path, monkeypatch):
+    api = FakeAPI([b'noise\ntime_total:1.5\n', b'time_namelookup:0.25\n'], 0)
+    logpath = tmp_path / 'out.log.gz'
+
+    timings = pool(monkeypatch, api).run({'image': 'curl'}, ['--url'], logpath)
+
+    assert timings == {'time_total': 1.5, 'time_namelookup': 0.25}
+    assert api.commands == [('container', ['client', '--url'])]
+    with gzip.open(logpath) as f:
+        assert f.read().startswith(b'noise')
+
+
+def test_run_raises_on_failed_client(tmp_path, monkeypatch):
+    api = FakeAPI([b'Segmentation fault\n'], 139)
+
+    with pytest.raises(Exception, match='exited with code 139'):
+        pool(monkeypatch, api).run({'image': 'curl'}, [], tmp_path / 'out.log.gz')
@@ -0,0 +1,29 @@
+from conftest import load_script
+
+COUNTERS = {
+    'egress': {'netem_dropped': 2, 'htb_dropped': 1, 'dev_rx_dropped': 0, 'dev_tx_dropped': 0},
+    'ingress': {'netem_dropped': 1, 'htb_dropped': 0, 'dev_rx_dropped': 0, 'dev_tx_dropped': 0},
+}
+
+
+def reconcile(name: str):
+    loss_analysis = load_script('loss-analysis')
+    counters = {('loss-1_delay-0_bw-10/example.org/1MB', 'quic_h3', 3): COUNTERS}
+    filename = '/data/qlogs/loss-1_delay-0_bw-10/example.org/1MB/quic_h3/{}'.format(name)
+    return loss_analysis.reconcile(filename, '/data/qlogs', counters, [0] * 7)
+
+
+def test_reconcile_plain_iteration():
+    row = reconcile('quic_h3_3.qlog')
+    assert (row['observed'], row['injected_egress'], row['injected_ingress'], row['host'], row['path']) == \
+        (7, 2, 1, 1, 3)
+
+
+def test_reconcile_compressed_iteration():
+    assert reconcile('quic_h3_3.qlog.gz') == {**reconcile('quic_h3_3.qlog'),
+                                              'file': reconcile('quic_h3_3.qlog.gz')['file']}
+    assert reconcile('quic_h3_3.json.xz') is not None
+
+
+def test_reconcile_skips_files_without_iteration():
+    assert reconcile('quic_h3.qlog.gz') is None
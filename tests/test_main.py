@@ -0,0 +1,20 @@
+import math
+
+from conftest import load_script
+
+
+def test_buffer_sweeps_default_qdisc():
+    main = load_script('main')
+    sweeps = main.buffer_sweeps([
+        'loss-0_delay-50_bw-10',
+        'loss-0_delay-50_bw-10_buf-0dot5',
+        'loss-0_delay-50_bw-10_buf-2',
+        'loss-0_delay-50_bw-10_qdisc-fq_codel',
+        'loss-0_delay-50_bw-10_qdisc-fq_codel_buf-1',
+    ])
+
+    assert sorted(sweeps[('loss-0_delay-50_bw-10', 'pfifo')]) == [
+        (0.5, 'loss-0_delay-50_bw-10_buf-0dot5'), (2.0, 'loss-0_delay-50_bw-10_buf-2')]
+    assert sorted(sweeps[('loss-0_delay-50_bw-10', 'fq_codel')]) == [
+        (1.0, 'loss-0_delay-50_bw-10_qdisc-fq_codel_buf-1'), (math.inf, 'loss-0_delay-50_bw-10_qdisc-fq_codel')]
+    assert len(sweeps) == 2
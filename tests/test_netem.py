@@ -0,0 +1,40 @@
+from pathlib import Path
+
+import pytest
+
+import netem
+from conftest import ROOT
+
+
+def tc_lines(text: str) -> list:
+    return [x.strip() for x in text.split('\n') if x.startswith('/sbin/tc') and ' add ' in x]
+
+
+@pytest.mark.parametrize('path', sorted(Path.joinpath(ROOT, 'network').glob('loss-*.sh')),
+                         ids=lambda x: x.stem)
+def test_profile_matches_script(path):
+    if path.stem.endswith('_local'):
+        pytest.skip('shapes lo')
+
+    generated = tc_lines(netem.script(netem.profile_from_name(path.stem), 'ens192', 'ifb6756'))
+    expected = tc_lines(path.read_text())
+
+    # Known differences: the rate of the ifb's default class, which the
+    # filter sends no IP traffic to, and how a jitter of 30ms is printed
+    if path.stem == 'loss-0_delay-0_bw-100':
+        expected = [x.replace('1a64:1 htb rate 10000000.0kbit', '1a64:1 htb rate 32000000.0kbit')
+                    if 'ifb6756' in x else x for x in expected]
+    expected = [x.replace(' 30ms', ' 30.0ms') for x in expected]
+
+    assert generated == expected
+
+
+@pytest.mark.parametrize('name', ['loss-0_delay-0_bw-100_local', 'loss-0_delay-0_bw-100_foo'])
+def test_unknown_suffix_is_rejected(name):
+    with pytest.raises(Exception):
+        netem.profile_from_name(name)
+
+
+def test_buffer_sweep_name():
+    profile = netem.profile_from_name('loss-0_delay-50_bw-10_qdisc-fq_codel_buf-0dot5')
+    assert profile['qdisc'] == 'fq_codel' and profile['buffer_bdp'] == 0.5
@@ -0,0 +1,31 @@
+import json
+
+from netlog import NetlogIndex, netlog_files, split_constants, CONSTANTS_DIR
+
+CONSTANTS = {
+    'clientInfo': {'name': 'test'},
+    'logEventPhase': {'PHASE_BEGIN': 1, 'PHASE_END': 2, 'PHASE_NONE': 0},
+    'logEventTypes': {'QUIC_SESSION': 10, 'QUIC_SESSION_PACKET_RECEIVED': 11},
+    'logSourceType': {'QUIC_SESSION': 1},
+}
+
+
+def write_netlog(path):
+    events = [
+        {'params': {'host': 'example.org'}, 'phase': 1, 'source': {'id': 1, 'type': 1}, 'time': '1000', 'type': 10},
+        {'phase': 0, 'source': {'id': 1, 'type': 1}, 'time': '1005', 'type': 11},
+    ]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text('{{"constants":{},\n"events": [\n{}\n]}}\n'.format(
+        json.dumps(CONSTANTS), ',\n'.join([json.dumps(x) for x in events])))
+    return str(path)
+
+
+def test_netlog_files_skip_stored_constants(tmp_path):
+    netlogs = [write_netlog(tmp_path / 'scenario' / 'chrome_h3' / 'netlog_{}.json'.format(i)) for i in range(2)]
+    for filename in netlogs:
+        split_constants(filename, str(tmp_path))
+
+    assert len(list((tmp_path / CONSTANTS_DIR).glob('*.json'))) == 1
+    assert netlog_files(str(tmp_path)) == sorted(netlogs)
+    assert len(NetlogIndex(netlogs[0]).events['offset']) == 2
@@ -0,0 +1,16 @@
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_netns_does_not_import_client():
+    # A fresh interpreter, so modules other tests imported do not count
+    out = subprocess.run([sys.executable, '-c', 'import sys, netns; print("client" in sys.modules)'],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == 'False'
+
+
+def test_names_fit_interface_limit():
+    import netns
+    assert all([len(x) <= 15 for x in netns.names(255).values()])
@@ -0,0 +1,20 @@
+import subprocess
+
+import origins
+
+
+def san(cert):
+    out = subprocess.run(['openssl', 'x509', '-noout', '-ext', 'subjectAltName', '-in', str(cert)],
+                         capture_output=True, text=True, check=True)
+    return out.stdout
+
+
+def test_certificate_covers_scenario_addresses(tmp_path):
+    origins.generate_certs(tmp_path)
+    assert '10.200.0.1' not in san(tmp_path / 'leaf_cert.pem')
+
+    # A certificate without the addresses is regenerated
+    origins.generate_certs(tmp_path, ['10.200.0.1', '10.200.1.1'])
+    names = san(tmp_path / 'leaf_cert.pem')
+    assert 'IP Address:127.0.0.1' in names
+    assert 'IP Address:10.200.0.1' in names and 'IP Address:10.200.1.1' in names
@@ -0,0 +1,112 @@
+import struct
+
+import numpy as np
+
+from pcap import read_capture, MISSING
+
+CLIENT = bytes([10, 0, 0, 1])
+SERVER = bytes([10, 0, 0, 2])
+
+# NOP and a window scale of 7 from the client, 2 from the server
+CLIENT_WSCALE = bytes([1, 3, 3, 7])
+SERVER_WSCALE = bytes([1, 3, 3, 2])
+# NOP, NOP and one SACK block
+SACK = bytes([1, 1, 5, 10]) + struct.pack('!II', 5201, 5301)
+
+
+def ethernet(payload: bytes, src: bytes, dst: bytes, protocol: int = 6) -> bytes:
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 0, 0, 64, protocol, 0, src, dst)
+    return b'\0' * 12 + struct.pack('!H', 0x0800) + ip + payload
+
+
+def tcp(sport: int, dport: int, seq: int, ack: int, flags: int, window: int,
+        options: bytes = b'', length: int = 0) -> bytes:
+    header = struct.pack('!HHIIBBHHH', sport, dport, seq, ack, (20 + len(options)) // 4 << 4,
+                         flags, window, 0, 0)
+    src, dst = (CLIENT, SERVER) if dport == 443 else (SERVER, CLIENT)
+    return ethernet(header + options + b'x' * length, src, dst)
+
+
+def udp() -> bytes:
+    return ethernet(struct.pack('!HHHH', 5000, 53, 8, 0), CLIENT, SERVER, protocol=17)
+
+
+# Frame 1 is not TCP, so frame numbers differ from segment positions
+FRAMES = [
+    udp(),
+    tcp(5000, 443, 1000, 0, 0x02, 64240, CLIENT_WSCALE),
+    tcp(443, 5000, 5000, 1001, 0x12, 65160, SERVER_WSCALE),
+    tcp(5000, 443, 1001, 5001, 0x10, 100),
+    tcp(443, 5000, 5001, 1001, 0x10, 50, length=100),
+    tcp(5000, 443, 1001, 5101, 0x10, 100, SACK),
+]
+
+
+def pcap(frames: list) -> bytes:
+    out = struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1)
+    for i, frame in enumerate(frames):
+        out += struct.pack('<IIII', 1, i * 1000, len(frame), len(frame)) + frame
+    return out
+
+
+def block(block_type: int, body: bytes) -> bytes:
+    body += b'\0' * (-len(body) % 4)
+    return struct.pack('<II', block_type, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+
+def pcapng(frames: list) -> bytes:
+    out = block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+    out += block(1, struct.pack('<HHI', 1, 0, 65535))
+    for i, frame in enumerate(frames):
+        ts = 1000000 + i * 1000
+        out += block(6, struct.pack('<IIIII', 0, ts >> 32, ts & 0xFFFFFFFF, len(frame), len(frame)) + frame)
+    return out
+
+
+def write(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+def check_handshake(packets: dict):
+    assert packets['srcport'].tolist() == [5000, 443, 5000, 443, 5000]
+    assert packets['seq'].tolist() == [0, 0, 1, 1, 1]
+    assert packets['ack'].tolist() == [0, 1, 1, 1, 101]
+    assert np.allclose(packets['time'], [0, 0.001, 0.002, 0.003, 0.004])
+
+    # Frames are numbered by their position in the capture, like tshark
+    assert packets['acks_frame'].tolist() == [MISSING, 2, 3, MISSING, 5]
+
+    # Windows of SYNs are not scaled
+    assert packets['window_size'].tolist() == [64240, 65160, 100 << 7, 50 << 2, 100 << 7]
+
+    # SACK edges are relative to the server's sequence numbers
+    assert packets['sack_le'].tolist() == [201]
+    assert packets['sack_re'].tolist() == [301]
+    assert packets['sack_le_index'].tolist() == [0, 0, 0, 0, 0, 1]
+
+
+def test_pcap(tmp_path):
+    check_handshake(read_capture(write(tmp_path / 'x.pcap', pcap(FRAMES))))
+
+
+def test_pcapng(tmp_path):
+    check_handshake(read_capture(write(tmp_path / 'x.pcapng', pcapng(FRAMES))))
+
+
+def test_empty_capture(tmp_path):
+    packets = read_capture(write(tmp_path / 'x.pcap', b''))
+    assert len(packets['time']) == 0
+    assert packets['sack_le_index'].tolist() == [0]
+
+
+def test_truncated_capture(tmp_path):
+    # The last record is cut off mid-packet and dropped
+    packets = read_capture(write(tmp_path / 'x.pcap', pcap(FRAMES)[:-10]))
+    assert packets['srcport'].tolist() == [5000, 443, 5000, 443]
+
+    packets = read_capture(write(tmp_path / 'y.pcapng', pcapng(FRAMES)[:-10]))
+    assert packets['srcport'].tolist() == [5000, 443, 5000, 443]
+
+    # Cut off inside the file header
+    assert len(read_capture(write(tmp_path / 'z.pcap', pcap(FRAMES)[:10]))['time']) == 0
@@ -0,0 +1,108 @@
+import json
+
+import numpy as np
+
+from conftest import load_script
+from qlog import parse_qlog, stream_acks, max_acked, SENT, RECEIVED
+
+
+def write_qlog(path, events):
+    qlog = {
+        'qlog_version': 'draft-01',
+        'traces': [{
+            'vantage_point': {'type': 'client'},
+            'configuration': {'time_units': 'ms'},
+            'event_fields': ['relative_time', 'category', 'event', 'data'],
+            'events': events,
+        }],
+    }
+    path.write_text(json.dumps(qlog))
+    return str(path)
+
+
+def packet(time, event_type, packet_type, number, frames):
+    return [str(time), 'transport', event_type, {
+        'packet_type': packet_type,
+        'header': {'packet_number': str(number), 'packet_size': 1200},
+        'frames': frames,
+    }]
+
+
+def stream(offset, length):
+    return {'frame_type': 'stream', 'stream_id': '0', 'offset': str(offset), 'length': str(length)}
+
+
+def ack(begin, end):
+    return {'frame_type': 'ack', 'acked_ranges': [[str(begin), str(end)]]}
+
+
+def mixed_space_qlog(tmp_path):
+    # The Initial ack of pn 0 is sent before 1RTT pn 0 with stream data arrives
+    return write_qlog(tmp_path / 'mixed.qlog', [
+        packet(0, 'packet_sent', 'initial', 0, [{'frame_type': 'crypto', 'offset': '0', 'length': '300'}]),
+        packet(50, 'packet_received', 'initial', 0, [{'frame_type': 'crypto', 'offset': '0', 'length': '100'}]),
+        packet(50.1, 'packet_sent', 'initial', 1, [ack(0, 0)]),
+        packet(100, 'packet_received', '1RTT', 0, [stream(0, 1200)]),
+        packet(103, 'packet_received', '1RTT', 1, [stream(1200, 4800)]),
+        packet(106, 'packet_sent', '1RTT', 2, [ack(0, 1)]),
+    ])
+
+
+def test_max_acked_ignores_other_spaces_and_later_packets(tmp_path):
+    tables = parse_qlog(mixed_space_qlog(tmp_path))
+    frames = tables['frames']
+    packets = tables['packets']
+
+    data = (frames['direction'] == RECEIVED) & (frames['frame_type'] == 'stream')
+    acks = stream_acks(tables, tables['acks']['direction'] == SENT)
+    max_acks = max_acked(acks, packets['packet_number'][frames['packet'][data]],
+                         frames['offset'][data] + frames['length'][data], frames['time'][data])
+
+    assert max_acks == {5: 6000}
+
+
+def test_max_acked_only_counts_arrived_packets():
+    acks = {
+        'packet': np.array([7, 8]),
+        'time': np.array([10, 30]),
+        'begin': np.array([0, 0]),
+        'end': np.array([5, 5]),
+    }
+    max_acks = max_acked(acks, np.array([0, 1, 1]), np.array([100, 200, 300]), np.array([5, 20, 25]))
+
+    # The retransmission of pn 1 at 25 replaces its first copy
+    assert max_acks == {7: 100, 8: 300}
+
+
+def test_ack_analysis_mixed_space_ack(tmp_path):
+    ack_analysis = load_script('ack-analysis')
+    res, _ = ack_analysis.analyze_qlog(mixed_space_qlog(tmp_path))
+
+    assert res['ack_ts'] == {106.0: 6000 / 1024}
+
+
+def test_stream_acks_of_untyped_packets(tmp_path):
+    tables = parse_qlog(write_qlog(tmp_path / 'untyped.qlog', [
+        packet(0, 'packet_sent', '', 0, [stream(0, 100)]),
+        packet(50, 'packet_received', '', 0, [ack(0, 0)]),
+        packet(60, 'packet_received', 'handshake', 1, [ack(0, 0)]),
+    ]))
+
+    acks = stream_acks(tables, tables['acks']['direction'] == RECEIVED)
+    assert acks['packet'].tolist() == [1]
+
+
+def test_times_follow_their_event(tmp_path):
+    qlog = write_qlog(tmp_path / 'times.qlog', [
+        packet(1.5, 'packet_sent', '1RTT', 0, [stream(0, 100)]),
+        packet(2.25, 'packet_received', '1RTT', 0, [ack(0, 0)]),
+        ['3', 'recovery', 'metrics_updated', {'latest_rtt': '0.75'}],
+    ])
+    tables = parse_qlog(qlog)
+
+    assert tables['events']['time'].tolist() == [1500000, 2250000, 3000000]
+    assert tables['frames']['time'].tolist() == [1500000, 2250000]
+    assert tables['acks']['time'].tolist() == [2250000]
+    assert tables['metrics']['time'].tolist() == [3000000]
+    assert tables['metrics']['latest_rtt'].tolist() == [0.75]
+    assert tables['meta']['start'] == 1500000
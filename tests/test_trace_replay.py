@@ -0,0 +1,62 @@
+import subprocess
+import time
+
+import pytest
+
+import trace_replay
+
+
+def build(times: list, rates: list) -> trace_replay.TraceReplayer:
+    schedule = [{'time': t, 'rate': rate, 'delay': None} for t, rate in zip(times, rates)]
+    return trace_replay.TraceReplayer(schedule, {'burst': 10, 'rate': 1000, 'egress': {}},
+                                      direction='egress', dev='eth0')
+
+
+def replay(replayer: trace_replay.TraceReplayer, count: int) -> list:
+    rates = []
+
+    def write(lines):
+        rates.append(float(lines[0].split(' rate ')[1].split('Kbit')[0]))
+        if len(rates) == count:
+            replayer.stopped.set()
+
+    replayer.write = write
+
+    # What start() does, without a tc process
+    replayer.write(replayer.lines(replayer.schedule[0]))
+    replayer.start_time = time.monotonic()
+    replayer.replay()
+
+    return rates
+
+
+def test_first_step_applied_once():
+    # Up to the first step of the second loop
+    assert replay(build([0, 10, 20], [100, 200, 300]), 4) == [100, 200, 300, 100]
+
+
+def test_csv_trace_starts_at_its_first_step():
+    replayer = build([5000, 5010, 5020], [100, 200, 300])
+    assert replayer.period() == 30
+
+    start = time.monotonic()
+    assert replay(replayer, 7) == [100, 200, 300, 100, 200, 300, 100]
+    # Two passes of 30ms, not 5s of waiting for the first timestamp
+    assert time.monotonic() - start < 1
+
+
+def test_failed_step_fails_the_iteration(monkeypatch):
+    popen = subprocess.Popen
+
+    def failing_tc(args, **kwargs):
+        return popen(['sh', '-c', 'cat > /dev/null; echo "Cannot find device eth0" >&2; exit 1'], **kwargs)
+
+    monkeypatch.setattr(trace_replay.subprocess, 'Popen', failing_tc)
+    monkeypatch.setattr(trace_replay.netem, 'netem_args', lambda side: '')
+
+    replayer = build([0, 10], [100, 200])
+    replayer.start()
+    time.sleep(0.05)
+
+    with pytest.raises(Exception, match='Cannot find device eth0'):
+        replayer.stop()
@@ -0,0 +1,213 @@
+import argparse
+import csv
+import json
+import subprocess
+import tempfile
+import threading
+import time
+
+import netem
+
+# Mahimahi traces are lists of ms timestamps, each one a 1500 byte delivery opportunity
+MTU = 1500
+
+# Width of the bins Mahimahi delivery opportunities are averaged over
+BIN_MS = 100
+
+# Wake up this long before a step is due and spin for the rest
+SPIN_S = 0.002
+
+
+def read_mahimahi(path: str, bin_ms: int = BIN_MS) -> list:
+    with open(path, mode='r') as f:
+        opportunities = [int(line) for line in f if line.strip()]
+
+    if len(opportunities) == 0:
+        raise Exception('trace {} is empty'.format(path))
+
+    bins = [0] * (opportunities[-1] // bin_ms + 1)
+    for ts in opportunities:
+        bins[ts // bin_ms] += 1
+
+    return [{
+        'time': i * bin_ms,
+        'rate': count * MTU * 8 / bin_ms,
+        'delay': None,
+    } for i, count in enumerate(bins)]
+
+
+def read_csv(path: str) -> list:
+    # Columns: time (ms), rate (kbit) and optionally delay (ms)
+    schedule = []
+
+    with open(path, mode='r') as f:
+        for row in csv.reader(f):
+            if len(row) == 0 or not row[0].strip().replace('.', '').isdigit():
+                continue
+
+            schedule.append({
+                'time': float(row[0]),
+                'rate': float(row[1]),
+                'delay': float(row[2]) if len(row) > 2 and row[2].strip() else None,
+            })
+
+    if len(schedule) == 0:
+        raise Exception('trace {} is empty'.format(path))
+
+    return sorted(schedule, key=lambda x: x['time'])
+
+
+def read_trace(path: str, bin_ms: int = BIN_MS) -> list:
+    if str(path).endswith('.csv'):
+        return read_csv(path)
+    return read_mahimahi(path, bin_ms)
+
+
+class TraceReplayer:
+    """
+    Replays a rate/delay schedule on top of a netem.py profile while one
+    iteration runs. The schedule restarts at every `start()`, so every
+    client sees the same conditions relative to its own start.
+    """
+
+    def __init__(self, schedule: list, profile: dict, direction: str = 'ingress',
+                 dev: str = netem.DEVICE, ifb: str = netem.IFB, netns: str = None):
+        self.schedule = schedule
+        self.profile = profile
+        self.devices = []
+
+        if direction in ['egress', 'both']:
+            self.devices.append((dev, 'egress'))
+        if direction in ['ingress', 'both']:
+            self.devices.append((ifb, 'ingress'))
+
+        self.netns = netns
+        self.thread = None
+        self.stopped = threading.Event()
+        self.lags = []
+
+    def lines(self, step: dict) -> list:
+        lines = []
+        rate = max(step['rate'], 1)
+        burst = self.profile['burst']
+
+        for dev, side in self.devices:
+            lines.append('class change dev {} parent {} classid {} htb rate {:.1f}Kbit ceil {:.1f}Kbit burst {:.1f}KB cburst {:.1f}KB'.format(
+                dev, netem.ROOT_HANDLE, netem.SHAPED_CLASS, rate, rate, burst, burst))
+
+            # netem change replaces every parameter, so keep the profile's loss
+            if step['delay'] is not None:
+                params = dict(self.profile[side], delay=step['delay'])
+                lines.append('qdisc change dev {} parent {} handle {} netem {}'.format(
+                    dev, netem.SHAPED_CLASS, netem.NETEM_HANDLE, netem.netem_args(params)).rstrip())
+
+        return lines
+
+    def restore_lines(self) -> list:
+        lines = self.lines({'rate': self.profile['rate'], 'delay': None})
+
+        for dev, side in self.devices:
+            lines.append('qdisc change dev {} parent {} handle {} netem {}'.format(
+                dev, netem.SHAPED_CLASS, netem.NETEM_HANDLE, netem.netem_args(self.profile[side])).rstrip())
+
+        return lines
+
+    def start(self):
+        self.stopped.clear()
+        self.lags = []
+
+        # One long-lived tc process avoids a fork per step. Its errors go to a
+        # file, which unlike a pipe never fills up and blocks tc
+        self.errors = tempfile.TemporaryFile(mode='w+')
+        self.process = subprocess.Popen(['tc'] + netem.ns_args(self.netns) + ['-force', '-batch', '-'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                        stderr=self.errors, text=True)
+
+        self.write(self.lines(self.schedule[0]))
+        self.start_time = time.monotonic()
+
+        self.thread = threading.Thread(target=self.replay, daemon=True)
+        self.thread.start()
+
+    def write(self, lines: list):
+        self.process.stdin.write('\n'.join(lines) + '\n')
+        self.process.stdin.flush()
+
+    def period(self) -> float:
+        """Length of one pass of the trace in ms, its last step held for as long as the one before"""
+        times = [x['time'] for x in self.schedule]
+        last = times[-1] - times[-2] if len(times) > 1 else BIN_MS
+        return times[-1] - times[0] + last
+
+    def replay(self):
+        # Traces are replayed relative to their first step, which need not be at 0
+        first = self.schedule[0]['time']
+        duration = self.period()
+        offset = -first
+        # start() already applied the first step
+        steps = self.schedule[1:]
+
+        # Loop the trace until the iteration ends, like Mahimahi
+        while not self.stopped.is_set():
+            for step in steps:
+                deadline = self.start_time + (offset + step['time']) / 1000
+
+                if self.stopped.wait(max(deadline - time.monotonic() - SPIN_S, 0)):
+                    return
+
+                while time.monotonic() < deadline:
+                    pass
+
+                try:
+                    self.write(self.lines(step))
+                except BrokenPipeError:
+                    # tc is gone, stop() reports why
+                    return
+                self.lags.append((time.monotonic() - deadline) * 1000)
+
+            offset += duration
+            steps = self.schedule
+
+    def stop(self) -> dict:
+        self.stopped.set()
+        self.thread.join()
+
+        # Leave the profile's own rate and delay in place between iterations
+        try:
+            self.write(self.restore_lines())
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+
+        self.errors.seek(0)
+        errors = self.errors.read().strip()
+        self.errors.close()
+
+        # A failed step leaves the iteration running under the wrong conditions
+        if self.process.returncode != 0 or len(errors) > 0:
+            raise Exception('trace replay failed, tc exited with {}: {}'.format(
+                self.process.returncode, errors))
+
+        return {
+            'steps': len(self.lags),
+            'mean_lag_ms': sum(self.lags) / len(self.lags) if len(self.lags) > 0 else 0,
+            'max_lag_ms': max(self.lags) if len(self.lags) > 0 else 0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace')
+    parser.add_argument('--bin', type=int, default=BIN_MS,
+                        help='Mahimahi bin width in ms')
+
+    args = parser.parse_args()
+
+    schedule = read_trace(args.trace, args.bin)
+
+    print(json.dumps(schedule, indent=4))
+
+
+if __name__ == "__main__":
+    main()